@@ -0,0 +1,146 @@
+"""
+Benchmark fixtures.
+Run with ``python -m pytest benchmarks`` from the repository root.
+"""
+
+import gc
+import json
+import time
+import tracemalloc
+
+import pytest
+
+from groundhog import sd_fits_io
+from groundhog import sd_fits_sim
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('groundhog benchmarks')
+    group.addoption('--bench-repeat', type=int, default=3,
+                    help='Number of timed runs per benchmark.')
+    group.addoption('--bench-npairs', type=int, default=4,
+                    help='Number of position switched pairs in the synthetic session.')
+    group.addoption('--bench-nint', type=int, default=8,
+                    help='Number of integrations per scan.')
+    group.addoption('--bench-nif', type=int, default=2,
+                    help='Number of spectral windows.')
+    group.addoption('--bench-npol', type=int, default=2,
+                    help='Number of polarizations.')
+    group.addoption('--bench-nfd', type=int, default=1,
+                    help='Number of feeds.')
+    group.addoption('--bench-nchan', type=int, default=4096,
+                    help='Number of channels.')
+    group.addoption('--bench-json', default=None,
+                    help='Save the benchmark results to this JSON file.')
+
+
+class Benchmark:
+    """
+    Times a function and measures its peak memory.
+    The function is timed `repeat` times and then run once more
+    under `tracemalloc`, so the memory tracing does not affect the timing.
+    """
+
+    def __init__(self, name, repeat):
+        self.name = name
+        self.repeat = repeat
+        self.times = []
+        self.peak = None
+
+    def __call__(self, func, *args, setup=None, **kwargs):
+        """
+        Runs `func(*args, **kwargs)`.
+        If `setup` is given, it is called before every run, outside
+        of the measurements, and the tuple it returns is prepended to `args`.
+        """
+
+        def get_args():
+            if setup is None:
+                return args
+            return tuple(setup()) + args
+
+        for i in range(self.repeat):
+            args_ = get_args()
+            gc.collect()
+            t0 = time.perf_counter()
+            result = func(*args_, **kwargs)
+            self.times.append(time.perf_counter() - t0)
+            del result, args_
+
+        args_ = get_args()
+        gc.collect()
+        tracemalloc.start()
+        result = func(*args_, **kwargs)
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return result
+
+    def as_dict(self):
+        return {'name': self.name,
+                'min': min(self.times),
+                'mean': sum(self.times)/len(self.times),
+                'repeat': len(self.times),
+                'peak_mb': self.peak/2**20}
+
+
+_results = []
+
+
+@pytest.fixture
+def bench(request):
+    benchmark = Benchmark(request.node.name, request.config.getoption('--bench-repeat'))
+    yield benchmark
+    if benchmark.peak is not None:
+        _results.append(benchmark.as_dict())
+
+
+@pytest.fixture(scope='session')
+def session_kwargs(request):
+    opt = request.config.getoption
+    return {'npairs': opt('--bench-npairs'),
+            'nint': opt('--bench-nint'),
+            'nif': opt('--bench-nif'),
+            'npol': opt('--bench-npol'),
+            'nfd': opt('--bench-nfd'),
+            'nchan': opt('--bench-nchan'),
+            'seed': 0}
+
+
+@pytest.fixture(scope='session')
+def session_file(tmp_path_factory, session_kwargs):
+    filename = str(tmp_path_factory.mktemp('bench') / 'session.fits')
+    sd_fits_sim.write_ps_session(filename, **session_kwargs)
+    return filename
+
+
+@pytest.fixture
+def sdfits(session_file):
+    return sd_fits_io.read_sdfits(session_file)
+
+
+@pytest.fixture(scope='session')
+def fs_session_file(tmp_path_factory, session_kwargs):
+    # One frequency switched scan per position switched pair.
+    kwargs = dict(session_kwargs)
+    kwargs['nscans'] = kwargs.pop('npairs')
+    filename = str(tmp_path_factory.mktemp('bench') / 'fs_session.fits')
+    sd_fits_io.write_new_sdfits(filename, sd_fits_sim.make_fs_table(**kwargs))
+    return filename
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if len(_results) == 0:
+        return
+
+    tr = terminalreporter
+    tr.section('groundhog benchmarks')
+    width = max(len(r['name']) for r in _results)
+    tr.write_line(f"{'name':<{width}}  {'min (s)':>10}  {'mean (s)':>10}  {'peak (MB)':>10}")
+    for r in _results:
+        tr.write_line(f"{r['name']:<{width}}  {r['min']:10.4f}  {r['mean']:10.4f}  {r['peak_mb']:10.1f}")
+
+    filename = config.getoption('--bench-json')
+    if filename is not None:
+        with open(filename, 'w') as f:
+            json.dump({'results': _results}, f, indent=2)
@@ -0,0 +1,113 @@
+"""
+Benchmarks of the hot paths in groundhog.
+"""
+
+import pytest
+import numpy as np
+
+from groundhog import baseline
+from groundhog import datared
+from groundhog import flagging
+from groundhog import gridding
+from groundhog import mapping
+from groundhog import smoothing
+from groundhog import sd_fits_io
+from groundhog.scan import Scan
+from groundhog.sd_fits import SDFITS
+
+
+def test_read_sdfits(bench, session_file):
+    bench(sd_fits_io.read_sdfits, session_file)
+
+
+def test_read_sdfits_lazy(bench, session_file):
+    bench(sd_fits_io.read_sdfits, session_file, lazy=True)
+
+
+def test_get_scans(bench, sdfits):
+    bench(sdfits.get_scans, [1, 2], ifnum=0, plnum=0)
+
+
+def test_scan_average(bench, sdfits):
+    # Scan.average modifies the scan, so each run gets a new one.
+    def setup():
+        return (sdfits.get_scans(1, ifnum=0, plnum=0),)
+    bench(Scan.average, setup=setup)
+
+
+@pytest.mark.parametrize('method', ['vector', 'gbtidl', 'classic'])
+def test_get_ps(bench, sdfits, method):
+    bench(datared.get_ps, sdfits, 1, ifnum=0, plnum=0, method=method, avgf_min=16)
+
+
+@pytest.mark.parametrize('dtype', [None, 'float32'])
+def test_get_ps_all(bench, session_file, dtype):
+    sdfits = sd_fits_io.read_sdfits(session_file, dtype=dtype)
+    bench(datared.get_ps_all, sdfits, method='gbtidl')
+
+
+def test_get_tcal(bench, sdfits):
+    bench(datared.get_tcal, sdfits, 1, ifnum=0, plnum=0, avgf_min=16)
+
+
+def test_get_tcal_all(bench, sdfits):
+    bench(datared.get_tcal_all, sdfits, 1, avgf_min=16)
+
+
+def test_get_fs_all(bench, fs_session_file):
+    sdfits = sd_fits_io.read_sdfits(fs_session_file)
+    bench(datared.get_fs_all, sdfits, avgf_min=16)
+
+
+def test_map_with_ref(bench, sdfits):
+    ref_scan = datared.prepare_mapping_off(sdfits, 1, ifnum=0, plnum=0)
+    bench(mapping.map_with_ref, sdfits, [2], ref_scan, ifnum=0, plnum=0, avgf_min=16)
+
+
+def test_map_with_refs(bench, sdfits):
+    bench(mapping.map_with_refs, sdfits, [2], [1, 3], interp='linear')
+
+
+def test_grid_cube(bench, sdfits):
+    ref_scan = datared.prepare_mapping_off(sdfits, 1, ifnum=0, plnum=0)
+    table = mapping.map_with_ref(sdfits, [2, 4], ref_scan, ifnum=0, plnum=0).table
+    # Spread the spectra over the map.
+    rng = np.random.default_rng(1)
+    table['CRVAL2'] += rng.uniform(-0.1, 0.1, len(table))
+    table['CRVAL3'] += rng.uniform(-0.1, 0.1, len(table))
+    kernel = gridding.gauss_kernel(0.03)
+    wcs, shape = gridding.make_wcs(table['CRVAL2'], table['CRVAL3'], 0.01, margin=kernel.support)
+    bench(gridding.grid_cube, table, wcs, shape, kernel)
+
+
+def test_subtract_baseline(bench, sdfits):
+    cal = datared.get_ps_all(sdfits, avgf_min=16)
+    data = cal.table[0]['DATA']
+    nchan = data.shape[1]
+    bench(baseline.subtract_baseline, data, order=3, exclude=[(nchan//2 - nchan//10, nchan//2 + nchan//10)])
+
+
+def test_flag_rfi(bench, session_file):
+    # flag_rfi adds to the flags, so each run gets a new copy.
+    def setup():
+        return (sd_fits_io.read_sdfits(session_file),)
+    bench(flagging.flag_rfi, setup=setup)
+
+
+def test_smooth_sdfits(bench, session_file):
+    # smooth_sdfits replaces the tables, so each run gets a new copy.
+    def setup():
+        return (sd_fits_io.read_sdfits(session_file),)
+    bench(smoothing.smooth_sdfits, setup=setup, kind='hanning', width=3, factor=4)
+
+
+def test_update_tcal(bench, session_file):
+    # update_tcal modifies the table, so each run gets a new copy.
+    def setup():
+        return (sd_fits_io.read_sdfits(session_file),)
+    bench(SDFITS.update_tcal, 1, setup=setup, avgf_min=16)
+
+
+def test_write_sdfits(bench, sdfits, tmp_path):
+    filename = str(tmp_path / 'out.fits')
+    bench(sd_fits_io.write_sdfits, filename, sdfits, overwrite=True)
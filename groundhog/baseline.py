@@ -0,0 +1,269 @@
+"""
+Baseline fitting and subtraction.
+
+Baselines are linear models, Legendre polynomials or cubic splines,
+fitted to the line-free channels. All the spectra share the same
+design matrix, so its pseudo-inverse is computed once and fitting a
+block of spectra is a single matrix product. Only the spectra with
+invalid values in the line-free channels are fitted one at a time.
+"""
+
+import numpy as np
+
+from collections import namedtuple
+
+from groundhog import profiling
+from groundhog import sd_fits_utils
+
+
+BaselineModel = namedtuple('BaselineModel', ['design', 'mask', 'pinv'])
+
+
+def line_free_mask(nchan, regions=None, exclude=None):
+    """
+    Selects the line-free channels.
+
+    Parameters
+    ----------
+    nchan : int
+        Number of channels.
+    regions : list, optional
+        (first, last) channel ranges to use, with last exclusive.
+        Defaults to all the channels.
+    exclude : list, optional
+        (first, last) channel ranges to leave out, e.g., the lines.
+
+    Returns
+    -------
+    mask : array
+        True for the line-free channels.
+    """
+
+    if regions is None:
+        mask = np.ones(nchan, dtype=bool)
+    else:
+        mask = np.zeros(nchan, dtype=bool)
+        for c0,c1 in regions:
+            mask[c0:c1] = True
+
+    if exclude is not None:
+        for c0,c1 in exclude:
+            mask[c0:c1] = False
+
+    return mask
+
+
+def poly_design(nchan, order):
+    """
+    Design matrix of a polynomial of degree `order`.
+    Uses Legendre polynomials over the channels scaled
+    to [-1, 1], which are better conditioned than powers.
+    """
+
+    x = np.linspace(-1., 1., nchan)
+
+    return np.polynomial.legendre.legvander(x, order)
+
+
+def spline_design(nchan, nknots, degree=3):
+    """
+    Design matrix of a spline with `nknots` interior knots equally
+    spaced in channel. The basis functions are B-splines of `degree`,
+    evaluated with the Cox-de Boor recursion.
+    """
+
+    x = np.arange(nchan, dtype=float)
+    inner = np.linspace(0., nchan - 1., nknots + 2)
+    t = np.concatenate(([inner[0]]*degree, inner, [inner[-1]]*degree))
+
+    # Degree zero. The last channel belongs to the last interval.
+    basis = ((x[:,np.newaxis] >= t[:-1]) & (x[:,np.newaxis] < t[1:])).astype(float)
+    basis[-1,np.where(t[:-1] < t[1:])[0][-1]] = 1.
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(1, degree + 1):
+            d1 = t[k:-1] - t[:-k-1]
+            d2 = t[k+1:] - t[1:-k]
+            left = np.where(d1 > 0, (x[:,np.newaxis] - t[:-k-1])/d1, 0.)*basis[:,:-1]
+            right = np.where(d2 > 0, (t[k+1:] - x[:,np.newaxis])/d2, 0.)*basis[:,1:]
+            basis = left + right
+
+    return basis
+
+
+def make_model(nchan, order=1, regions=None, exclude=None, kind='poly', nknots=4):
+    """
+    Sets up a baseline model.
+
+    Parameters
+    ----------
+    nchan : int
+        Number of channels.
+    order : int, optional
+        Degree of the polynomial, or of the spline pieces.
+    regions : list, optional
+        (first, last) channel ranges to fit. See `line_free_mask`.
+    exclude : list, optional
+        (first, last) channel ranges to leave out of the fit.
+    kind : {'poly', 'spline'}, optional
+        Polynomial or spline baseline.
+    nknots : int, optional
+        Number of interior knots of the spline.
+
+    Returns
+    -------
+    model : `BaselineModel` object
+        BaselineModel(design, mask, pinv). `design` is the design matrix
+        over all the channels, `mask` the line-free channels and `pinv`
+        the pseudo-inverse of the design matrix over the line-free channels.
+    """
+
+    if kind == 'poly':
+        design = poly_design(nchan, order)
+    elif kind == 'spline':
+        design = spline_design(nchan, nknots, degree=order)
+    else:
+        raise ValueError(f"Unknown baseline kind: {kind}.")
+
+    mask = line_free_mask(nchan, regions=regions, exclude=exclude)
+    if mask.sum() < design.shape[1]:
+        raise ValueError(f"There are {mask.sum()} line-free channels, "
+                         f"but the baseline has {design.shape[1]} parameters.")
+
+    pinv = np.linalg.pinv(design[mask])
+
+    return BaselineModel(design=design, mask=mask, pinv=pinv)
+
+
+@profiling.profiled
+def fit_baseline(data, model):
+    """
+    Fits a baseline model to every row of `data`.
+
+    Parameters
+    ----------
+    data : array
+        Spectra, one per row.
+    model : `BaselineModel` object
+        Baseline model, as returned by `make_model`.
+
+    Returns
+    -------
+    coefs : array
+        Baseline coefficients of each row. They are NaN for rows
+        without enough valid line-free channels.
+    """
+
+    free = np.asarray(np.atleast_2d(data)[:,model.mask], dtype=np.float64)
+    coefs = free @ model.pinv.T
+
+    # Rows with invalid values are fitted using only their valid channels.
+    bad = np.where(~np.all(np.isfinite(free), axis=1))[0]
+    ncoef = model.design.shape[1]
+    design = model.design[model.mask]
+    for r in bad:
+        valid = np.isfinite(free[r])
+        if valid.sum() < ncoef:
+            coefs[r] = np.nan
+        else:
+            coefs[r] = np.linalg.lstsq(design[valid], free[r,valid], rcond=None)[0]
+    profiling.add(rows=len(free), slow_rows=len(bad))
+
+    return coefs
+
+
+def eval_baseline(coefs, model):
+    """
+    Evaluates the baselines with coefficients `coefs` over all the channels.
+    """
+
+    return coefs @ model.design.T
+
+
+def subtract_baseline(data, order=1, regions=None, exclude=None, kind='poly', nknots=4,
+                      chunk=1024, model=None):
+    """
+    Fits and subtracts baselines from a set of spectra.
+
+    Parameters
+    ----------
+    data : array
+        Spectra, one per row.
+    order : int, optional
+        Degree of the polynomial, or of the spline pieces.
+    regions : list, optional
+        (first, last) channel ranges to fit. Defaults to all the channels.
+    exclude : list, optional
+        (first, last) channel ranges to leave out of the fit.
+    kind : {'poly', 'spline'}, optional
+        Polynomial or spline baseline.
+    nknots : int, optional
+        Number of interior knots of the spline.
+    chunk : int, optional
+        Number of rows to fit at a time.
+    model : `BaselineModel` object, optional
+        Baseline model. If given, the previous parameters are not used.
+
+    Returns
+    -------
+    residual : array
+        Spectra with the baselines subtracted. It has the type of `data`.
+    coefs : array
+        Baseline coefficients of each row.
+    """
+
+    shape = np.shape(data)
+    data = np.atleast_2d(data)
+    if model is None:
+        model = make_model(data.shape[-1], order=order, regions=regions, exclude=exclude,
+                           kind=kind, nknots=nknots)
+
+    dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+    residual = np.empty(data.shape, dtype=dtype)
+    coefs = np.empty((len(data), model.design.shape[1]), dtype=np.float64)
+    for r0 in range(0, len(data), chunk):
+        block = data[r0:r0+chunk]
+        coefs[r0:r0+chunk] = fit_baseline(block, model)
+        residual[r0:r0+chunk] = block - eval_baseline(coefs[r0:r0+chunk], model)
+
+    if len(shape) == 1:
+        return residual[0], coefs[0]
+
+    return residual, coefs
+
+
+@profiling.profiled
+def subtract_baseline_sdfits(sdfits, order=1, regions=None, exclude=None, kind='poly',
+                             nknots=4, chunk=1024):
+    """
+    Fits and subtracts baselines from all the rows of an SDFITS object,
+    e.g., the output of `groundhog.datared.get_ps_all`.
+    The tables are read and updated in place `chunk` rows at a time,
+    so they must be writable.
+    Only the channels inside the channel window of each table are used.
+    Flagged values are left out of the fits, but their baselines
+    are subtracted too. Rows without enough valid line-free channels
+    for a fit are left unchanged.
+    See `subtract_baseline` for the parameters.
+    """
+
+    for i in range(sdfits.numtab):
+
+        table = sdfits.table[i]
+        window = sdfits.chan_window[i]
+        sl = sd_fits_utils.chan_slice(window)
+        model = make_model(sdfits.get_nchan(i), order=order, regions=regions,
+                           exclude=exclude, kind=kind, nknots=nknots)
+
+        data = table['DATA']
+        for r0 in range(0, len(table), chunk):
+            rows = np.arange(r0, min(r0 + chunk, len(table)))
+            flagged = sd_fits_utils.read_data(table, rows, window=window, flags=sdfits.flags[i],
+                                              dtype=np.float64)
+            coefs = fit_baseline(flagged, model)
+            fitted = np.all(np.isfinite(coefs), axis=1)
+            rows = rows[fitted]
+            data[rows,sl] = np.asarray(data[rows,sl], dtype=np.float64) - \
+                            eval_baseline(coefs[fitted], model)
+
+        sdfits.history.append([i, 'BASELINE', [kind, order, nknots, regions, exclude]])
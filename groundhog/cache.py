@@ -0,0 +1,302 @@
+"""
+On-disk cache of derived calibration products.
+
+Products are stored as .npz files named after a hash of the input
+files (path, size and modification time), the changes made to the
+SDFITS object since it was read, its processing state (floating point
+type, channel windows and flags), the function and its arguments.
+The least recently used products are removed when the cache grows
+beyond its size limit.
+"""
+
+import os
+import json
+import time
+import hashlib
+import inspect
+import functools
+
+import numpy as np
+
+
+def default_directory():
+    """
+    Default cache directory.
+    Set by the ``GROUNDHOG_CACHE`` environment variable,
+    ``~/.cache/groundhog`` otherwise.
+    """
+
+    return os.environ.get('GROUNDHOG_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'groundhog'))
+
+
+def file_signature(filename):
+    """
+    Identifies the contents of `filename` by its
+    absolute path, size and modification time.
+    """
+
+    stat = os.stat(filename)
+
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
+
+
+class Cache:
+    """
+    Size bounded cache of arrays stored as .npz files.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Where to store the cached products.
+        Defaults to `default_directory`.
+    max_bytes : int, optional
+        Maximum size of the cache in bytes.
+        The least recently used products are removed to stay below it.
+    """
+
+    def __init__(self, directory=None, max_bytes=2**30):
+
+        if directory is None:
+            directory = default_directory()
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+
+    def _entries(self):
+        """
+        Cached files sorted from least to most recently used.
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        return sorted(entries)
+
+
+    @staticmethod
+    def make_key(name, files, params):
+        """
+        Hash of the function `name`, the signature of
+        the input `files` and the function `params`.
+        """
+
+        content = json.dumps([name, files, params], sort_keys=True, default=str)
+
+        return hashlib.sha1(content.encode()).hexdigest()
+
+
+    def get(self, key):
+        """
+        Loads the arrays stored under `key`.
+        Returns None if `key` is not in the cache.
+        """
+
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = {k: npz[k] for k in npz.files if k != '__info__'}
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        # Mark as recently used.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return arrays
+
+
+    def put(self, key, arrays, info=None):
+        """
+        Stores a dictionary of `arrays` under `key`.
+
+        Parameters
+        ----------
+        key : str
+            Key of the product, as returned by `make_key`.
+        arrays : dict
+            Arrays to store.
+        info : dict, optional
+            Description of the product. Returned by `info`.
+        """
+
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, __info__=json.dumps(info, default=str), **arrays)
+        os.replace(tmp, path)
+
+        self.evict()
+
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used products until the
+        cache is smaller than `max_bytes`, by default `Cache.max_bytes`.
+        """
+
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        for mtime,nbytes,path in entries:
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+
+
+    def info(self):
+        """
+        Describes the cached products.
+
+        Returns
+        -------
+        info : list of dict
+            For each product, its key, size in bytes, last time it was used
+            and the function, files and arguments used to compute it.
+            Sorted from least to most recently used.
+        """
+
+        out = []
+        for mtime,nbytes,path in self._entries():
+            try:
+                with np.load(path, allow_pickle=False) as npz:
+                    info = json.loads(str(npz['__info__']))
+            except (FileNotFoundError, ValueError, OSError, KeyError):
+                info = None
+            entry = {'key': os.path.basename(path)[:-4], 'bytes': nbytes,
+                     'last_used': time.ctime(mtime)}
+            if isinstance(info, dict):
+                entry.update(info)
+            out.append(entry)
+
+        return out
+
+
+    def invalidate(self, filename=None, name=None):
+        """
+        Removes cached products.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Only remove the products derived from this file.
+        name : str, optional
+            Only remove the products of this function,
+            e.g., ``'datared.get_tcal'``.
+            If neither `filename` nor `name` are given,
+            the cache is cleared.
+        """
+
+        if filename is not None:
+            filename = os.path.abspath(filename)
+
+        for entry in self.info():
+            if filename is not None and \
+               filename not in [f[0] for f in entry.get('files', [])]:
+                continue
+            if name is not None and entry.get('name') != name:
+                continue
+            try:
+                os.remove(self._path(entry['key']))
+            except FileNotFoundError:
+                pass
+
+
+    def clear(self):
+        """
+        Removes all the cached products.
+        """
+
+        self.invalidate()
+
+
+def object_state(sdfits):
+    """
+    State of an SDFITS object that changes the derived products:
+    the floating point type used to process the spectra,
+    and the channel window and flags of each table.
+    """
+
+    dtype = getattr(sdfits, 'dtype', None)
+    windows = getattr(sdfits, 'chan_window', {})
+    flags = getattr(sdfits, 'flags', {})
+
+    return ['STATE', None if dtype is None else np.dtype(dtype).name,
+            [windows[i] for i in sorted(windows)],
+            [flags[i].digest() for i in sorted(flags)]]
+
+
+def cached(pack, unpack):
+    """
+    Decorator that adds a `cache` argument to a function whose
+    first argument is a `groundhog.sd_fits.SDFITS` object.
+    If `cache` is a `Cache`, the result is looked up in it and
+    computed and stored only when it is missing.
+    Objects without a file, e.g., built in memory, are not cached.
+
+    Parameters
+    ----------
+    pack : callable
+        Converts the result of the function to a dictionary of arrays.
+        If it returns None the result is not stored.
+    unpack : callable
+        Converts a dictionary of arrays back to the result of the function.
+    """
+
+    def decorator(func):
+
+        name = f"{func.__module__.replace('groundhog.', '')}.{func.__qualname__}"
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(sdfits, *args, cache=None, **kwargs):
+
+            filename = getattr(sdfits, 'filename', None)
+            if cache is None or filename is None:
+                return func(sdfits, *args, **kwargs)
+
+            bound = signature.bind(sdfits, *args, **kwargs)
+            bound.apply_defaults()
+            params = dict(list(bound.arguments.items())[1:])
+            params = {k: np.asarray(v).tolist() if isinstance(v, np.ndarray) else v
+                      for k,v in params.items()}
+            files = [file_signature(f) for f in np.atleast_1d(filename)]
+            key = Cache.make_key(name, files + list(sdfits.history) + [object_state(sdfits)], 
+                                 params)
+
+            arrays = cache.get(key)
+            if arrays is not None:
+                return unpack(arrays)
+
+            result = func(sdfits, *args, **kwargs)
+            arrays = pack(result)
+            if arrays is not None:
+                cache.put(key, arrays, info={'name': name, 'files': files, 'params': params})
+
+            return result
+
+        return wrapper
+
+    return decorator
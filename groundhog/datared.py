@@ -2,16 +2,35 @@
 Data reduction functions.
 """
 
+import io
 import warnings
+import functools
 import numpy as np
 
+from collections import namedtuple
+
+from astropy.io import fits
+from astropy import units as u
+
 from groundhog import utils
+from groundhog import cache
+from groundhog import profiling
+from groundhog import sd_fits
 from groundhog.scan import Scan
+from groundhog import smoothing
 from groundhog import sd_fits_utils
 from groundhog import spectral_axis
 from groundhog.fluxscales import calibrators
 
 
+# Reference spectra of a map, one per scan, spectral window, polarization and feed.
+MapRefs = namedtuple('MapRefs', ['keys', 'mjd', 'data', 'tsys', 'exposure'])
+# Rows of the source and reference scans, with the noise diode on and off,
+# of a set of groups, loaded by `_load_cal_groups`.
+CalGroups = namedtuple('CalGroups', ['tcal', 'rows', 'starts', 'group_id', 'data', 'tint', 
+                                     'avg', 'freq_axis'])
+
+
 def gbtidl_sigref2ta(sig, ref, tsys):
     """
     """
@@ -27,7 +46,8 @@ def gbtidl_tsys(ref_on, ref_off, tcal):
     ch0 = int(nchan*0.1)
     chf = -int(nchan*0.1) + 1 # Python indexing is exclusive, IDL inclusive.
     
-    return tcal*np.average(ref_off[:,ch0:chf], axis=1)/np.average(ref_on[:,ch0:chf] - ref_off[:,ch0:chf], axis=1) + tcal/2.
+    # Accumulate the averages in float64, even for float32 spectra.
+    return tcal*np.nanmean(ref_off[:,ch0:chf], axis=1, dtype=np.float64)/np.nanmean(ref_on[:,ch0:chf] - ref_off[:,ch0:chf], axis=1, dtype=np.float64) + tcal/2.
 
 
 def classic_tsys(ref_on, ref_off, tcal):
@@ -38,9 +58,14 @@ def classic_tsys(ref_on, ref_off, tcal):
     ch0 = int(nchan*0.1)
     chf = -int(nchan*0.1) + 1 # Python indexing is exclusive.
     
-    tsys_tcal = (ref_on + ref_off - np.average((ref_on + ref_off)[:,ch0:chf], axis=1)[:,np.newaxis])/(2.*np.average((ref_on + ref_off)[:,ch0:chf], axis=1)[:,np.newaxis])
+    # Accumulate the averages in float64, even for float32 spectra.
+    # The average of (ref - ref_avg)/(2*ref_avg) over channels is
+    # computed from the average of ref, without the intermediate array.
+    ref = ref_on + ref_off
+    ref_avg = np.nanmean(ref[:,ch0:chf], axis=1, dtype=np.float64)
+    tsys_tcal = (np.nanmean(ref, axis=1, dtype=np.float64) - ref_avg)/(2.*ref_avg)
     
-    return tcal*np.average(tsys_tcal, axis=1)
+    return tcal*tsys_tcal
 
 
 def get_kappa(tcal_on, tcal_off, avgf=1):
@@ -53,8 +78,10 @@ def get_kappa(tcal_on, tcal_off, avgf=1):
         Power with the noise diode on.
     tcal_off : array
         Power with the noise diode off.
-    avgf : int
+    avgf : float
         Average the ratio `tcal_on/tcal_off` by this amount.
+        It does not need to divide the number of channels,
+        see `groundhog.smoothing.decimate`.
     
     Returns
     -------
@@ -62,17 +89,38 @@ def get_kappa(tcal_on, tcal_off, avgf=1):
         Kappa factor as defined by Eq. (14) in Winkel et al. 2012.
     """
     
-    nchan = len(tcal_on)
-    
     # Compute the kappa factor (Winkel et al. 2012).
     off_ratio = tcal_on/tcal_off
     # Average in frequency to increase the SNR.
-    off_ratio = off_ratio.reshape(nchan//avgf, avgf).mean(axis=1)
-    kappa = np.ma.power(off_ratio - 1., -1.)  
+    # Blocks without valid channels are NaN.
+    off_ratio = smoothing.decimate(off_ratio, avgf)
+    with np.errstate(divide='ignore'):
+        kappa = utils.invalid_to_nan(np.power(off_ratio - 1., -1.))
     
     return kappa
     
 
+def get_kappa_avgf(nchan, avgf_min):
+    """
+    Number of channels to average when computing the kappa factor.
+    Uses the smallest divisor of `nchan` not smaller than `avgf_min`,
+    so every block has the same channels, unless it is larger than 
+    twice `avgf_min`. Then it uses `avgf_min`.
+    It is at most `nchan`.
+    """
+    
+    if nchan <= avgf_min:
+        return nchan
+    
+    facs = utils.factors(nchan)
+    avgf = np.min(facs[facs >= avgf_min])
+    if avgf < 2*avgf_min:
+        return avgf
+    
+    return avgf_min
+
+
+@profiling.profiled
 def get_ps(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0, method='vector', avgf_min=256):
     """
     
@@ -96,7 +144,7 @@ def get_ps(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0, method='vector'
     
     """
 
-    ps_scan = sdfits.get_scans(scan, ifnum=ifnum, intnum=intnum, plnum=plnum)
+    ps_scan = sdfits.get_scans(scan, ifnum=ifnum, intnum=intnum, plnum=plnum, fdnum=fdnum)
     rows = ps_scan.table
     obsmode = rows["OBSMODE"]
     last_on = rows["LASTON"]
@@ -113,10 +161,16 @@ def get_ps(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0, method='vector'
     
     scan_on, scan_off = utils.get_ps_scan_pair(scan, procnum, procname)
     
-    sou_on = sdfits.get_scans(scan_on, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum)
-    sou_off = sdfits.get_scans(scan_on, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum)
-    off_on = sdfits.get_scans(scan_off, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum)
-    off_off = sdfits.get_scans(scan_off, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum)
+    sou_on = sdfits.get_scans(scan_on, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                              fdnum=fdnum)
+    sou_off = sdfits.get_scans(scan_on, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                               fdnum=fdnum)
+    off_on = sdfits.get_scans(scan_off, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                              fdnum=fdnum)
+    off_off = sdfits.get_scans(scan_off, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                               fdnum=fdnum)
+    
+    dtype = sdfits.dtype
     
     if method == 'vector':
         
@@ -124,20 +178,24 @@ def get_ps(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0, method='vector'
         sou_off.average()
         off_on.average()
         off_off.average()
-        off_freq = off_off.freq
-        sou_freq = sou_on.freq
+        sou_freq = spectral_axis.eval_freq_axis(sou_on.freq_axis)
         
         nchan = off_on.data.shape[0]
-        facs = utils.factors(nchan)
-        avgf = np.min(facs[facs >= avgf_min])
+        avgf = get_kappa_avgf(nchan, avgf_min)
         
-        kappa_off = get_kappa(off_on.data, off_off.data, avgf=avgf)
-        kappa_freq = off_freq.reshape(nchan//avgf, avgf).mean(axis=1)
+        with profiling.stage('datared.kappa'):
+            kappa_off = get_kappa(off_on.data, off_off.data, avgf=avgf)
+            kappa_freq = spectral_axis.block_freq_axis(off_off.freq_axis, avgf)
         
         # Interpolate back to high frequency resolution.
-        pt = np.argsort(kappa_freq)
-        pi = np.argsort(sou_freq)
-        kappa_interp = np.interp(sou_freq.to('Hz').value[pi], kappa_freq.to('Hz').value[pt], kappa_off)
+        with profiling.stage('datared.kappa_interp'):
+            pt = np.argsort(kappa_freq)
+            pi = np.argsort(sou_freq)
+            kappa_interp = np.interp(sou_freq[pi], kappa_freq[pt], kappa_off)
+        
+        # Keep the products in the precision of the spectra.
+        kappa_interp = utils.as_dtype(kappa_interp, dtype)
+        tcal = utils.as_dtype(tcal, dtype)
         
         # Compute the source temperature (Eq. (16) in Winkel et al. 2012).
         tsou_on = (kappa_interp + 1.)*tcal*(sou_on.data - off_on.data)/off_on.data
@@ -152,34 +210,831 @@ def get_ps(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0, method='vector'
         tsys = gbtidl_tsys(off_on.data, off_off.data, tcal)
         sig = 0.5*(sou_on.data + sou_off.data)
         ref = 0.5*(off_on.data + off_off.data)
-        ta = gbtidl_sigref2ta(sig, ref, tsys)
+        ta = gbtidl_sigref2ta(sig, ref, utils.as_dtype(tsys, dtype))
         tint_sou = 0.5*(sou_on.table["EXPOSURE"] + sou_off.table["EXPOSURE"])
         tint_off = 0.5*(off_on.table["EXPOSURE"] + off_off.table["EXPOSURE"])
         tint = 0.5*(tint_sou + tint_off)
         dnu = np.mean(sou_on.table["CDELT1"])
-        tsou = np.average(ta, axis=0, weights=dnu*tint*np.power(tsys, -2.))
+        weights = dnu*tint*np.power(tsys, -2.)
+        tsou = utils.chunked_average(ta, weights, dtype=dtype or np.float64)
         
     elif method == 'classic':
         tsys = classic_tsys(off_on.data, off_off.data, tcal)
-        ta_on = (sou_on.data - off_on.data)/off_on.data*(tsys[:,np.newaxis] + tcal)
-        ta_off = (sou_off.data - off_off.data)/off_off.data*(tsys[:,np.newaxis])
+        ta_on = (sou_on.data - off_on.data)/off_on.data*utils.as_dtype(tsys[:,np.newaxis] + tcal, dtype)
+        ta_off = (sou_off.data - off_off.data)/off_off.data*utils.as_dtype(tsys[:,np.newaxis], dtype)
         tint_sou = 0.5*(sou_on.table["EXPOSURE"] + sou_off.table["EXPOSURE"])
         tint_off = 0.5*(off_on.table["EXPOSURE"] + off_off.table["EXPOSURE"])
         tint = 0.5*(tint_sou + tint_off)
         dnu = np.mean(sou_on.table["CDELT1"])
-        ta_on = np.average(ta_on, axis=0, weights=dnu*tint_sou*np.power(tsys, -2.))
-        ta_off = np.average(ta_off, axis=0, weights=dnu*tint_off*np.power(tsys, -2.))
+        ta_on = utils.chunked_average(ta_on, dnu*tint_sou*np.power(tsys, -2.), dtype=dtype or np.float64)
+        ta_off = utils.chunked_average(ta_off, dnu*tint_off*np.power(tsys, -2.), dtype=dtype or np.float64)
         tsou = 0.5*(ta_on + ta_off)
         
     return tsou
 
 
-def get_tcal(sdfits, scan, ifnum=0, intnum=None, plnum=0, scale="Perley-Butler 2017", units="K",
-             avgf_min=16):
+@profiling.profiled
+def get_ps_all(sdfits, ifnum=None, plnum=None, fdnum=None, method='vector', avgf_min=256,
+               chunk=None, writer=None):
+    """
+    Calibrates all the position switched pairs (OnOff or OffOn)
+    in an SDFITS object. The pairs, spectral windows, polarizations
+    and feeds are calibrated together using the same equations as `get_ps`.
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the observations.
+    ifnum : list, optional
+        Spectral windows to calibrate.
+        Will process all spectral windows by default.
+    plnum : list, optional
+        Polarizations to calibrate.
+        Will process all polarizations by default.
+    fdnum : list, optional
+        Feeds to calibrate.
+        Will process all feeds by default.
+    method : {'vector', 'gbtidl', 'classic'}, optional
+        Method used to compute the source temperature.
+        See `get_ps`.
+    avgf_min : int, optional
+        Minimum number of channels to average together when
+        computing the kappa factor. Only used if ``method='vector'``.
+    chunk : int, optional
+        Number of pairs to calibrate at a time.
+        Will calibrate all the pairs in a table at once by default.
+    writer : `groundhog.sd_fits_io.SDFITSWriter`, optional
+        If given, the calibrated rows are written to it as
+        each chunk is calibrated, and nothing is returned.
+    
+    Returns
+    -------
+    cal_sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with one calibrated row for every pair, 
+        spectral window, polarization and feed.
+        TCAL is averaged over the first scan of each pair.
+    """
+    
+    return _calibrate_all(sdfits, sd_fits_utils.get_ps_pairs, 
+                          functools.partial(_get_ps_groups, ifnum=ifnum, plnum=plnum, fdnum=fdnum),
+                          functools.partial(_calibrate_ps_groups, method=method, avgf_min=avgf_min),
+                          chunk=chunk, writer=writer)
+
+
+@profiling.profiled
+def get_fs(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0, method='vector', avgf_min=256,
+           fold=True):
+    """
+    Calibrates a frequency switched scan.
+    Each switching state is calibrated using the other one as
+    reference, and the two results are aligned and averaged (folded).
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the observations.
+    scan : int
+        Scan number.
+    ifnum : int, optional
+        Spectral window number.
+    intnum : list, optional
+        Integrations to use. All by default.
+    plnum : int, optional
+        Polarization number.
+    fdnum : int, optional
+        Feed number.
+    method : {'vector', 'gbtidl', 'classic'}, optional
+        Method used to compute the source temperature.
+        See `get_ps`.
+    avgf_min : int, optional
+        Minimum number of channels to average together when
+        computing the kappa factor. Only used if ``method='vector'``.
+    fold : bool, optional
+        Fold the two switching states? If False, only the
+        state with SIG='T' is returned.
+    
+    Returns
+    -------
+    tsou : array
+        Calibrated spectrum, in the channels of the state with SIG='T'.
+        Channels only covered by one of the states
+        only have the contribution from that state.
+    """
+    
+    for i in sdfits.scan_tables.get(scan, []):
+        groups, _ = _get_fs_groups(sdfits.index[i], [scan], ifnum=[ifnum], plnum=[plnum], 
+                                   fdnum=[fdnum])
+        if len(groups) > 0:
+            cal_table = _calibrate_fs_groups(sdfits.table[i], _select_integrations(groups, intnum),
+                                             method=method, avgf_min=avgf_min, dtype=sdfits.dtype,
+                                             window=sdfits.chan_window[i], flags=sdfits.flags[i],
+                                             fold=fold)
+            return cal_table['DATA'][0]
+    
+    raise ValueError(f"Scan {scan} with ifnum={ifnum}, plnum={plnum} and fdnum={fdnum} "
+                     f"has no frequency switched data.")
+
+
+@profiling.profiled
+def get_fs_all(sdfits, scans=None, ifnum=None, plnum=None, fdnum=None, method='vector', 
+               avgf_min=256, fold=True, chunk=None, writer=None):
+    """
+    Calibrates all the frequency switched scans in an SDFITS object.
+    The scans, spectral windows, polarizations and feeds are 
+    calibrated together using the same equations as `get_fs`.
+    When the frequency offset between the switching states is a whole
+    number of channels, the states are aligned by slicing, otherwise
+    by linear interpolation between channels.
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the observations.
+    scans : list, optional
+        Scans to calibrate. All the frequency switched scans by default.
+    ifnum : list, optional
+        Spectral windows to calibrate. All by default.
+    plnum : list, optional
+        Polarizations to calibrate. All by default.
+    fdnum : list, optional
+        Feeds to calibrate. All by default.
+    method : {'vector', 'gbtidl', 'classic'}, optional
+        Method used to compute the source temperature.
+        See `get_ps`.
+    avgf_min : int, optional
+        Minimum number of channels to average together when
+        computing the kappa factor. Only used if ``method='vector'``.
+    fold : bool, optional
+        Fold the two switching states? See `get_fs`.
+    chunk : int, optional
+        Number of scans to calibrate at a time.
+        Will calibrate all the scans in a table at once by default.
+    writer : `groundhog.sd_fits_io.SDFITSWriter`, optional
+        If given, the calibrated rows are written to it as
+        each chunk is calibrated, and nothing is returned.
+    
+    Returns
+    -------
+    cal_sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with one calibrated row for every scan, 
+        spectral window, polarization and feed. The rows
+        have the frequency axis of the state with SIG='T'.
+    """
+    
+    def get_scans(meta):
+        fs_scans = sd_fits_utils.get_fs_scans(meta)
+        if scans is None:
+            return fs_scans
+        return [scan for scan in fs_scans if scan in np.atleast_1d(scans)]
+    
+    return _calibrate_all(sdfits, get_scans, 
+                          functools.partial(_get_fs_groups, ifnum=ifnum, plnum=plnum, fdnum=fdnum),
+                          functools.partial(_calibrate_fs_groups, method=method, avgf_min=avgf_min,
+                                            fold=fold),
+                          chunk=chunk, writer=writer)
+
+
+@profiling.profiled
+def get_nod(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=(0, 1), method='vector', 
+            avgf_min=256):
+    """
+    Calibrates a pair of nodding scans.
+    Each feed is calibrated using the scan where the source 
+    is in the other feed as reference, and the two feeds are averaged.
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the observations.
+    scan : int
+        One of the scans of the nodding pair.
+    ifnum : int, optional
+        Spectral window number.
+    intnum : list, optional
+        Integrations to use. All by default.
+    plnum : int, optional
+        Polarization number.
+    fdnum : tuple, optional
+        Feeds with the source in the first and second scans of the pair.
+    method : {'vector', 'gbtidl', 'classic'}, optional
+        Method used to compute the source temperature.
+        See `get_ps`.
+    avgf_min : int, optional
+        Minimum number of channels to average together when
+        computing the kappa factor. Only used if ``method='vector'``.
+    
+    Returns
+    -------
+    tsou : array
+        Calibrated spectrum.
+    """
+    
+    for i in sdfits.scan_tables.get(scan, []):
+        pairs = [pair for pair in sd_fits_utils.get_nod_pairs(sdfits.meta[i]) if scan in pair]
+        groups, _ = _get_nod_groups(sdfits.index[i], pairs[:1], ifnum=[ifnum], plnum=[plnum],
+                                    fdnum=fdnum)
+        if len(groups) > 0:
+            cal_table = _calibrate_nod_groups(sdfits.table[i], _select_integrations(groups, intnum),
+                                              method=method, avgf_min=avgf_min, dtype=sdfits.dtype,
+                                              window=sdfits.chan_window[i], flags=sdfits.flags[i])
+            return cal_table['DATA'][0]
+    
+    raise ValueError(f"Scan {scan} with ifnum={ifnum}, plnum={plnum} and fdnum={fdnum} "
+                     f"is not part of a nodding procedure.")
+
+
+@profiling.profiled
+def get_nod_all(sdfits, ifnum=None, plnum=None, fdnum=(0, 1), method='vector', avgf_min=256,
+                chunk=None, writer=None):
+    """
+    Calibrates all the nodding pairs in an SDFITS object.
+    The pairs, spectral windows and polarizations are calibrated 
+    together using the same equations as `get_nod`.
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the observations.
+    ifnum : list, optional
+        Spectral windows to calibrate. All by default.
+    plnum : list, optional
+        Polarizations to calibrate. All by default.
+    fdnum : tuple, optional
+        Feeds with the source in the first and second scans of each pair.
+    method : {'vector', 'gbtidl', 'classic'}, optional
+        Method used to compute the source temperature.
+        See `get_ps`.
+    avgf_min : int, optional
+        Minimum number of channels to average together when
+        computing the kappa factor. Only used if ``method='vector'``.
+    chunk : int, optional
+        Number of pairs to calibrate at a time.
+        Will calibrate all the pairs in a table at once by default.
+    writer : `groundhog.sd_fits_io.SDFITSWriter`, optional
+        If given, the calibrated rows are written to it as
+        each chunk is calibrated, and nothing is returned.
+    
+    Returns
+    -------
+    cal_sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with one calibrated row for every pair, 
+        spectral window and polarization. The rows have 
+        the metadata of the first feed in `fdnum`.
+    """
+    
+    return _calibrate_all(sdfits, sd_fits_utils.get_nod_pairs, 
+                          functools.partial(_get_nod_groups, ifnum=ifnum, plnum=plnum, fdnum=fdnum),
+                          functools.partial(_calibrate_nod_groups, method=method, avgf_min=avgf_min),
+                          chunk=chunk, writer=writer)
+
+
+def _calibrate_all(sdfits, get_procs, get_groups, calibrate, chunk=None, writer=None):
+    """
+    Calibrates all the procedures of an SDFITS object, `chunk` at a time.
+    `get_procs` finds the procedures, pairs or scans, in the metadata of a table,
+    `get_groups` finds the groups of rows of some procedures in the row index, and
+    `calibrate` returns a table with the calibrated groups.
+    See `get_ps_all` for the other parameters.
+    """
+    
+    tables = []
+    headers = []
+    
+    for i in range(sdfits.numtab):
+        
+        procs = get_procs(sdfits.meta[i])
+        
+        if chunk is None:
+            chunk_ = max(len(procs), 1)
+        else:
+            chunk_ = chunk
+        
+        cal_tables = []
+        for j in range(0, len(procs), chunk_):
+            
+            groups, _ = get_groups(sdfits.index[i], procs[j:j+chunk_])
+            
+            if len(groups) == 0:
+                continue
+            
+            cal_table = calibrate(sdfits.table[i], groups, dtype=sdfits.dtype, 
+                                  window=sdfits.chan_window[i], flags=sdfits.flags[i])
+            
+            if writer is not None:
+                writer.write(cal_table, header=sdfits.header[i])
+            else:
+                cal_tables.append(cal_table)
+        
+        if writer is not None:
+            # Each table goes to its own extension.
+            writer.new_table()
+        elif len(cal_tables) > 0:
+            tables.append(sd_fits_utils.concatenate_tables(cal_tables))
+            headers.append(sdfits.header[i].copy())
+    
+    if writer is not None:
+        return
+    
+    table = np.empty(len(tables), dtype=object)
+    table[:] = tables
+    header = np.empty(len(headers), dtype=object)
+    header[:] = headers
+    
+    return sd_fits.SDFITS(table, header, phead=sdfits.phead, pheads=sdfits.pheads)
+
+
+def _get_setups(index, ifnum=None, plnum=None, fdnum=None):
+    """
+    Spectral window, polarization and feed combinations in a row index.
+    """
+    
+    keys = index.keys
+    sel = np.ones(len(keys), dtype=bool)
+    for col,vals in zip(['IFNUM', 'PLNUM', 'FDNUM'], [ifnum, plnum, fdnum]):
+        if vals is not None:
+            sel &= np.isin(keys[col], vals)
+    
+    return np.unique(np.asarray(keys)[sel][['IFNUM', 'PLNUM', 'FDNUM']]).tolist()
+
+
+def _lookup_rows(index, lookup, scan, ifnum, plnum, fdnum, sigs, cals):
+    """
+    Rows of a scan, spectral window, polarization and feed with any
+    of the signal states in `sigs` and noise diode states in `cals`.
+    `lookup` maps the keys of the row index to their group.
+    """
+    
+    gs = [lookup[k] for k in [(scan, ifnum, plnum, fdnum, sig, cal) for sig in sigs for cal in cals] if k in lookup]
+    if len(gs) == 0:
+        return np.array([], dtype=int)
+    
+    return np.sort(np.concatenate([index.rows[index.offsets[g]:index.offsets[g+1]] for g in gs]))
+
+
+def _select_integrations(groups, intnum=None):
+    """
+    Keeps the integrations `intnum` of the source and reference rows of each group.
+    """
+    
+    if intnum is None:
+        return groups
+    
+    return [[g[k][intnum] for k in range(4)] + list(g[4:]) for g in groups]
+
+
+def _get_ps_groups(index, pairs, ifnum=None, plnum=None, fdnum=None):
+    """
+    Finds the rows of each position switched pair, spectral window, 
+    polarization and feed.
+    Each group is a list with the rows of the source with the noise diode
+    on and off, the rows of the reference with the noise diode on and off, 
+    and the rows used to average TCAL.
+    Also returns the spectral window, polarization and feed of each group.
+    """
+    
+    setups = _get_setups(index, ifnum=ifnum, plnum=plnum, fdnum=fdnum)
+    
+    lookup = sd_fits_utils.get_index_groups(index)
+    
+    def rows(*key):
+        return _lookup_rows(index, lookup, *key)
+    
+    groups = []
+    group_setups = []
+    for scan_on,scan_off in pairs:
+        for ifnum_,plnum_,fdnum_ in setups:
+            group = [rows(scan_on, ifnum_, plnum_, fdnum_, 'T', 'T'),
+                     rows(scan_on, ifnum_, plnum_, fdnum_, 'T', 'F'),
+                     rows(scan_off, ifnum_, plnum_, fdnum_, 'T', 'T'),
+                     rows(scan_off, ifnum_, plnum_, fdnum_, 'T', 'F'),
+                     rows(min(scan_on, scan_off), ifnum_, plnum_, fdnum_, 'TF', 'TF')]
+            if np.all([len(g) > 0 for g in group]):
+                groups.append(group)
+                group_setups.append((ifnum_, plnum_, fdnum_))
+    
+    return groups, group_setups
+
+
+def _get_fs_groups(index, scans, ifnum=None, plnum=None, fdnum=None):
+    """
+    Finds the rows of each frequency switched scan, spectral window,
+    polarization and feed. The groups are as in `_get_ps_groups`, with 
+    the rows with SIG='T' as source and the rows with SIG='F' as reference.
+    """
+    
+    setups = _get_setups(index, ifnum=ifnum, plnum=plnum, fdnum=fdnum)
+    
+    lookup = sd_fits_utils.get_index_groups(index)
+    
+    def rows(*key):
+        return _lookup_rows(index, lookup, *key)
+    
+    groups = []
+    group_setups = []
+    for scan in scans:
+        for ifnum_,plnum_,fdnum_ in setups:
+            group = [rows(scan, ifnum_, plnum_, fdnum_, 'T', 'T'),
+                     rows(scan, ifnum_, plnum_, fdnum_, 'T', 'F'),
+                     rows(scan, ifnum_, plnum_, fdnum_, 'F', 'T'),
+                     rows(scan, ifnum_, plnum_, fdnum_, 'F', 'F'),
+                     rows(scan, ifnum_, plnum_, fdnum_, 'TF', 'TF')]
+            if np.all([len(g) > 0 for g in group]):
+                groups.append(group)
+                group_setups.append((ifnum_, plnum_, fdnum_))
+    
+    return groups, group_setups
+
+
+def _get_nod_groups(index, pairs, ifnum=None, plnum=None, fdnum=(0, 1)):
+    """
+    Finds the rows of each nodding pair, spectral window and polarization.
+    Each pair gives two consecutive groups, as in `_get_ps_groups`, one 
+    for each feed in `fdnum`, with the scan where the source is in 
+    that feed as source and the other scan as reference.
+    """
+    
+    fd_on, fd_off = fdnum
+    setups = sorted(set((ifnum_, plnum_) for ifnum_,plnum_,_ in 
+                        _get_setups(index, ifnum=ifnum, plnum=plnum, fdnum=fdnum)))
+    
+    lookup = sd_fits_utils.get_index_groups(index)
+    
+    def rows(*key):
+        return _lookup_rows(index, lookup, *key)
+    
+    groups = []
+    group_setups = []
+    for scan1,scan2 in pairs:
+        for ifnum_,plnum_ in setups:
+            group = []
+            for scan_on,scan_off,fdnum_ in [(scan1, scan2, fd_on), (scan2, scan1, fd_off)]:
+                group.append([rows(scan_on, ifnum_, plnum_, fdnum_, 'T', 'T'),
+                              rows(scan_on, ifnum_, plnum_, fdnum_, 'T', 'F'),
+                              rows(scan_off, ifnum_, plnum_, fdnum_, 'T', 'T'),
+                              rows(scan_off, ifnum_, plnum_, fdnum_, 'T', 'F'),
+                              rows(scan1, ifnum_, plnum_, fdnum_, 'TF', 'TF')])
+            if np.all([len(g) > 0 for g in group[0] + group[1]]):
+                groups.extend(group)
+                group_setups.append((ifnum_, plnum_, tuple(fdnum)))
+    
+    return groups, group_setups
+
+
+def _concatenate_groups(groups):
+    """
+    Concatenates the rows of a list of groups.
+    Returns the rows, the start of each group and the group of each row.
+    """
+    
+    counts = np.array([len(g) for g in groups])
+    rows = np.concatenate(groups)
+    starts = np.zeros(len(groups), dtype=int)
+    starts[1:] = np.cumsum(counts)[:-1]
+    group_id = np.repeat(np.arange(len(groups)), counts)
+    
+    return rows, starts, group_id
+
+
+def _load_groups(table, groups, dtype=np.float64, window=None, flags=None):
+    """
+    Loads the DATA and EXPOSURE of the rows of the source and 
+    reference scans, with the noise diode on and off, of every group.
+    DATA is loaded as `dtype`, only the channels inside `window`,
+    with the values in `flags` set to NaN.
+    """
+    
+    rows = []
+    starts = []
+    group_id = []
+    data = []
+    tint = []
+    for k in range(4):
+        rows_, starts_, group_id_ = _concatenate_groups([g[k] for g in groups])
+        rows.append(rows_)
+        starts.append(starts_)
+        group_id.append(group_id_)
+        data.append(sd_fits_utils.read_data(table, rows_, window=window, flags=flags, dtype=dtype))
+        tint.append(np.asarray(table['EXPOSURE'][rows_], dtype=float))
+    
+    return rows, starts, group_id, data, tint
+
+
+def _average_groups(table, rows, starts, data, tint, dtype=np.float64, window=None):
+    """
+    Averages the integrations of each group, as `groundhog.Scan.average`.
+    Returns the averaged spectra and their frequency axes.
+    `window` is the channel window used to load `data`.
+    """
+    
+    nchan = data[0].shape[1]
+    
+    avg = []
+    freq_axis = []
+    for k in range(len(data)):
+        rows_ = sd_fits_utils.get_rows(table, rows[k], ['CRVAL1', 'CDELT1', 'CRPIX1', 'VFRAME', 'TSYS'])
+        if window is not None:
+            rows_['CRPIX1'] -= window[0]
+        weights = rows_['CDELT1']*tint[k]*np.power(rows_['TSYS'], -2.)
+        avg.append(utils.group_average(data[k], weights, starts[k], dtype=dtype))
+        freq_axis.append(spectral_axis.average_freq_axis(spectral_axis.get_freq_axis(rows_, nchan=nchan), 
+                                                         weights, starts=starts[k]))
+    
+    return avg, freq_axis
+
+
+def _interp_kappa(freq, kappa_freq, kappa):
+    """
+    Interpolates each row of `kappa` to the frequencies in `freq`.
+    """
+    
+    kappa_interp = np.empty(freq.shape, dtype=float)
+    for g in range(freq.shape[0]):
+        pt = np.argsort(kappa_freq[g])
+        pi = np.argsort(freq[g])
+        kappa_interp[g] = np.interp(freq[g][pi], kappa_freq[g][pt], kappa[g])
+    
+    return kappa_interp
+
+
+@profiling.profiled
+def _calibrate_ps_groups(table, groups, method='vector', avgf_min=256, dtype=None, 
+                         window=None, flags=None):
     """
+    Calibrates the position switched groups found by `_get_ps_groups`.
+    Returns a table with one row per group.
+    The spectra are processed as `dtype`, float64 if None.
+    Only the channels inside the channel `window` are used,
+    and the values in `flags` are ignored.
     """
     
-    cal_scan = sdfits.get_scans(scan, ifnum=ifnum, intnum=intnum, plnum=plnum)
+    tsou, tsys, exposure, rows, starts = _calibrate_groups(table, groups, method=method, 
+                                                           avgf_min=avgf_min, dtype=dtype, 
+                                                           window=window, flags=flags)
+    
+    return _make_cal_table(table, rows[0][starts[0]], window, tsou, exposure, tsys)
+
+
+@profiling.profiled
+def _calibrate_fs_groups(table, groups, method='vector', avgf_min=256, dtype=None, 
+                         window=None, flags=None, fold=True):
+    """
+    Calibrates the frequency switched groups found by `_get_fs_groups`.
+    Returns a table with one row per group, with the frequency axis 
+    of the state with SIG='T'. See `_calibrate_ps_groups`.
+    """
+    
+    loaded = _load_cal_groups(table, groups, method=method, dtype=dtype, window=window, 
+                              flags=flags)
+    ta_sig, tsys_sig, exp_sig, rows, starts = _calibrate_groups(table, groups, method=method, 
+                                                                avgf_min=avgf_min, dtype=dtype, 
+                                                                loaded=loaded)
+    sig_rows = rows[0][starts[0]]
+    
+    if not fold:
+        return _make_cal_table(table, sig_rows, window, ta_sig, exp_sig, tsys_sig)
+    
+    # Calibrate the reference state against the signal state,
+    # reusing the rows already loaded.
+    swapped = [[g[2], g[3], g[0], g[1], g[4]] for g in groups]
+    ta_ref, tsys_ref, exp_ref, rows, starts = _calibrate_groups(table, swapped, method=method, 
+                                                                avgf_min=avgf_min, dtype=dtype, 
+                                                                loaded=_swap_cal_groups(loaded))
+    ref_rows = rows[0][starts[0]]
+    
+    # Align the reference state with the signal state.
+    sig_axis = sd_fits_utils.get_rows(table, sig_rows, ['CRVAL1', 'CDELT1', 'CRPIX1'])
+    ref_axis = sd_fits_utils.get_rows(table, ref_rows, ['CRVAL1', 'CRPIX1'])
+    offset = (sig_axis['CRVAL1'] - ref_axis['CRVAL1'])/sig_axis['CDELT1'] + \
+             ref_axis['CRPIX1'] - sig_axis['CRPIX1']
+    with profiling.stage('datared.fold'):
+        ta_ref = utils.shift_channels(ta_ref, offset)
+        # Channels outside the reference state only use the signal state.
+        tsou = np.where(np.isnan(ta_ref), ta_sig, 0.5*(ta_sig + ta_ref))
+    
+    tsys = None if tsys_sig is None else 0.5*(tsys_sig + tsys_ref)
+    
+    return _make_cal_table(table, sig_rows, window, tsou, exp_sig + exp_ref, tsys)
+
+
+@profiling.profiled
+def _calibrate_nod_groups(table, groups, method='vector', avgf_min=256, dtype=None, 
+                          window=None, flags=None):
+    """
+    Calibrates the nodding groups found by `_get_nod_groups`.
+    Returns a table with one row per pair of groups,
+    the average of the two feeds. See `_calibrate_ps_groups`.
+    """
+    
+    tsou, tsys, exposure, rows, starts = _calibrate_groups(table, groups, method=method, 
+                                                           avgf_min=avgf_min, dtype=dtype, 
+                                                           window=window, flags=flags)
+    
+    # Average the two feeds.
+    tsou = 0.5*(tsou[0::2] + tsou[1::2])
+    exposure = exposure[0::2] + exposure[1::2]
+    if tsys is not None:
+        tsys = 0.5*(tsys[0::2] + tsys[1::2])
+    
+    return _make_cal_table(table, rows[0][starts[0][0::2]], window, tsou, exposure, tsys)
+
+
+def _make_cal_table(table, rows, window, data, exposure, tsys=None):
+    """
+    Table with calibrated spectra, using `rows` of `table` as template.
+    """
+    
+    cal_table = sd_fits_utils.apply_chan_window(table[rows], window)
+    cal_table['DATA'][:] = data
+    cal_table['EXPOSURE'][:] = exposure
+    if tsys is not None:
+        cal_table['TSYS'][:] = tsys
+    
+    return cal_table
+
+
+def _load_cal_groups(table, groups, method='vector', dtype=None, window=None, flags=None):
+    """
+    Loads the rows of each group needed by `_calibrate_groups`, and 
+    their TCAL averaged over the first scan of the pair.
+    The vector method also needs the average of the integrations.
+    Returns a `CalGroups` object.
+    """
+    
+    dtype_ = dtype or np.float64
+    
+    # Average TCAL over the first scan of the pair.
+    tcal_rows, tcal_starts, _ = _concatenate_groups([g[4] for g in groups])
+    tcal = utils.group_average(np.asarray(table['TCAL'][tcal_rows], dtype=float),
+                               np.ones(len(tcal_rows)), tcal_starts)
+    if tcal.ndim == 1:
+        tcal = tcal[:,np.newaxis]
+    else:
+        tcal = tcal[:,sd_fits_utils.chan_slice(window)]
+    tcal = utils.as_dtype(tcal, dtype)
+    
+    # Load the rows of the source and reference scans, 
+    # with the noise diode on and off.
+    rows, starts, group_id, data, tint = _load_groups(table, groups, dtype=dtype_, window=window,
+                                                      flags=flags)
+    
+    avg, freq_axis = None, None
+    if method == 'vector':
+        avg, freq_axis = _average_groups(table, rows, starts, data, tint, dtype=dtype_, 
+                                         window=window)
+    
+    return CalGroups(tcal=tcal, rows=rows, starts=starts, group_id=group_id, data=data, 
+                     tint=tint, avg=avg, freq_axis=freq_axis)
+
+
+def _swap_cal_groups(loaded):
+    """
+    Swaps the source and reference rows of groups loaded by `_load_cal_groups`.
+    """
+    
+    order = [2, 3, 0, 1]
+    swapped = {}
+    for field in ['rows', 'starts', 'group_id', 'data', 'tint', 'avg', 'freq_axis']:
+        values = getattr(loaded, field)
+        if values is not None:
+            swapped[field] = [values[k] for k in order]
+    
+    return loaded._replace(**swapped)
+
+
+def _calibrate_groups(table, groups, method='vector', avgf_min=256, dtype=None, 
+                      window=None, flags=None, loaded=None):
+    """
+    Calibrates the source rows of each group against its reference rows.
+    See `_calibrate_ps_groups` for the parameters.
+    `loaded` are the rows of `groups` loaded by `_load_cal_groups`,
+    they are loaded if not given.
+    Returns the calibrated spectra, their system temperature (None for
+    the vector method), exposure time, and the rows and first row of 
+    each group of the source and reference, with noise diode on and off.
+    """
+    
+    dtype_ = dtype or np.float64
+    
+    if loaded is None:
+        loaded = _load_cal_groups(table, groups, method=method, dtype=dtype, window=window, 
+                                  flags=flags)
+    tcal = loaded.tcal
+    rows, starts, group_id, data, tint = loaded.rows, loaded.starts, loaded.group_id, \
+                                         loaded.data, loaded.tint
+    sou_on, sou_off, off_on, off_off = data
+    
+    nchan = sou_on.shape[1]
+    
+    if method == 'vector':
+        
+        sou_on, sou_off, off_on, off_off = loaded.avg
+        freq_axis = loaded.freq_axis
+        sou_freq = spectral_axis.eval_freq_axis(freq_axis[0])
+        
+        avgf = get_kappa_avgf(nchan, avgf_min)
+        
+        kappa_off = get_kappa(off_on, off_off, avgf=avgf)
+        kappa_freq = spectral_axis.block_freq_axis(freq_axis[3], avgf)
+        
+        # Interpolate back to high frequency resolution.
+        kappa_interp = utils.as_dtype(_interp_kappa(sou_freq, kappa_freq, kappa_off), dtype)
+        
+        # Compute the source temperature (Eq. (16) in Winkel et al. 2012).
+        tsou_on = (kappa_interp + 1.)*tcal*(sou_on - off_on)/off_on
+        tsou_off = kappa_interp*tcal*(sou_off - off_off)/off_off
+        # Average.
+        tsou = 0.5*(tsou_on + tsou_off)
+        tsys_avg = None
+        
+    elif method in ['gbtidl', 'classic']:
+        
+        counts = np.array([[len(g[k]) for k in range(4)] for g in groups])
+        if np.any(counts != counts[:,:1]):
+            raise ValueError("The number of integrations of the source and "
+                             "reference scans do not match.")
+        
+        gid = group_id[0]
+        tcal_row = tcal[gid]
+        dnu = utils.group_average(np.asarray(table['CDELT1'][rows[0]], dtype=float),
+                                  np.ones(len(gid)), starts[0])[gid]
+        tint_sou = 0.5*(tint[0] + tint[1])
+        tint_off = 0.5*(tint[2] + tint[3])
+        
+        if method == 'gbtidl':
+            # Eqs. (1) and (2) from Braatz (2009, GBTIDL calibration guide)
+            tsys = gbtidl_tsys(off_on, off_off, tcal_row.mean(axis=1, dtype=np.float64))
+            sig = 0.5*(sou_on + sou_off)
+            ref = 0.5*(off_on + off_off)
+            ta = gbtidl_sigref2ta(sig, ref, utils.as_dtype(tsys, dtype))
+            weights = dnu*0.5*(tint_sou + tint_off)*np.power(tsys, -2.)
+            tsou = utils.group_average(ta, weights, starts[0], dtype=dtype_)
+        else:
+            tsys = classic_tsys(off_on, off_off, tcal_row.mean(axis=1, dtype=np.float64))
+            ta_on = (sou_on - off_on)/off_on*utils.as_dtype(tsys[:,np.newaxis] + tcal_row, dtype)
+            ta_off = (sou_off - off_off)/off_off*utils.as_dtype(tsys[:,np.newaxis], dtype)
+            ta_on = utils.group_average(ta_on, dnu*tint_sou*np.power(tsys, -2.), starts[0], dtype=dtype_)
+            ta_off = utils.group_average(ta_off, dnu*tint_off*np.power(tsys, -2.), starts[0], dtype=dtype_)
+            tsou = 0.5*(ta_on + ta_off)
+            weights = dnu*tint_sou*np.power(tsys, -2.)
+        tsys_avg = utils.group_average(tsys, weights, starts[0])
+    
+    else:
+        raise ValueError(f"Unknown method: {method}.")
+    
+    # Exposure time of the calibrated spectra.
+    tint_sig = np.add.reduceat(tint[0], starts[0]) + np.add.reduceat(tint[1], starts[1])
+    tint_ref = np.add.reduceat(tint[2], starts[2]) + np.add.reduceat(tint[3], starts[3])
+    exposure = tint_sig*tint_ref/(tint_sig + tint_ref)
+    
+    return tsou, tsys_avg, exposure, rows, starts
+
+
+def _pack_quantity(quantity):
+    if quantity is None:
+        return None
+    return {'value': np.asarray(quantity.value), 'unit': str(quantity.unit)}
+
+
+def _unpack_quantity(arrays):
+    return arrays['value']*u.Unit(str(arrays['unit']))
+
+
+def _pack_tcals(tcals):
+    if not tcals:
+        return None
+    arrays = {'keys': np.array(list(tcals.keys())), 
+              'unit': str(list(tcals.values())[0].unit)}
+    for i,tcal in enumerate(tcals.values()):
+        arrays[f'value{i}'] = tcal.value
+    return arrays
+
+
+def _unpack_tcals(arrays):
+    unit = u.Unit(str(arrays['unit']))
+    return {tuple(key): arrays[f'value{i}']*unit for i,key in enumerate(arrays['keys'].tolist())}
+
+
+def _pack_scan(scan):
+    # Store the row in FITS format to keep the column definitions.
+    row = scan.table
+    buf = io.BytesIO()
+    fits.BinTableHDU(data=row.array[row.row:row.row+1]).writeto(buf)
+    return {'fits': np.frombuffer(buf.getvalue(), dtype=np.uint8)}
+
+
+def _unpack_scan(arrays):
+    hdu = fits.open(io.BytesIO(arrays['fits'].tobytes()))
+    return Scan(hdu[1].data[0])
+
+
+@profiling.profiled
+@cache.cached(_pack_quantity, _unpack_quantity)
+def get_tcal(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0, scale="Perley-Butler 2017", 
+             units="K", avgf_min=16):
+    """
+    """
+    
+    cal_scan = sdfits.get_scans(scan, ifnum=ifnum, intnum=intnum, plnum=plnum, fdnum=fdnum)
     cal_rows = cal_scan.table
     obsmode = cal_rows["OBSMODE"]
     last_on = cal_rows["LASTON"]
@@ -201,45 +1056,157 @@ def get_tcal(sdfits, scan, ifnum=0, intnum=None, plnum=0, scale="Perley-Butler 2
     scan_on, scan_off = utils.get_ps_scan_pair(scan, procnum, procname)
     
     # Get the On and Off source scans with the noise diode On and Off.
-    sou_on = sdfits.get_scans(scan_on, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum)
-    sou_off = sdfits.get_scans(scan_on, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum)
-    off_on = sdfits.get_scans(scan_off, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum)
-    off_off = sdfits.get_scans(scan_off, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum)
+    sou_on = sdfits.get_scans(scan_on, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                              fdnum=fdnum)
+    sou_off = sdfits.get_scans(scan_on, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                               fdnum=fdnum)
+    off_on = sdfits.get_scans(scan_off, sig="T", cal="T", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                              fdnum=fdnum)
+    off_off = sdfits.get_scans(scan_off, sig="T", cal="F", ifnum=ifnum, intnum=intnum, plnum=plnum,
+                               fdnum=fdnum)
     
     sou_on.average()
     sou_off.average()
     off_on.average()
     off_off.average()
-    off_freq = off_off.freq
-    sou_freq = sou_on.freq
+    sou_freq = spectral_axis.eval_freq_axis(sou_on.freq_axis)
     
     nchan = off_on.data.shape[0]
-    facs = utils.factors(nchan)
-    avgf = np.min(facs[facs >= avgf_min])
+    avgf = get_kappa_avgf(nchan, avgf_min)
     
-    kappa_off = get_kappa(off_on.data, off_off.data, avgf=avgf)
-    kappa_freq = off_freq.reshape(nchan//avgf, avgf).mean(axis=1)
+    with profiling.stage('datared.kappa'):
+        kappa_off = get_kappa(off_on.data, off_off.data, avgf=avgf)
+        kappa_freq = spectral_axis.block_freq_axis(off_off.freq_axis, avgf)
     
     # Interpolate back to high frequency resolution.
-    pt = np.argsort(kappa_freq)
-    pi = np.argsort(sou_freq)
-    kappa_interp = np.interp(sou_freq.to('Hz').value[pi], kappa_freq.to('Hz').value[pt], kappa_off)
+    with profiling.stage('datared.kappa_interp'):
+        pt = np.argsort(kappa_freq)
+        pi = np.argsort(sou_freq)
+        kappa_interp = np.interp(sou_freq[pi], kappa_freq[pt], kappa_off)
     
-    ta_sou_on = calibrators.compute_sed(sou_freq, scale, source, units=units)
-    ta_sou_off = calibrators.compute_sed(off_freq, scale, source, units=units)
+    with profiling.stage('datared.compute_sed'):
+        ta_sou_on = calibrators.sed_freq_axis(sou_on.freq_axis, scale, source, units=units)
+        ta_sou_off = calibrators.sed_freq_axis(off_off.freq_axis, scale, source, units=units)
     
     # Compute the temperature of the noise diode (Eq. (76) in Winkel et al. 2012).
     # Using the observations with the noise diode off.
-    tcal_off = ta_sou_off/(kappa_interp*(sou_off.data - off_off.data)/off_off.data)
-    # Using the observations with the noise diode on.
-    tcal_on = ta_sou_on/((kappa_interp + 1.)*(sou_on.data - off_on.data)/off_on.data)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tcal_off = utils.invalid_to_nan(ta_sou_off/(kappa_interp*(sou_off.data - off_off.data)/off_off.data))
+        # Using the observations with the noise diode on.
+        tcal_on = utils.invalid_to_nan(ta_sou_on/((kappa_interp + 1.)*(sou_on.data - off_on.data)/off_on.data))
     # Average the results.
-    tcal = (tcal_off/np.ma.std(tcal_off)**2. + tcal_on/np.ma.std(tcal_on)**2.) / \
-           (1./np.ma.std(tcal_off)**2. + 1./np.ma.std(tcal_on)**2.)
+    tcal = (tcal_off/np.nanstd(tcal_off)**2. + tcal_on/np.nanstd(tcal_on)**2.) / \
+           (1./np.nanstd(tcal_off)**2. + 1./np.nanstd(tcal_on)**2.)
 
-    return tcal
+    return tcal*u.Unit(units)
+        
+        
+@profiling.profiled
+@cache.cached(_pack_tcals, _unpack_tcals)
+def get_tcal_all(sdfits, scan, ifnum=None, plnum=None, fdnum=None, scale="Perley-Butler 2017", 
+                 units="K", avgf_min=16):
+    """
+    Computes the temperature of the noise diode for all the spectral windows, 
+    polarizations and feeds of a position switched observation of a calibrator.
+    The rows of the calibrator are read once and all the setups are solved
+    together, using the same equations as `get_tcal`.
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the observations.
+    scan : int
+        One of the scans of the calibrator.
+    ifnum : list, optional
+        Spectral windows to process.
+        Will process all spectral windows by default.
+    plnum : list, optional
+        Polarizations to process.
+        Will process all polarizations by default.
+    fdnum : list, optional
+        Feeds to process.
+        Will process all feeds by default.
+    scale : str, optional
+        Flux density scale of the calibrator.
+    units : {'K', 'Jy'}, optional
+        TCAL units.
+    avgf_min : int, optional
+        Minimum number of channels to average together when
+        computing the kappa factor (Eq. (14) in Winkel et al. 2012).
+    cache : `groundhog.cache.Cache`, optional
+        Cache where to look for the result before computing it.
+    
+    Returns
+    -------
+    tcal : dict
+        Temperature of the noise diode. The keys are tuples 
+        with the spectral window, polarization and feed.
+        None if no table has an OnOff or OffOn pair with `scan`.
+    """
+    
+    tcals = {}
+    
+    for i in sdfits.scan_tables.get(scan, []):
+        
+        meta = sdfits.meta[i]
+        pairs = [pair for pair in sd_fits_utils.get_ps_pairs(meta) if scan in pair]
+        if len(pairs) == 0:
+            # Other tables may have the pair.
+            continue
         
+        groups, setups = _get_ps_groups(sdfits.index[i], pairs[:1], 
+                                        ifnum=ifnum, plnum=plnum, fdnum=fdnum)
+        if len(groups) == 0:
+            continue
+        
+        table = sdfits.table[i]
+        window = sdfits.chan_window[i]
+        rows, starts, _, data, tint = _load_groups(table, groups, window=window, 
+                                                   flags=sdfits.flags[i])
+        avg, freq_axis = _average_groups(table, rows, starts, data, tint, window=window)
+        sou_on, sou_off, off_on, off_off = avg
+        
+        nchan = sou_on.shape[1]
+        avgf = get_kappa_avgf(nchan, avgf_min)
+        
+        with profiling.stage('datared.kappa'):
+            kappa_off = get_kappa(off_on, off_off, avgf=avgf)
+            kappa_freq = spectral_axis.block_freq_axis(freq_axis[3], avgf)
+        
+        # Interpolate back to high frequency resolution.
+        sou_freq = spectral_axis.eval_freq_axis(freq_axis[0])
+        with profiling.stage('datared.kappa_interp'):
+            kappa_interp = _interp_kappa(sou_freq, kappa_freq, kappa_off)
         
+        source = meta['OBJECT'][rows[0][0]]
+        with profiling.stage('datared.compute_sed'):
+            ta_sou_on = calibrators.sed_freq_axis(freq_axis[0], scale, source, units=units)
+            ta_sou_off = calibrators.sed_freq_axis(freq_axis[3], scale, source, units=units)
+        
+        # Compute the temperature of the noise diode (Eq. (76) in Winkel et al. 2012).
+        # Using the observations with the noise diode off.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tcal_off = utils.invalid_to_nan(ta_sou_off/(kappa_interp*(sou_off - off_off)/off_off))
+            # Using the observations with the noise diode on.
+            tcal_on = utils.invalid_to_nan(ta_sou_on/((kappa_interp + 1.)*(sou_on - off_on)/off_on))
+        # Average the results.
+        w_off = np.nanstd(tcal_off, axis=1, keepdims=True)**-2.
+        w_on = np.nanstd(tcal_on, axis=1, keepdims=True)**-2.
+        tcal = (tcal_off*w_off + tcal_on*w_on)/(w_off + w_on)
+        
+        for g,setup in enumerate(setups):
+            tcals[setup] = tcal[g]*u.Unit(units)
+    
+    if not tcals:
+        warnings.warn(f"Scan {scan} is not part of an OnOff or OffOn procedure "
+                      f"for the selected setups. Cannot get Tcal from this scan.")
+        return None
+    
+    return tcals
+
+
+@profiling.profiled
+@cache.cached(_pack_scan, _unpack_scan)
 def prepare_mapping_off(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0):
     """
     """
@@ -256,7 +1223,7 @@ def prepare_mapping_off(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0):
 
     weight = ref_exposures / tsys_ref**2
     tsys = np.average(tsys_ref, weights=weight)
-    ref = np.ma.average(ref_add, weights=weight, axis=0)
+    ref = utils.chunked_average(ref_add, weight)
     ref_exposure = ref_exposures.sum()
     
     # Create a scan object for the reference position
@@ -269,7 +1236,83 @@ def prepare_mapping_off(sdfits, scan, ifnum=0, intnum=None, plnum=0, fdnum=0):
         avg_col = np.array([np.average(ref_on.table.field(f'crval{k}'), weights=weight)])
         ref_table.setfield(f'crval{k}', avg_col)
     ref_scan = Scan(ref_table)
-    ref_scan.get_freq()
     
     return ref_scan
+
+
+@profiling.profiled
+def prepare_mapping_offs(sdfits, scans, ifnum=None, plnum=None, fdnum=None):
+    """
+    Averages the integrations of the reference scans of a map, as 
+    `prepare_mapping_off`, for all the spectral windows, polarizations 
+    and feeds at once.
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the reference scans.
+    scans : int or list
+        Reference scans.
+    ifnum : list, optional
+        Spectral windows to process. All by default.
+    plnum : list, optional
+        Polarizations to process. All by default.
+    fdnum : list, optional
+        Feeds to process. All by default.
+    
+    Returns
+    -------
+    refs : `MapRefs` object
+        MapRefs(keys, mjd, data, tsys, exposure).
+        One reference spectrum for every scan, spectral window, 
+        polarization and feed, with the SCAN, IFNUM, PLNUM and FDNUM 
+        in `keys` and the weighted average time of its integrations in `mjd`.
+    """
     
+    dtype = sdfits.dtype or np.float64
+    
+    refs = []
+    for i in range(sdfits.numtab):
+        
+        rows_on, rows_off, starts, keys = sd_fits_utils.get_cal_pairs(sdfits.index[i], scans=scans, 
+                                                                      ifnum=ifnum, plnum=plnum, 
+                                                                      fdnum=fdnum)
+        if len(keys) == 0:
+            continue
+        
+        table = sdfits.table[i]
+        window = sdfits.chan_window[i]
+        sl = sd_fits_utils.chan_slice(window)
+        gid = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(rows_on))))
+        
+        ref_on = sd_fits_utils.read_data(table, rows_on, window=window, flags=sdfits.flags[i], 
+                                         dtype=dtype)
+        ref_off = sd_fits_utils.read_data(table, rows_off, window=window, flags=sdfits.flags[i], 
+                                          dtype=dtype)
+        
+        # TCAL averaged over the integrations with the noise diode on.
+        tcal = np.asarray(table['TCAL'][rows_on], dtype=float)
+        if tcal.ndim == 2:
+            tcal = tcal[:,sl].mean(axis=1)
+        tcal = utils.group_average(tcal, np.ones(len(rows_on)), starts)
+        
+        tsys_ref = gbtidl_tsys(ref_on, ref_off, tcal[gid])
+        exposure = np.asarray(table['EXPOSURE'][rows_on], dtype=float) + \
+                   np.asarray(table['EXPOSURE'][rows_off], dtype=float)
+        weight = exposure/tsys_ref**2.
+        
+        refs.append(MapRefs(keys=keys,
+                            mjd=utils.group_average(sd_fits_utils.get_mjd(table, rows_on), weight, starts),
+                            data=utils.group_average(0.5*(ref_on + ref_off), weight, starts, dtype=dtype),
+                            tsys=utils.group_average(tsys_ref, weight, starts),
+                            exposure=np.add.reduceat(exposure, starts)))
+    
+    if len(refs) == 0:
+        return None
+    
+    return MapRefs(keys=np.concatenate([ref.keys for ref in refs]).view(np.recarray),
+                   mjd=np.concatenate([ref.mjd for ref in refs]),
+                   data=np.concatenate([ref.data for ref in refs]),
+                   tsys=np.concatenate([ref.tsys for ref in refs]),
+                   exposure=np.concatenate([ref.exposure for ref in refs]))
+
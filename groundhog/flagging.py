@@ -0,0 +1,386 @@
+"""
+Flagging of bad channels and integrations.
+
+Flags are kept per SDFITS table in a `Flags` object, and are applied
+when the spectra are read, by replacing the flagged channels with NaN.
+The averages, system temperature estimators and calibration ignore NaN,
+so flagged data is left out of every reduction step.
+The tables are never modified.
+"""
+
+import hashlib
+
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from groundhog import profiling
+from groundhog import sd_fits_utils
+
+
+# Ratio between the standard deviation and the
+# median absolute deviation of a normal distribution.
+MAD_TO_STD = 1.4826
+
+
+class Flags:
+    """
+    Flags of the channels of an SDFITS table.
+    Only the rows with flagged channels are stored, with their channel
+    flags packed in bits, using an eighth of the memory of a boolean mask.
+    Channels are those of the table, before applying any channel window.
+
+    Parameters
+    ----------
+    nchan : int, optional
+        Number of channels. If not given, it is set
+        when the first flags are added.
+    """
+
+    def __init__(self, nchan=None):
+
+        self.nchan = nchan
+        # Flagged rows, sorted, and their packed channel flags.
+        self.rows = np.array([], dtype=int)
+        self.bits = np.zeros((0, 0), dtype=np.uint8)
+
+
+    def __len__(self):
+        return len(self.rows)
+
+
+    def add(self, rows, mask):
+        """
+        Flags channels of some rows.
+
+        Parameters
+        ----------
+        rows : array
+            Rows to flag.
+        mask : array
+            True for the channels to flag. It can have one
+            row per element of `rows`, or a single row that
+            applies to all of them.
+        """
+
+        mask = np.asarray(mask, dtype=bool)
+        if self.nchan is None:
+            self.nchan = mask.shape[-1]
+        rows = np.atleast_1d(np.asarray(rows, dtype=int))
+        mask = np.broadcast_to(mask, (len(rows), self.nchan))
+
+        keep = mask.any(axis=1)
+        if not keep.any():
+            return
+
+        rows = np.concatenate((self.rows, rows[keep]))
+        bits = np.packbits(mask[keep], axis=1)
+        if len(self.rows) > 0:
+            bits = np.concatenate((self.bits, bits))
+
+        # Combine the flags of repeated rows.
+        order = np.argsort(rows, kind='stable')
+        self.rows, starts = np.unique(rows[order], return_index=True)
+        self.bits = np.bitwise_or.reduceat(bits[order], starts, axis=0)
+
+
+    def _find(self, rows):
+        """
+        Position of `rows` in the flagged rows, and whether they are flagged.
+        """
+
+        rows = np.atleast_1d(np.asarray(rows, dtype=int))
+        if len(self.rows) == 0:
+            return np.zeros(len(rows), dtype=int), np.zeros(len(rows), dtype=bool)
+
+        pos = np.clip(np.searchsorted(self.rows, rows), 0, len(self.rows) - 1)
+
+        return pos, self.rows[pos] == rows
+
+
+    def get(self, rows, chans=slice(None)):
+        """
+        Boolean flags of the channels `chans` of `rows`.
+        """
+
+        pos, found = self._find(rows)
+        nchan = len(range(self.nchan or 0)[chans])
+        mask = np.zeros((len(pos), nchan), dtype=bool)
+        if found.any():
+            mask[found] = np.unpackbits(self.bits[pos[found]], axis=1,
+                                        count=self.nchan).astype(bool)[:,chans]
+
+        return mask
+
+
+    def apply(self, rows, data, chans=slice(None)):
+        """
+        Replaces the flagged values of `data` with NaN, in place.
+
+        Parameters
+        ----------
+        rows : array
+            Row of each spectrum in `data`.
+        data : array
+            Spectra read from the table. Modified in place.
+        chans : slice, optional
+            Channels of the table in `data`.
+        """
+
+        pos, found = self._find(rows)
+        if not found.any():
+            return data
+
+        hit = np.where(found)[0]
+        mask = np.unpackbits(self.bits[pos[hit]], axis=1, count=self.nchan).astype(bool)[:,chans]
+        data[hit] = np.where(mask, np.nan, data[hit])
+
+        return data
+
+
+    def count(self):
+        """
+        Number of flagged channels.
+        """
+
+        return int(np.unpackbits(self.bits, axis=1, count=self.nchan).sum()) if len(self) > 0 else 0
+
+
+    def clear(self):
+        """
+        Removes all the flags.
+        """
+
+        self.rows = np.array([], dtype=int)
+        self.bits = np.zeros((0, 0), dtype=np.uint8)
+
+
+    def digest(self):
+        """
+        Hash of the flags.
+        """
+
+        sha = hashlib.sha1(np.ascontiguousarray(self.rows))
+        sha.update(np.ascontiguousarray(self.bits))
+
+        return sha.hexdigest()
+
+
+def save_flags(filename, flags):
+    """
+    Saves the flags of the tables of an SDFITS file.
+
+    Parameters
+    ----------
+    filename : str
+        Output file name. It is saved using `numpy.savez`.
+    flags : list
+        List with a `Flags` object for each table.
+    """
+
+    arrays = {}
+    for i,flags_ in enumerate(flags):
+        arrays[f'nchan{i}'] = -1 if flags_.nchan is None else flags_.nchan
+        arrays[f'rows{i}'] = flags_.rows
+        arrays[f'bits{i}'] = flags_.bits
+
+    with open(filename, 'wb') as f:
+        np.savez(f, numtab=len(flags), **arrays)
+
+
+def load_flags(filename):
+    """
+    Loads the flags saved with `save_flags`.
+
+    Returns
+    -------
+    flags : list
+        List with a `Flags` object for each table.
+    """
+
+    flags = []
+    with np.load(filename) as f:
+        for i in range(int(f['numtab'])):
+            nchan = int(f[f'nchan{i}'])
+            flags_ = Flags(None if nchan < 0 else nchan)
+            flags_.rows = f[f'rows{i}']
+            flags_.bits = f[f'bits{i}']
+            flags.append(flags_)
+
+    return flags
+
+
+def robust_std(values, axis=None, keepdims=False):
+    """
+    Standard deviation estimated from the median absolute deviation.
+    Invalid values are ignored.
+    """
+
+    med = np.nanmedian(values, axis=axis, keepdims=True)
+    mad = np.nanmedian(np.abs(values - med), axis=axis, keepdims=keepdims)
+
+    return MAD_TO_STD*mad
+
+
+def noise_std(data):
+    """
+    Standard deviation of the noise of each row, estimated from the
+    difference between adjacent channels, so it is not affected by
+    the bandpass or by lines wider than a few channels.
+    """
+
+    return robust_std(np.diff(data, axis=-1), axis=-1)/np.sqrt(2.)
+
+
+def rolling_median(data, width):
+    """
+    Median of every `width` consecutive channels, centered
+    on each channel. The edges are reflected about the edge
+    values, so linear trends are preserved.
+    """
+
+    half = width//2
+    padded = np.pad(data, [(0, 0)]*(data.ndim - 1) + [(half, width - half - 1)], mode='reflect',
+                    reflect_type='odd')
+
+    windows = sliding_window_view(padded, width, axis=-1)
+    # nanmedian is much slower than median, only use it when needed.
+    if np.isnan(data).any():
+        return np.nanmedian(windows, axis=-1)
+
+    return np.median(windows, axis=-1)
+
+
+def find_spikes(data, width=15, nsigma=5.):
+    """
+    Finds narrow features in channel. A channel is flagged if it deviates from
+    the rolling median of its row by more than `nsigma` robust standard deviations.
+
+    Parameters
+    ----------
+    data : array
+        Spectra, one per row.
+    width : int, optional
+        Number of channels of the rolling median.
+        Features narrower than about half of `width` are flagged.
+    nsigma : float, optional
+        Threshold in robust standard deviations.
+
+    Returns
+    -------
+    mask : array
+        True for the flagged channels.
+    """
+
+    resid = data - rolling_median(data, width)
+    sigma = noise_std(data)[...,np.newaxis]
+
+    with np.errstate(invalid='ignore'):
+        return np.abs(resid) > nsigma*sigma
+
+
+def find_time_outliers(data, width=15, nsigma=5.):
+    """
+    Finds values that deviate from the median of their channel over
+    the rows by more than `nsigma` robust standard deviations.
+    The rows should be consecutive integrations of the same setup.
+    The standard deviation of each channel is smoothed with a rolling
+    median over `width` channels, so it can be estimated from a few rows.
+
+    Returns
+    -------
+    mask : array
+        True for the flagged values.
+    """
+
+    resid = data - np.nanmedian(data, axis=0)
+    sigma = rolling_median(robust_std(resid, axis=0), width)
+
+    with np.errstate(invalid='ignore'):
+        return np.abs(resid) > nsigma*sigma
+
+
+def find_bad_rows(data, nsigma=5.):
+    """
+    Finds rows whose noise deviates from the typical noise of the rows
+    by more than `nsigma` robust standard deviations.
+    The noise of each row is estimated with `noise_std`.
+
+    Returns
+    -------
+    bad : array
+        True for the flagged rows.
+    """
+
+    noise = noise_std(data)
+    resid = noise - np.nanmedian(noise)
+
+    with np.errstate(invalid='ignore'):
+        return ~(np.abs(resid) <= nsigma*robust_std(noise))
+
+
+@profiling.profiled
+def flag_rfi(sdfits, scans=None, ifnum=None, plnum=None, fdnum=None, width=15, nsigma=5.,
+             time=True, rows=True, chunk=256):
+    """
+    Flags RFI and bad integrations in an SDFITS object.
+    Each group of consecutive integrations with the same scan,
+    spectral window, polarization, feed, signal and noise diode state
+    is processed in blocks of `chunk` rows.
+    The flags are added to `sdfits.flags`.
+    Only the channels inside the channel window are searched.
+
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object to flag.
+    scans : list, optional
+        Scans to flag. All by default.
+    ifnum : list, optional
+        Spectral windows to flag. All by default.
+    plnum : list, optional
+        Polarizations to flag. All by default.
+    fdnum : list, optional
+        Feeds to flag. All by default.
+    width : int, optional
+        Number of channels of the rolling median. See `find_spikes`.
+    nsigma : float, optional
+        Threshold in robust standard deviations.
+    time : bool, optional
+        Also flag outliers in time? See `find_time_outliers`.
+    rows : bool, optional
+        Also flag whole integrations with anomalous noise? See `find_bad_rows`.
+    chunk : int, optional
+        Number of integrations processed at a time.
+    """
+
+    for i in range(sdfits.numtab):
+
+        table = sdfits.table[i]
+        index = sdfits.index[i]
+        flags = sdfits.flags[i]
+        window = sdfits.chan_window[i]
+        sl = sd_fits_utils.chan_slice(window)
+        nchan = table['DATA'].shape[-1]
+
+        groups = sd_fits_utils.select_index_groups(index, scans=scans, ifnum=ifnum,
+                                                   plnum=plnum, fdnum=fdnum)
+
+        nflag = flags.count()
+        for g in groups:
+            group_rows = np.sort(index.rows[index.offsets[g]:index.offsets[g+1]])
+            for r0 in range(0, len(group_rows), chunk):
+                rows_ = group_rows[r0:r0+chunk]
+                data = sd_fits_utils.read_data(table, rows_, window=window, flags=flags,
+                                               dtype=np.float64)
+                mask = find_spikes(data, width=width, nsigma=nsigma)
+                if time and len(rows_) >= 3:
+                    mask |= find_time_outliers(data, width=width, nsigma=nsigma)
+                if rows and len(rows_) >= 3:
+                    mask[find_bad_rows(data, nsigma=nsigma)] = True
+                full = np.zeros((len(rows_), nchan), dtype=bool)
+                full[:,sl] = mask
+                flags.add(rows_, full)
+
+        profiling.add(flagged=flags.count() - nflag)
+        sdfits.history.append([i, 'FLAGS', flags.digest()])
@@ -5,10 +5,10 @@ Brightness scales.
 import numpy as np
 
 from astropy import units as u
-from astropy import constants as ac
 
 from groundhog import utils
 from groundhog import telescopes
+from groundhog.spectral_axis import c_ms
 
 
 def jy2k(freq, eta_a_low_freq=telescopes.gbt['aperture efficiency'],
@@ -31,9 +31,36 @@ def jy2k(freq, eta_a_low_freq=telescopes.gbt['aperture efficiency'],
         Conversion factor in K/Jy.
     """
     
-    lmbd = (ac.c/freq)
+    return jy2k_value(freq.to(u.Hz).value, eta_a_low_freq=eta_a_low_freq, 
+                      surf_rms=surf_rms)*u.K/u.Jy
+
+
+def jy2k_value(freq, eta_a_low_freq=telescopes.gbt['aperture efficiency'],
+               surf_rms=telescopes.gbt['surface rms']):
+    """
+    Conversion factor between Jy and K.
+    Same as `jy2k`, but on plain arrays.
+    
+    Parameters
+    ----------
+    freq : array
+        Frequency in Hz.
+    eta_a_low_freq : float, optional
+        Low frequency aperture efficiency of the telescope.
+    surf_rms : `~astropy.units.Quantity` or float, optional
+        Surface root-mean-squared error. In m if a float.
+        
+    Returns
+    -------
+    jy2k : array
+        Conversion factor in K/Jy.
+    """
+    
+    lmbd = c_ms/freq
+    if isinstance(surf_rms, u.Quantity):
+        surf_rms = surf_rms.to_value(u.m)
     eta_a = utils.ruze(lmbd, eta_a_low_freq, surf_rms)
     # Specific gain: (2k/Ap)
     gain = 2.84
     
-    return gain*eta_a*u.K/u.Jy
+    return gain*eta_a
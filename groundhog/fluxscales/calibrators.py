@@ -2,10 +2,13 @@
 Coefficients to compute radio SED of calibrator sources.
 """
 
+import functools
+import collections
 import numpy as np
 
 from astropy import units as u
 
+from groundhog import spectral_axis
 from groundhog.fluxscales import bscales
 
 
@@ -23,20 +26,166 @@ cal_coefs = {'Perley-Butler 2017':{
                                    } # Perley and Butler 2017
             } 
 
+# Memoized SEDs evaluated by `sed_freq_axis`, least recently used first,
+# and the limit on their total size in bytes.
+_sed_cache = collections.OrderedDict()
+SED_CACHE_BYTES = 64*2**20
+
 
 def compute_sed(freq, scale, source, units='Jy'):
     """
     """
     
+    # Look up the coefficients first, so unknown scales 
+    # or sources fail before the frequencies are converted.
     coefs = cal_coefs[scale][source]
-    nu = freq.to(u.GHz).value
+    snu = _eval_sed(freq.to(u.Hz).value, coefs, units)
+    
+    return snu*u.Unit(units)
+
+
+def compute_seds(freq, scale, sources, units='Jy'):
+    """
+    Evaluates the SED of several calibrators on the same frequencies.
+    
+    Parameters
+    ----------
+    freq : `~astropy.units.Quantity`
+        Frequencies. Can have any shape.
+    scale : str
+        Flux density scale.
+    sources : list
+        Names of the calibrators.
+    units : str, optional
+        Units of the output, a flux density or a temperature.
+    
+    Returns
+    -------
+    sed : `~astropy.units.Quantity`
+        SED of each source. Its first axis runs over `sources`.
+    """
+    
+    # Each source is evaluated once, with the polynomials of all
+    # the sources padded to the same degree and evaluated together.
+    unique, inverse = np.unique(np.asarray(sources, dtype=str), return_inverse=True)
+    coefs = [cal_coefs[scale][source] for source in unique]
+    ncoef = max(len(c) for c in coefs)
+    coefs = np.array([[0.]*(ncoef - len(c)) + list(c) for c in coefs])
+    
+    freq = freq.to(u.Hz).value
+    # Coefficients along the first axis, sources along the second.
+    coefs = coefs.T.reshape(coefs.T.shape + (1,)*np.ndim(freq))
+    sed = _eval_sed(freq, coefs, units)[inverse]
+    
+    return sed*u.Unit(units)
+
+
+def sed_values(freq, scale, source, units='Jy'):
+    """
+    Evaluates the SED of a calibrator on plain arrays.
+    
+    Parameters
+    ----------
+    freq : array
+        Frequency in Hz.
+    scale : str
+        Flux density scale.
+    source : str
+        Name of the calibrator.
+    units : str, optional
+        Units of the output, a flux density or a temperature.
+    
+    Returns
+    -------
+    sed : array
+        SED of `source` in `units`.
+    """
+    
+    return _eval_sed(freq, cal_coefs[scale][source], units)
+
+
+def _eval_sed(freq, coefs, units):
+    """
+    SED with polynomial coefficients `coefs` at frequencies `freq` in Hz.
+    """
     
     # Calibrator flux density in Jy.
-    snu = np.power(10., np.polyval(coefs, np.log10(nu)))*u.Jy
+    snu = np.power(10., np.polyval(coefs, np.log10(freq*1e-9)))
     
     if 'K' in units:
-        conv = bscales.jy2k(freq)
-        snu *= conv
+        snu = snu*bscales.jy2k_value(freq)
+        conv = _unit_scale('K', units)
+    else:
+        conv = _unit_scale('Jy', units)
+    
+    if conv != 1.:
+        snu = snu*conv
+    
+    return snu
+
+
+@functools.lru_cache(maxsize=None)
+def _unit_scale(unit, units):
+    """
+    Scale factor between `unit` and `units`.
+    """
+    
+    return u.Unit(unit).to(units)
+
+
+def sed_freq_axis(freq_axis, scale, source, units='Jy'):
+    """
+    Evaluates the SED of a calibrator on a compact frequency axis.
+    The results are memoized, so evaluating the SED again on the 
+    same frequency axis does not recompute it.
+    
+    Parameters
+    ----------
+    freq_axis : `groundhog.spectral_axis.FreqAxis`
+        Frequency axis, as returned by `groundhog.spectral_axis.get_freq_axis`.
+    scale : str
+        Flux density scale.
+    source : str
+        Name of the calibrator.
+    units : str, optional
+        Units of the output, a flux density or a temperature.
+    
+    Returns
+    -------
+    sed : array
+        SED of `source` in `units`, with one row for each row of `freq_axis`.
+        It is read-only, since it can be shared between calls.
+    """
+    
+    shape = np.shape(freq_axis.crval1)
+    grid = tuple(tuple(np.broadcast_to(np.asarray(v, dtype=float), shape).ravel().tolist()) 
+                 for v in freq_axis[:4])
+    
+    return _sed_grid(scale, source, units, grid, shape, freq_axis.nchan)
+
+
+def _sed_grid(scale, source, units, grid, shape, nchan):
+    """
+    Memoized evaluation of the SED on a frequency axis.
+    The least recently used SEDs are dropped when the
+    memoized SEDs are larger than `SED_CACHE_BYTES`.
+    """
+    
+    key = (scale, source, units, grid, shape, nchan)
+    sed = _sed_cache.get(key)
+    if sed is not None:
+        _sed_cache.move_to_end(key)
+        return sed
+    
+    crval1, cdelt1, crpix1, doppler = [np.reshape(v, shape) for v in grid]
+    freq_axis = spectral_axis.FreqAxis(crval1, cdelt1, crpix1, doppler, nchan)
+    sed = sed_values(spectral_axis.eval_freq_axis(freq_axis), scale, source, units=units)
+    sed.flags.writeable = False
+    
+    _sed_cache[key] = sed
+    nbytes = sum(v.nbytes for v in _sed_cache.values())
+    while nbytes > SED_CACHE_BYTES:
+        nbytes -= _sed_cache.popitem(last=False)[1].nbytes
     
-    return snu.to(units)
+    return sed
         
@@ -4,6 +4,7 @@ import numpy as np
 
 from astropy import units as u
 
+from groundhog import spectral_axis
 from groundhog.fluxscales import calibrators
 
 
@@ -25,3 +26,40 @@ def test_compute_sed2():
     flux = expected[:,1]*u.Jy
     snu = calibrators.compute_sed(freq, scale, source, units='Jy')
     np.testing.assert_allclose(snu, flux, atol=2)
+
+
+def test_sed_freq_axis():
+    scale = 'Perley-Butler 2017'
+    freq_axis = spectral_axis.FreqAxis(np.array([1.4e9, 1.5e9]), np.array([1e5, 2e5]), 
+                                       np.array([1., 1.]), np.array([1., 1.]), 1024)
+    freq = spectral_axis.eval_freq_axis(freq_axis)*u.Hz
+    sed = calibrators.sed_freq_axis(freq_axis, scale, '3C286', units='K')
+    np.testing.assert_allclose(sed, calibrators.compute_sed(freq, scale, '3C286', units='K').value)
+    cached = calibrators.sed_freq_axis(freq_axis, scale, '3C286', units='K')
+    assert cached is sed
+    assert not cached.flags.writeable
+    # Other sources and units are not mixed up in the cache.
+    np.testing.assert_allclose(calibrators.sed_freq_axis(freq_axis, scale, '3C48', units='Jy'),
+                               calibrators.compute_sed(freq, scale, '3C48', units='Jy').value)
+    np.testing.assert_allclose(cached, calibrators.compute_sed(freq, scale, '3C286', units='K').value)
+    # The cache is bounded in size.
+    limit = calibrators.SED_CACHE_BYTES
+    calibrators.SED_CACHE_BYTES = 2*sed.nbytes
+    try:
+        for crpix1 in range(1, 5):
+            axis = freq_axis._replace(crpix1=np.array([crpix1, crpix1]))
+            sed_ = calibrators.sed_freq_axis(axis, scale, '3C286', units='K')
+            np.testing.assert_allclose(sed_, calibrators.compute_sed(
+                spectral_axis.eval_freq_axis(axis)*u.Hz, scale, '3C286', units='K').value)
+        assert sum(v.nbytes for v in calibrators._sed_cache.values()) <= 2*sed.nbytes
+    finally:
+        calibrators.SED_CACHE_BYTES = limit
+    seds = calibrators.compute_seds(freq, scale, ['3C286', '3C48'], units='Jy')
+    assert seds.shape == (2, 2, 1024)
+    np.testing.assert_allclose(seds[1], calibrators.compute_sed(freq, scale, '3C48', units='Jy'))
+    # Repeated sources and polynomials of different degree.
+    sources = ['3C380', '3C286', '3C380', '3C147']
+    seds = calibrators.compute_seds(freq, scale, sources, units='K')
+    for source,sed_ in zip(sources, seds):
+        np.testing.assert_allclose(sed_, calibrators.compute_sed(freq, scale, source, units='K'), 
+                                   rtol=1e-12)
@@ -0,0 +1,346 @@
+"""
+Gridding of calibrated spectra into spectral cubes.
+
+Each spectrum is convolved with a kernel onto the pixels of a
+celestial grid, as in the GBT gridder (https://github.com/nrao/gbtgridder).
+The pixels near each spectrum are found by binning the spectra
+in pixel cells, so the cost grows linearly with the number of spectra.
+The cube is built in blocks of channels, and can be written
+to a FITS file without holding it in memory.
+"""
+
+import numpy as np
+
+from collections import namedtuple
+
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from groundhog import profiling
+from groundhog import spectral_axis
+
+
+Kernel = namedtuple('Kernel', ['name', 'width', 'support'])
+
+# Pairs of pixel and spectrum closer than the kernel support.
+# They are sorted by pixel, and `index` points to the pixel in `pixels`.
+Neighbours = namedtuple('Neighbours', ['pixels', 'index', 'rows', 'distances'])
+
+
+def gauss_kernel(fwhm, support=None):
+    """
+    Truncated Gaussian kernel.
+
+    Parameters
+    ----------
+    fwhm : float
+        Full width at half maximum of the Gaussian in degrees.
+    support : float, optional
+        Distance, in degrees, beyond which the kernel is zero.
+        Defaults to three standard deviations.
+
+    Returns
+    -------
+    kernel : `Kernel` object
+        Kernel(name, width, support).
+    """
+
+    if support is None:
+        support = 3.*fwhm/np.sqrt(8.*np.log(2.))
+
+    return Kernel(name='gauss', width=fwhm, support=support)
+
+
+def box_kernel(radius):
+    """
+    Kernel that is one inside `radius`, in degrees, and zero outside.
+    Each pixel will be the average of the spectra within `radius`.
+
+    Returns
+    -------
+    kernel : `Kernel` object
+        Kernel(name, width, support).
+    """
+
+    return Kernel(name='box', width=radius, support=radius)
+
+
+def eval_kernel(kernel, distance):
+    """
+    Evaluates a kernel.
+
+    Parameters
+    ----------
+    kernel : `Kernel` object
+        Kernel, as returned by `gauss_kernel` or `box_kernel`.
+    distance : array
+        Distance from the center of the kernel in degrees.
+
+    Returns
+    -------
+    values : array
+        Kernel values. They are zero beyond the kernel support.
+    """
+
+    distance = np.asarray(distance, dtype=float)
+
+    if kernel.name == 'gauss':
+        sigma = kernel.width/np.sqrt(8.*np.log(2.))
+        values = np.exp(-0.5*(distance/sigma)**2.)
+    elif kernel.name == 'box':
+        values = np.ones_like(distance)
+    else:
+        raise ValueError(f"Unknown kernel: {kernel.name}.")
+
+    return np.where(distance <= kernel.support, values, 0.)
+
+
+def make_wcs(lon, lat, pixel_size, ctype=('RA', 'DEC'), proj='SFL', margin=0.):
+    """
+    Celestial grid that covers a set of positions.
+
+    Parameters
+    ----------
+    lon : array
+        Longitude of the positions in degrees, e.g., CRVAL2.
+    lat : array
+        Latitude of the positions in degrees, e.g., CRVAL3.
+    pixel_size : float
+        Size of the pixels in degrees.
+    ctype : tuple, optional
+        Type of the longitude and latitude axes, e.g., ``('GLON', 'GLAT')``.
+    proj : str, optional
+        Projection code.
+    margin : float, optional
+        Distance in degrees to add around the positions,
+        e.g., the kernel support.
+
+    Returns
+    -------
+    wcs : `astropy.wcs.WCS`
+        Celestial WCS of the grid.
+    shape : tuple
+        Number of pixels along the latitude and longitude axes.
+    """
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = [f"{ctype[0]:-<4}-{proj}", f"{ctype[1]:-<4}-{proj}"]
+    wcs.wcs.cunit = ['deg', 'deg']
+    wcs.wcs.crval = [0.5*(np.nanmin(lon) + np.nanmax(lon)),
+                     0.5*(np.nanmin(lat) + np.nanmax(lat))]
+    wcs.wcs.cdelt = [-pixel_size, pixel_size]
+    wcs.wcs.crpix = [1., 1.]
+
+    # Make the grid start at pixel zero.
+    # Pixel i covers from i - 0.5 to i + 0.5.
+    x, y = wcs.wcs_world2pix(lon, lat, 0)
+    pad = margin/pixel_size
+    x0 = np.rint(np.nanmin(x) - pad)
+    y0 = np.rint(np.nanmin(y) - pad)
+    nx = int(np.rint(np.nanmax(x) + pad) - x0) + 1
+    ny = int(np.rint(np.nanmax(y) + pad) - y0) + 1
+    wcs.wcs.crpix = [1. - x0, 1. - y0]
+
+    return wcs, (ny, nx)
+
+
+@profiling.profiled
+def find_neighbours(x, y, shape, support):
+    """
+    Finds the pixels closer than `support` to each position.
+    Positions are binned in pixel cells, and only the
+    cells around each position are searched.
+
+    Parameters
+    ----------
+    x : array
+        Pixel coordinate of the positions along the longitude axis.
+    y : array
+        Pixel coordinate of the positions along the latitude axis.
+    shape : tuple
+        Number of pixels along the latitude and longitude axes.
+    support : float
+        Search radius in pixels.
+
+    Returns
+    -------
+    neighbours : `Neighbours` object
+        Neighbours(pixels, index, rows, distances).
+        `pixels` are the flattened indices of the pixels with
+        at least one neighbour.
+    """
+
+    ny, nx = shape
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Offsets to the cells that can be within `support`.
+    r = int(np.ceil(support))
+    dy, dx = np.mgrid[-r:r+1, -r:r+1]
+    dx = dx.ravel()
+    dy = dy.ravel()
+
+    finite = np.isfinite(x) & np.isfinite(y)
+    ix = np.rint(np.where(finite, x, -2*r - 1)).astype(int)
+    iy = np.rint(np.where(finite, y, -2*r - 1)).astype(int)
+    px = ix[:,np.newaxis] + dx
+    py = iy[:,np.newaxis] + dy
+    distance = np.hypot(px - x[:,np.newaxis], py - y[:,np.newaxis])
+
+    keep = (distance <= support) & (px >= 0) & (px < nx) & (py >= 0) & (py < ny) & \
+           finite[:,np.newaxis]
+    rows = np.broadcast_to(np.arange(len(x))[:,np.newaxis], px.shape)[keep]
+    pix = (py*nx + px)[keep]
+    distance = distance[keep]
+
+    order = np.argsort(pix, kind='stable')
+    pixels, index = np.unique(pix[order], return_inverse=True)
+    profiling.add(rows=len(x), pairs=len(order))
+
+    return Neighbours(pixels=pixels, index=index, rows=rows[order], distances=distance[order])
+
+
+def make_cube_header(wcs, freq_axis, bunit='K'):
+    """
+    Header of a spectral cube.
+
+    Parameters
+    ----------
+    wcs : `astropy.wcs.WCS`
+        Celestial WCS of the cube.
+    freq_axis : `groundhog.spectral_axis.FreqAxis` object
+        Frequency axis of the cube. It must have a single row.
+    bunit : str, optional
+        Units of the cube.
+
+    Returns
+    -------
+    header : `astropy.io.fits.Header`
+        Header with the WCS of the cube.
+    """
+
+    header = wcs.to_header()
+    header['WCSAXES'] = 3
+    header['CTYPE3'] = 'FREQ'
+    header['CUNIT3'] = 'Hz'
+    header['CRVAL3'] = float(np.squeeze(freq_axis.crval1*freq_axis.doppler))
+    header['CDELT3'] = float(np.squeeze(freq_axis.cdelt1*freq_axis.doppler))
+    header['CRPIX3'] = float(np.squeeze(freq_axis.crpix1))
+    header['BUNIT'] = bunit
+
+    return header
+
+
+def _create_cube_file(filename, header, shape, overwrite=False):
+    """
+    Creates a FITS file for a float32 cube of `shape`
+    without allocating it, and opens it memory-mapped.
+    """
+
+    hdu = fits.PrimaryHDU(data=np.zeros((1,1,1), dtype=np.float32))
+    hdu.header.update(header)
+    for i,n in enumerate(shape[::-1]):
+        hdu.header[f'NAXIS{i+1}'] = n
+
+    hdu.header.tofile(filename, overwrite=overwrite)
+    nbytes = int(np.prod(shape))*4
+    # Pad the data to a multiple of the FITS block size.
+    nbytes = int(np.ceil(nbytes/2880.))*2880
+    with open(filename, 'rb+') as f:
+        f.seek(len(hdu.header.tostring()) + nbytes - 1)
+        f.write(b'\0')
+
+    return fits.open(filename, mode='update', memmap=True)
+
+
+@profiling.profiled
+def grid_cube(table, wcs, shape, kernel, chunk=256, filename=None, overwrite=False,
+              apply_doppler=True, bunit='K'):
+    """
+    Grids calibrated spectra into a spectral cube.
+    Each pixel is the weighted average of the spectra within the
+    kernel support. The weights are the kernel times EXPOSURE/TSYS**2.
+    Invalid values (NaN or inf) are ignored.
+    Pixels without spectra are NaN.
+    The spectra are not regridded in frequency, they should share
+    the same channels, e.g., after Doppler tracking.
+
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Calibrated spectra, e.g., the table of the output of
+        `groundhog.mapping.map_with_ref`. It can be memory-mapped.
+        Positions are taken from the CRVAL2 and CRVAL3 columns.
+    wcs : `astropy.wcs.WCS`
+        Celestial WCS of the grid, e.g., from `make_wcs`.
+    shape : tuple
+        Number of pixels along the latitude and longitude axes.
+    kernel : `Kernel` object
+        Gridding kernel, e.g., from `gauss_kernel`.
+    chunk : int, optional
+        Number of channels gridded at a time.
+        Only arrays with `chunk` channels, for every pair of
+        spectrum and pixel within the kernel support, are kept in memory.
+    filename : str, optional
+        If given, the cube is written to this FITS file block by block
+        and nothing is returned.
+    overwrite : bool, optional
+        Overwrite `filename` if it exists?
+    apply_doppler : bool, optional
+        Apply the Doppler correction to the frequency axis of the cube?
+    bunit : str, optional
+        Units of the spectra.
+
+    Returns
+    -------
+    hdu : `astropy.io.fits.PrimaryHDU`
+        Spectral cube, with axes frequency, latitude and longitude.
+    """
+
+    ny, nx = shape
+    nchan = table['DATA'].shape[-1]
+    pixel_size = abs(wcs.wcs.cdelt[1])
+
+    # Find the spectra around each pixel.
+    lon = np.asarray(table['CRVAL2'], dtype=float)
+    lat = np.asarray(table['CRVAL3'], dtype=float)
+    x, y = wcs.wcs_world2pix(lon, lat, 0)
+    neigh = find_neighbours(x, y, shape, kernel.support/pixel_size)
+
+    row_weights = np.asarray(table['EXPOSURE'], dtype=float)*np.power(np.asarray(table['TSYS'], dtype=float), -2.)
+    weights = eval_kernel(kernel, neigh.distances*pixel_size)*row_weights[neigh.rows]
+    starts = np.flatnonzero(np.diff(neigh.index, prepend=-1))
+
+    freq_axis = spectral_axis.average_freq_axis(spectral_axis.get_freq_axis(table, apply_doppler=apply_doppler,
+                                                                            nchan=nchan),
+                                                row_weights)
+    header = make_cube_header(wcs, freq_axis, bunit=bunit)
+
+    if filename is None:
+        hdul = None
+        cube = np.empty((nchan, ny, nx), dtype=np.float32)
+    else:
+        hdul = _create_cube_file(filename, header, (nchan, ny, nx), overwrite=overwrite)
+        cube = hdul[0].data
+
+    for c0 in range(0, nchan, chunk):
+        with profiling.stage('gridding.grid_cube.block'):
+            data = np.asarray(table['DATA'][:,c0:c0+chunk], dtype=np.float64)[neigh.rows]
+            valid = np.isfinite(data)
+            wgt = weights[:,np.newaxis]
+            num = np.add.reduceat(np.where(valid, data*wgt, 0.), starts, axis=0)
+            den = np.add.reduceat(valid*wgt, starts, axis=0)
+            block = np.full((data.shape[1], ny*nx), np.nan, dtype=np.float32)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                block[:,neigh.pixels] = (num/den).T
+            cube[c0:c0+chunk] = block.reshape(-1, ny, nx)
+            profiling.add(bytes_alloc=data.nbytes + block.nbytes)
+
+    if hdul is not None:
+        hdul.close()
+        return
+
+    return fits.PrimaryHDU(data=cube, header=header)
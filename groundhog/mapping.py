@@ -2,13 +2,18 @@
 Mapping functions.
 """
 
+import numpy as np
+
 from groundhog.scan import Scan
+from groundhog import datared
+from groundhog import profiling
 from groundhog import sd_fits_utils
 
 
+@profiling.profiled
 def map_with_ref(sdfits, scans, ref_scan, 
                  ifnum=0, plnum=0, fdnum=0, 
-                 method='gbtidl', avgf_min=256):
+                 method='gbtidl', avgf_min=256, writer=None):
     """
     Mapping with a reference position.
     
@@ -36,6 +41,9 @@ def map_with_ref(sdfits, scans, ref_scan,
         Averaging factor for the reference scan.
         The reference spectrum will be averaged by this
         factor in frequency.
+    writer : `groundhog.sd_fits_io.SDFITSWriter`, optional
+        If given, the scans are calibrated one at a time and
+        written to it, and nothing is returned.
     
     Returns
     -------
@@ -43,6 +51,14 @@ def map_with_ref(sdfits, scans, ref_scan,
         Calibrated scans.
     """
     
+    if writer is not None:
+        for scan in scans:
+            cal_scan = map_with_ref(sdfits, [scan], ref_scan, 
+                                    ifnum=ifnum, plnum=plnum, fdnum=fdnum,
+                                    method=method, avgf_min=avgf_min)
+            writer.write(cal_scan.table)
+        return
+    
     # Prepare variables from reference scan.
     ref = ref_scan.table['DATA']
     ref_tsys = ref_scan.table['TSYS']
@@ -68,4 +84,178 @@ def map_with_ref(sdfits, scans, ref_scan,
     cal_scans = Scan(cal_table)
     
     return cal_scans
+
+
+def match_refs(refs, ifnum, plnum, fdnum, mjd, interp='nearest'):
+    """
+    Finds the reference spectra of each row of a map.
+    Rows are matched to the references with the same spectral window,
+    polarization and feed, and then by time.
+    
+    Parameters
+    ----------
+    refs : `groundhog.datared.MapRefs` object
+        Reference spectra, as returned by `groundhog.datared.prepare_mapping_offs`.
+    ifnum : array
+        Spectral window of each row.
+    plnum : array
+        Polarization of each row.
+    fdnum : array
+        Feed of each row.
+    mjd : array
+        Time of each row.
+    interp : {'nearest', 'linear'}, optional
+        Use the reference closest in time, or interpolate linearly
+        between the references that bracket each row.
+        Rows outside the references use the closest one.
+    
+    Returns
+    -------
+    ref0 : array
+        Index of the first reference of each row.
+    ref1 : array
+        Index of the second reference of each row.
+    weight : array
+        Weight of the second reference. 
+        The reference of each row is ``(1 - weight)*ref0 + weight*ref1``.
+    """
+    
+    if interp not in ['nearest', 'linear']:
+        raise ValueError(f"Unknown interpolation: {interp}.")
+    
+    # Label the setups of the references and the rows.
+    setups = np.rec.fromarrays([np.concatenate((refs.keys[col], vals)).astype(int) 
+                                for col,vals in zip(['IFNUM', 'PLNUM', 'FDNUM'], [ifnum, plnum, fdnum])],
+                               names=['IFNUM', 'PLNUM', 'FDNUM'])
+    usetups, label = np.unique(setups, return_inverse=True)
+    label = label.ravel()
+    ref_label = label[:len(refs.keys)]
+    row_label = label[len(refs.keys):]
+    
+    nrow = len(row_label)
+    ref0 = np.zeros(nrow, dtype=int)
+    ref1 = np.zeros(nrow, dtype=int)
+    weight = np.zeros(nrow, dtype=float)
+    
+    for s in np.unique(row_label):
+        
+        rows = np.where(row_label == s)[0]
+        cand = np.where(ref_label == s)[0]
+        if len(cand) == 0:
+            raise ValueError("There is no reference for IFNUM={0}, PLNUM={1} "
+                             "and FDNUM={2}.".format(*usetups[s].tolist()))
+        cand = cand[np.argsort(refs.mjd[cand], kind='stable')]
+        t = refs.mjd[cand]
+        
+        # Bracketing references.
+        j = np.searchsorted(t, mjd[rows])
+        lo = np.clip(j - 1, 0, len(t) - 1)
+        hi = np.clip(j, 0, len(t) - 1)
+        
+        if interp == 'nearest':
+            lo = np.where(np.abs(t[hi] - mjd[rows]) < np.abs(mjd[rows] - t[lo]), hi, lo)
+            hi = lo
+            w = np.zeros(len(rows))
+        else:
+            dt = t[hi] - t[lo]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                w = np.where(dt > 0, (mjd[rows] - t[lo])/dt, 0.)
+            w = np.clip(w, 0., 1.)
+        
+        ref0[rows] = cand[lo]
+        ref1[rows] = cand[hi]
+        weight[rows] = w
+    
+    return ref0, ref1, weight
+
+
+@profiling.profiled
+def map_with_refs(sdfits, scans, ref_scans, ifnum=None, plnum=None, fdnum=None, 
+                  interp='nearest', refs=None):
+    """
+    Mapping with reference positions, for all the spectral windows,
+    polarizations and feeds at once.
+    Every row of the map is read once, and calibrated as in `map_with_ref`
+    against the reference of its spectral window, polarization and feed.
+    
+    Parameters
+    ----------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the map and reference scans.
+    scans : list
+        Scan numbers of the map.
+    ref_scans : int or list
+        Reference scans.
+    ifnum : list, optional
+        Spectral windows to calibrate. All by default.
+    plnum : list, optional
+        Polarizations to calibrate. All by default.
+    fdnum : list, optional
+        Feeds to calibrate. All by default.
+    interp : {'nearest', 'linear'}, optional
+        Calibrate against the reference scan closest in time, or
+        interpolate linearly in time between the reference scans 
+        before and after each row. See `match_refs`.
+    refs : `groundhog.datared.MapRefs` object, optional
+        Reference spectra, as returned by `groundhog.datared.prepare_mapping_offs`.
+        If given, `ref_scans` is not used.
+    
+    Returns
+    -------
+    cal_scans : `Scan` object
+        Calibrated rows. There is one row for every integration,
+        spectral window, polarization and feed. Rows are sorted by
+        scan, spectral window, polarization and feed.
+    """
     
+    if refs is None:
+        refs = datared.prepare_mapping_offs(sdfits, ref_scans, ifnum=ifnum, 
+                                            plnum=plnum, fdnum=fdnum)
+    if refs is None:
+        raise ValueError(f"Reference scans {ref_scans} not found.")
+    
+    dtype = sdfits.dtype or np.float64
+    
+    cal_tables = []
+    for i in range(sdfits.numtab):
+        
+        rows_on, rows_off, starts, keys = sd_fits_utils.get_cal_pairs(sdfits.index[i], scans=scans,
+                                                                      ifnum=ifnum, plnum=plnum,
+                                                                      fdnum=fdnum)
+        if len(keys) == 0:
+            continue
+        
+        table = sdfits.table[i]
+        window = sdfits.chan_window[i]
+        flags = sdfits.flags[i]
+        gid = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(rows_on))))
+        
+        # Add the spectra with the noise diode on and off.
+        sig = 0.5*(sd_fits_utils.read_data(table, rows_on, window=window, flags=flags, dtype=dtype) + 
+                   sd_fits_utils.read_data(table, rows_off, window=window, flags=flags, dtype=dtype))
+        sig_exposure = np.asarray(table['EXPOSURE'][rows_on], dtype=float) + \
+                       np.asarray(table['EXPOSURE'][rows_off], dtype=float)
+        mjd = 0.5*(sd_fits_utils.get_mjd(table, rows_on) + sd_fits_utils.get_mjd(table, rows_off))
+        
+        # Reference of each row.
+        ref0, ref1, w = match_refs(refs, keys['IFNUM'][gid], keys['PLNUM'][gid], 
+                                   keys['FDNUM'][gid], mjd, interp=interp)
+        w_ = w[:,np.newaxis].astype(dtype)
+        ref = (1. - w_)*refs.data[ref0] + w_*refs.data[ref1]
+        ref_tsys = (1. - w)*refs.tsys[ref0] + w*refs.tsys[ref1]
+        ref_exposure = (1. - w)*refs.exposure[ref0] + w*refs.exposure[ref1]
+        
+        # Calibrate all the rows at once.
+        ta = datared.gbtidl_sigref2ta(sig, ref, ref_tsys.astype(dtype))
+        
+        cal_table = sd_fits_utils.apply_chan_window(table[rows_on], window)
+        cal_table['DATA'][:] = ta
+        cal_table['TSYS'][:] = ref_tsys
+        cal_table['EXPOSURE'][:] = sig_exposure*ref_exposure/(sig_exposure + ref_exposure)
+        cal_tables.append(cal_table)
+    
+    if len(cal_tables) == 0:
+        raise ValueError(f"Scans {scans} not found.")
+    
+    return Scan(sd_fits_utils.concatenate_tables(cal_tables))
+
@@ -0,0 +1,234 @@
+"""
+Parallel data reduction.
+Work units are distributed over a pool of processes.
+Each process opens the SDFITS file memory-mapped, so the
+tables are never pickled.
+"""
+
+import itertools
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from groundhog import datared
+from groundhog import mapping
+from groundhog import sd_fits_io
+
+
+# SDFITS object opened by each worker.
+_sdfits = None
+
+
+def _init_worker(filename, ext):
+    """
+    Opens the SDFITS file in a worker process.
+    """
+    
+    global _sdfits
+    _sdfits = sd_fits_io.read_sdfits(filename, ext=ext, lazy=True)
+    
+    
+def _run_task(task):
+    """
+    Runs a work unit using the SDFITS object of the worker.
+    """
+    
+    func, args, kwargs = task
+    
+    return func(_sdfits, *args, **kwargs)
+
+
+def run(filename, tasks, nproc=None, ext='SINGLE DISH', chunksize=1):
+    """
+    Runs work units over a pool of processes.
+    
+    Parameters
+    ----------
+    filename : str
+        SDFITS file with the observations.
+        Each process will open it memory-mapped.
+    tasks : list
+        Work units. Each one is a tuple (function, args, kwargs).
+        The function is called as ``function(sdfits, *args, **kwargs)``.
+    nproc : int, optional
+        Number of processes. Defaults to the number of processors.
+    ext : str, optional
+        Name of the extensions with the single dish data.
+    chunksize : int, optional
+        Number of work units sent to a process at a time.
+    
+    Returns
+    -------
+    results : list
+        Results of the work units, in the same order as `tasks`.
+    """
+    
+    with ProcessPoolExecutor(max_workers=nproc, initializer=_init_worker, 
+                             initargs=(filename, ext)) as executor:
+        results = list(executor.map(_run_task, tasks, chunksize=chunksize))
+    
+    return results
+
+
+def _get_setups(filename, ext, ifnum, plnum, fdnum=None):
+    """
+    Fills the spectral windows, polarizations and feeds
+    not specified using the contents of the SDFITS file.
+    """
+    
+    if ifnum is None or plnum is None or fdnum is None:
+        sdfits = sd_fits_io.read_sdfits(filename, ext=ext, lazy=True)
+        meta = np.concatenate([sdfits.meta[i] for i in range(sdfits.numtab)])
+    
+    if ifnum is None:
+        ifnum = np.unique(meta['IFNUM']).tolist()
+    elif not hasattr(ifnum, "__len__"):
+        ifnum = [ifnum]
+    
+    if plnum is None:
+        plnum = np.unique(meta['PLNUM']).tolist()
+    elif not hasattr(plnum, "__len__"):
+        plnum = [plnum]
+    
+    if fdnum is None:
+        fdnum = np.unique(meta['FDNUM']).tolist()
+    elif not hasattr(fdnum, "__len__"):
+        fdnum = [fdnum]
+    
+    return ifnum, plnum, fdnum
+
+
+def get_ps(filename, scans, ifnum=None, plnum=None, fdnum=None, method='vector', avgf_min=256,
+           nproc=None, ext='SINGLE DISH'):
+    """
+    Calibrates position switched scans in parallel using `groundhog.datared.get_ps`.
+    
+    Parameters
+    ----------
+    filename : str
+        SDFITS file with the observations.
+    scans : list
+        Scans to calibrate.
+    ifnum : list, optional
+        Spectral windows to calibrate. Will process all by default.
+    plnum : list, optional
+        Polarizations to calibrate. Will process all by default.
+    fdnum : list, optional
+        Feeds to calibrate. Will process all by default.
+    method : {'vector', 'gbtidl', 'classic'}, optional
+        Method used to compute the source temperature.
+    avgf_min : int, optional
+        Minimum number of channels to average together when
+        computing the kappa factor.
+    nproc : int, optional
+        Number of processes.
+    
+    Returns
+    -------
+    tsou : dict
+        Calibrated spectra with (scan, ifnum, plnum, fdnum) as keys.
+    """
+    
+    ifnum, plnum, fdnum = _get_setups(filename, ext, ifnum, plnum, fdnum)
+    
+    keys = list(itertools.product(scans, ifnum, plnum, fdnum))
+    tasks = [(datared.get_ps, (scan,), {'ifnum': ifnum_, 'plnum': plnum_, 'fdnum': fdnum_,
+                                        'method': method, 'avgf_min': avgf_min})
+             for scan,ifnum_,plnum_,fdnum_ in keys]
+    
+    results = run(filename, tasks, nproc=nproc, ext=ext)
+    
+    return dict(zip(keys, results))
+
+
+def get_tcal(filename, scan, ifnum=None, plnum=None, fdnum=None, scale="Perley-Butler 2017", 
+             units="K", avgf_min=16, nproc=None, ext='SINGLE DISH'):
+    """
+    Derives the temperature of the noise diode in parallel 
+    using `groundhog.datared.get_tcal`.
+    
+    Parameters
+    ----------
+    filename : str
+        SDFITS file with the observations.
+    scan : int
+        Scan with observations of a calibrator source.
+    ifnum : list, optional
+        Spectral windows to process. Will process all by default.
+    plnum : list, optional
+        Polarizations to process. Will process all by default.
+    fdnum : list, optional
+        Feeds to process. Will process all by default.
+    nproc : int, optional
+        Number of processes.
+    
+    Returns
+    -------
+    tcal : dict
+        Temperature of the noise diode with (ifnum, plnum, fdnum) as keys.
+    """
+    
+    ifnum, plnum, fdnum = _get_setups(filename, ext, ifnum, plnum, fdnum)
+    
+    keys = list(itertools.product(ifnum, plnum, fdnum))
+    tasks = [(datared.get_tcal, (scan,), {'ifnum': ifnum_, 'plnum': plnum_, 'fdnum': fdnum_,
+                                          'scale': scale, 'units': units, 'avgf_min': avgf_min})
+             for ifnum_,plnum_,fdnum_ in keys]
+    
+    results = run(filename, tasks, nproc=nproc, ext=ext)
+    
+    return dict(zip(keys, results))
+
+
+def _map_with_ref(sdfits, scans, ref_scan, ifnum=0, plnum=0, fdnum=0, 
+                  method='gbtidl', avgf_min=256):
+    """
+    Prepares the reference scan and calibrates the mapping scans.
+    """
+    
+    ref = datared.prepare_mapping_off(sdfits, ref_scan, ifnum=ifnum, plnum=plnum, fdnum=fdnum)
+    cal_scans = mapping.map_with_ref(sdfits, scans, ref, ifnum=ifnum, plnum=plnum, fdnum=fdnum,
+                                     method=method, avgf_min=avgf_min)
+    
+    return cal_scans
+
+
+def map_with_ref(filename, scans, ref_scan, ifnum=None, plnum=None, fdnum=None,
+                 method='gbtidl', avgf_min=256, nproc=None, ext='SINGLE DISH'):
+    """
+    Calibrates mapping scans in parallel using 
+    `groundhog.datared.prepare_mapping_off` and `groundhog.mapping.map_with_ref`.
+    
+    Parameters
+    ----------
+    filename : str
+        SDFITS file with the observations.
+    scans : list
+        Scan numbers of the map.
+    ref_scan : int
+        Scan number of the reference position.
+    ifnum : list, optional
+        Spectral windows to process. Will process all by default.
+    plnum : list, optional
+        Polarizations to process. Will process all by default.
+    fdnum : list, optional
+        Feeds to process. Will process all by default.
+    nproc : int, optional
+        Number of processes.
+    
+    Returns
+    -------
+    cal_scans : dict
+        Calibrated `Scan` objects with (ifnum, plnum, fdnum) as keys.
+    """
+    
+    ifnum, plnum, fdnum = _get_setups(filename, ext, ifnum, plnum, fdnum)
+    
+    keys = list(itertools.product(ifnum, plnum, fdnum))
+    tasks = [(_map_with_ref, (scans, ref_scan), {'ifnum': ifnum_, 'plnum': plnum_, 'fdnum': fdnum_,
+                                                 'method': method, 'avgf_min': avgf_min})
+             for ifnum_,plnum_,fdnum_ in keys]
+    
+    results = run(filename, tasks, nproc=nproc, ext=ext)
+    
+    return dict(zip(keys, results))
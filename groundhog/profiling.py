@@ -0,0 +1,237 @@
+"""
+Optional profiling of the reduction steps.
+
+The functions in the hot paths of groundhog are wrapped with `profiled`,
+and some of their internal steps with `stage`. Nothing is recorded
+unless a `Profiler` is active, for example::
+
+    with profiling.Profiler() as prof:
+        tsou = datared.get_ps(sdfits, 5, ifnum=0, plnum=0)
+    prof.print_report()
+    prof.to_chrome_trace('get_ps.json')
+"""
+
+import json
+import time
+import functools
+
+from collections import namedtuple
+
+
+Record = namedtuple('Record', ['name', 'start', 'duration', 'depth', 'counts'])
+
+# Active profiler. None when profiling is off.
+_profiler = None
+
+
+class _NullStage:
+    """
+    Stage used when profiling is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    """
+    Times a stage and records it in `profiler` on exit.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.counts = {}
+
+    def __enter__(self):
+        self.depth = len(self.profiler._stack)
+        self.profiler._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        self.profiler._stack.pop()
+        self.profiler._record(Record(self.name, self.start - self.profiler.t0,
+                                     duration, self.depth, self.counts))
+        return False
+
+
+class Profiler:
+    """
+    Records the wall time and counters of the profiled stages
+    while it is active.
+
+    Parameters
+    ----------
+    callback : callable, optional
+        Function called with every `Record` as soon as its stage ends.
+    """
+
+    def __init__(self, callback=None):
+
+        self.callback = callback
+        self.records = []
+        self.t0 = time.perf_counter()
+        self._stack = []
+        self._previous = None
+
+
+    def __enter__(self):
+        global _profiler
+        self._previous = _profiler
+        self.t0 = time.perf_counter()
+        _profiler = self
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _profiler
+        _profiler = self._previous
+        return False
+
+
+    def _record(self, record):
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+
+    def report(self):
+        """
+        Aggregates the records by stage name.
+
+        Returns
+        -------
+        report : list of dict
+            One entry per stage with the number of calls,
+            the total wall time in seconds (including nested stages)
+            and the sum of each counter. Sorted by total time.
+        """
+
+        stages = {}
+        for rec in self.records:
+            entry = stages.setdefault(rec.name, {'name': rec.name, 'calls': 0, 'time': 0.})
+            entry['calls'] += 1
+            entry['time'] += rec.duration
+            for key,val in rec.counts.items():
+                entry[key] = entry.get(key, 0) + val
+
+        return sorted(stages.values(), key=lambda entry: entry['time'], reverse=True)
+
+
+    def print_report(self):
+        """
+        Prints the output of `report` as a table.
+        """
+
+        report = self.report()
+        if len(report) == 0:
+            return
+        width = max(len(entry['name']) for entry in report)
+        print(f"{'stage':<{width}}  {'calls':>6}  {'time (s)':>10}  counters")
+        for entry in report:
+            counts = ', '.join(f'{k}={v}' for k,v in entry.items() if k not in ['name', 'calls', 'time'])
+            print(f"{entry['name']:<{width}}  {entry['calls']:6d}  {entry['time']:10.4f}  {counts}")
+
+
+    def to_json(self, filename=None):
+        """
+        Dumps the report and the individual records as JSON.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Output file. If not given, the JSON string is returned.
+        """
+
+        out = {'report': self.report(),
+               'records': [rec._asdict() for rec in self.records]}
+
+        if filename is None:
+            return json.dumps(out)
+
+        with open(filename, 'w') as f:
+            json.dump(out, f, indent=1)
+
+
+    def to_chrome_trace(self, filename):
+        """
+        Writes the records in the Chrome trace event format.
+        The file can be opened with chrome://tracing or Perfetto.
+
+        Parameters
+        ----------
+        filename : str
+            Output file.
+        """
+
+        events = [{'name': rec.name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                   'ts': rec.start*1e6, 'dur': rec.duration*1e6,
+                   'args': rec.counts} for rec in self.records]
+
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def stage(name):
+    """
+    Context manager that times a stage if a `Profiler` is active.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    """
+
+    if _profiler is None:
+        return _null_stage
+
+    return _Stage(_profiler, name)
+
+
+def add(**counts):
+    """
+    Adds to the counters of the innermost active stage,
+    e.g., ``add(rows=10, bytes_read=1024)``.
+    Does nothing if profiling is off.
+    """
+
+    if _profiler is None or len(_profiler._stack) == 0:
+        return
+
+    stage_counts = _profiler._stack[-1].counts
+    for key,val in counts.items():
+        stage_counts[key] = stage_counts.get(key, 0) + int(val)
+
+
+def is_active():
+    """
+    Is a `Profiler` active?
+    """
+
+    return _profiler is not None
+
+
+def profiled(func):
+    """
+    Decorator that times every call to `func` as a stage
+    if a `Profiler` is active.
+    """
+
+    name = f"{func.__module__.replace('groundhog.', '')}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+        with _Stage(_profiler, name):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -4,6 +4,12 @@ Scan object.
 
 import numpy as np
 
+from astropy import units as u
+
+from groundhog import utils
+from groundhog import baseline
+from groundhog import profiling
+from groundhog import smoothing
 from groundhog import spectral_axis
 #from astropy.nddata import NDDataArray
 
@@ -12,31 +18,143 @@ class Scan():
     
     __name__ = "Scan"
     
-    def __init__(self, table):
+    def __init__(self, table, dtype=None):
         
         self.table = table
-        self.data = np.ma.masked_invalid(table["DATA"])
+        # Floating point type of the spectra.
+        # If None, DATA is used as stored and products are float64.
+        self.dtype = dtype
+        # Invalid values are NaN, there is no mask.
+        # The spectra are copied, so in place operations on `data`
+        # do not change `table`.
+        with profiling.stage('scan.Scan.astype'):
+            self.data = np.array(table["DATA"], dtype=dtype)
+            profiling.add(arrays=1, bytes_alloc=self.data.nbytes)
         self.tsys = table["TSYS"]
-        self.get_freq()
-        #self.freq = None
+        # Per row description of the frequency axis.
+        self.freq_axis = spectral_axis.get_freq_axis(table)
+        # Frequencies set explicitly, if any, used instead of `freq_axis`.
+        self._freq = None
+    
+    
+    @property
+    def mask(self):
+        """
+        True for the invalid (NaN or inf) values of `data`.
+        It is computed every time it is requested.
+        """
+        
+        return ~np.isfinite(self.data)
+    
+    
+    def get_masked(self):
+        """
+        Returns `data` as a masked array, with the invalid values masked.
+        """
+        
+        return np.ma.masked_invalid(self.data)
     
     
-    def average(self):
+    @property
+    def freq(self):
+        """
+        Frequency of every channel. 
+        It is evaluated from `freq_axis` every time it is requested,
+        unless it was set explicitly. Setting it to None goes back to 
+        `freq_axis`.
+        """
+        
+        return self.get_freq()
+    
+    
+    @freq.setter
+    def freq(self, freq):
+        
+        if freq is not None:
+            freq = u.Quantity(freq, u.Hz)
+        self._freq = freq
+    
+    
+    @profiling.profiled
+    def average(self, chunk=1024):
         """
         Averages the integrations in a scan along the time axis.
+        
+        Parameters
+        ----------
+        chunk : int, optional
+            Number of integrations to accumulate at a time.
+            This limits the size of the temporary arrays.
         """
         
         tint = self.table["EXPOSURE"]
         dnu = self.table["CDELT1"]
-        data_avg = np.ma.average(self.data, axis=0, weights=dnu*tint*np.power(self.tsys, -2.))
+        weights = dnu*tint*np.power(self.tsys, -2.)
+        data_avg = utils.chunked_average(self.data, weights, chunk=chunk, 
+                                         dtype=self.dtype or np.float64)
         self.data = data_avg
-        freq_avg = np.average(self.freq, axis=0, weights=dnu*tint*np.power(self.tsys, -2.))
-        self.freq = freq_avg
+        self.freq_axis = spectral_axis.average_freq_axis(self.freq_axis, weights)
+        if self._freq is not None:
+            self._freq = np.average(self._freq, axis=0, weights=weights)
         self.table["EXPOSURE"] = tint.sum()
+    
+    
+    @profiling.profiled
+    def subtract_baseline(self, order=1, regions=None, exclude=None, kind='poly', nknots=4):
+        """
+        Fits and subtracts baselines from every integration.
+        See `groundhog.baseline.subtract_baseline` for the parameters.
         
+        Returns
+        -------
+        coefs : array
+            Baseline coefficients of each integration.
+        """
+        
+        self.data, coefs = baseline.subtract_baseline(self.data, order=order, regions=regions, 
+                                                      exclude=exclude, kind=kind, nknots=nknots)
         
-    def get_freq(self):
+        return coefs
+    
+    
+    @profiling.profiled
+    def smooth(self, kind=None, width=3, factor=1):
         """
+        Smooths and decimates every integration.
+        The frequency axis is updated to match, the table is not.
+        See `groundhog.smoothing.smooth_table` for the parameters,
+        as there, there is no smoothing by default.
         """
+        
+        self.data = smoothing.smooth_decimate(self.data, kind=kind, width=width, factor=factor)
+        if factor != 1:
+            crpix1, cdelt1 = smoothing.decimate_axis(self.freq_axis.crpix1, self.freq_axis.cdelt1, 
+                                                     factor)
+            self.freq_axis = self.freq_axis._replace(crpix1=crpix1, cdelt1=cdelt1, 
+                                                     nchan=self.data.shape[-1])
+            if self._freq is not None:
+                self._freq = smoothing.decimate(self._freq.value, factor)*u.Hz
+        
+        
+    def get_freq(self, chan=None):
+        """
+        Evaluates the frequency axis.
+        
+        Parameters
+        ----------
+        chan : array, optional
+            Channels where to evaluate the frequency axis, counting from 1.
+            Defaults to all the channels.
+        
+        Returns
+        -------
+        freq : `~astropy.units.Quantity`
+            Frequency.
+        """
+
+        if self._freq is not None:
+            if chan is None:
+                return self._freq
+            return self._freq[...,np.asarray(chan) - 1]
 
-        self.freq = spectral_axis.compute_freq_axis(self.table)
+        return spectral_axis.eval_freq_axis(self.freq_axis, chan=chan)*u.Hz
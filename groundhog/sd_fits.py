@@ -2,10 +2,13 @@
 """
 """
 
+import hashlib
 import numpy as np
 
 from groundhog.scan import Scan
 from groundhog import datared
+from groundhog import flagging
+from groundhog import profiling
 from groundhog import sd_fits_utils
 
 
@@ -13,22 +16,75 @@ class SDFITS:
     
     __name__ = "SDFITS"
     
-    def __init__(self, table, header, phead=None):
+    def __init__(self, table, header, phead=None, lazy=False, index=None, filename=None,
+                 dtype=None, pheads=None):
         
         self.table = table
         self.header = header
+        # Primary header, used when writing.
         self.phead = phead
+        # Primary header of each file, when read from several files.
+        if pheads is None:
+            pheads = [phead]
+        self.pheads = list(pheads)
+        self.lazy = lazy
+        # Floating point type used to process the spectra.
+        self.dtype = dtype
+        # File, or files, the tables were read from, and
+        # the changes made to the tables since.
+        self.filename = filename
+        self.history = []
+        # Number of column updates, see `update_table_cols`.
+        self._nupdates = 0
+        # Channels of each table to use, as (first, last) or None.
+        # Applied when DATA is read, see `remove_edge_chans`.
+        self.chan_window = {i: None for i in range(len(table))}
+        # Flagged channels of each table.
+        # Applied when DATA is read, see `groundhog.flagging`.
+        self.flags = {i: flagging.Flags() for i in range(len(table))}
+        # Layout of the selections of each table with its channel window
+        # applied, as (table, window, template). See `get_scans`.
+        self._templates = {}
         
+        # Keep the columns used for selections in memory.
+        # If the tables are memory-mapped only these columns are read.
+        self.meta = {}
         self.unique = {}
+        self.index = {}
         for i,tab in enumerate(table):
-            self.unique[i] = sd_fits_utils.parse_sdfits(tab)
+            with profiling.stage('sd_fits.SDFITS.get_metadata'):
+                self.meta[i] = sd_fits_utils.get_metadata(tab)
+                profiling.add(rows=len(self.meta[i]), bytes_read=self.meta[i].nbytes)
+            self.unique[i] = sd_fits_utils.parse_sdfits(self.meta[i])
+            if index is not None and index[i].offsets[-1] == len(self.meta[i]):
+                self.index[i] = index[i]
+            else:
+                self.index[i] = sd_fits_utils.build_row_index(self.meta[i])
         
         self.numtab = len(table)
+        
+        self._update_scan_tables()
+    
+    
+    def _update_scan_tables(self):
+        """
+        Finds the tables where each scan is found.
+        Together with the row index of each table, this
+        gives the location of every row in the SDFITS object.
+        """
+        
+        self.scan_tables = {}
+        for i in range(self.numtab):
+            for scan in np.unique(self.index[i].keys['SCAN']).tolist():
+                self.scan_tables.setdefault(scan, []).append(i)
 
     
+    @profiling.profiled
     def get_scans(self, scans, ifnum=None, sig=None, cal=None, plnum=None, fdnum=None, intnum=None):
         """
         Returns the rows in the SDFITS table for the requested scan numbers.
+        The rows can come from several tables, or files, as long
+        as they have the same columns.
         
         Parameters
         ----------
@@ -41,39 +97,77 @@ class SDFITS:
             Rows with the selected scans.
         """
         
-        table = None
-        
-        # Select the table from the possible tables.
-        if self.numtab == 1:
-            table = self.table[0]
-        elif self.numtab > 1:
-            for i in range(self.numtab):
-                if np.isin(self.table[i]["SCAN"], scans).sum() > 0:
-                    if table is not None:
-                        print("Scans span multiple configurations.")
-                        print("This is not supported.")
-                        return
-                    table = self.table[i]
+        # Select the tables with the requested scans.
+        if scans is None:
+            tabnums = range(self.numtab)
+        else:
+            tabnums = set()
+            for scan in np.atleast_1d(scans).tolist():
+                tabnums.update(self.scan_tables.get(scan, []))
+            tabnums = sorted(tabnums)
         
-        mask = sd_fits_utils.get_table_mask(table, scans=scans, 
-                                            ifnum=ifnum, sig=sig, 
-                                            cal=cal, plnum=plnum)
+        # Find the rows using the row index, so only the
+        # selected rows are read from the tables.
+        selections = []
+        for i in tabnums:
+            rows = sd_fits_utils.get_index_rows(self.index[i], scans=scans, 
+                                                ifnum=ifnum, sig=sig, cal=cal, 
+                                                plnum=plnum, fdnum=fdnum)
+            if len(rows) > 0:
+                selections.append(sd_fits_utils.select_rows(self.table[i], rows, 
+                                                            window=self.chan_window[i], 
+                                                            flags=self.flags[i], 
+                                                            template=self._get_template(i)))
         
-        table_scans = table[mask]
+        if len(selections) == 0:
+            table_scans = sd_fits_utils.select_rows(self.table[0], [], window=self.chan_window[0])
+        elif len(selections) == 1:
+            table_scans = selections[0]
+        else:
+            formats = [sel.columns.formats for sel in selections]
+            if np.any([fmt != formats[0] for fmt in formats]):
+                raise ValueError(f"Scans {scans} span tables with different columns, "
+                                 "which cannot be joined.")
+            table_scans = sd_fits_utils.concatenate_tables(selections)
         
         if intnum is not None:
             if not hasattr(intnum, "__len__"):
                 intnum = [intnum]
             table_scans = table_scans[intnum]
+        profiling.add(rows=len(table_scans), bytes_read=table_scans.nbytes)
         
-        scan = Scan(table_scans)
+        scan = Scan(table_scans, dtype=self.dtype)
         
         return scan
     
     
+    def _get_template(self, tablenum):
+        """
+        Layout of the rows of table `tablenum` with its channel window applied.
+        It is built once for each table and window.
+        """
+        
+        table = self.table[tablenum]
+        window = self.chan_window[tablenum]
+        if window is None:
+            return None
+        
+        cached = self._templates.get(tablenum)
+        if cached is None or cached[0] is not table or cached[1] != window:
+            template = sd_fits_utils.apply_chan_window(table[:1], window)
+            cached = self._templates[tablenum] = (table, window, template)
+        
+        return cached[2]
+    
+    
+    @profiling.profiled
     def remove_edge_chans(self, frac=0.2, chan0=None, chanf=None):
         """
         Removes the edge channels of the SDFITS DATA table.
+        The tables are not modified. The channels to keep are stored
+        in `chan_window` and only those are read by `get_scans`.
+        They are removed from the tables when these are written 
+        by `groundhog.sd_fits_io.write_sdfits`.
         
         Parameters
         ----------
@@ -82,43 +176,91 @@ class SDFITS:
             It will remove half of this value at each end of the spectra,
             i.e., if `frac=0.2` it will remove 10% of the channels on the 
             left and 10% of the channels on the right.
+        chan0 : int, optional
+            First channel to keep. Overrides `frac`.
+        chanf : int, optional
+            Last channel to keep (exclusive). Overrides `frac`.
         """
         
-        for i,table in enumerate(self.table):
-            data = table['DATA']
-            
-            if len(data.shape) == 1:
-                nchan = data.shape[0]
-            elif len(data.shape) == 2:
-                nchan = data.shape[1]
-                
-            if chan0 is None:
-                chan0 = int(nchan*frac/2)
-            if chanf is None:
-                chanf = int(nchan - nchan*frac/2)
-            
-            # Select only inner channels.
-            if len(data.shape) == 1:
-                data = data[chan0:chanf]
-            elif len(data.shape) == 2:
-                data = data[:,chan0:chanf]
-            
-            # Update DATA column.
-            new_table = sd_fits_utils.update_table_column(table, 'DATA', data)
-            self.table[i] = new_table
+        for i in range(self.numtab):
             
-            # Update frequency axis header.
-            crp1 = table.field('crpix1')
-            crp1 -= chan0
-            new_table = sd_fits_utils.update_table_column(table, 'CRPIX1', crp1)
-            self.table[i] = new_table
+            nchan = self.get_nchan(i)
+            
+            chan0_ = int(nchan*frac/2) if chan0 is None else chan0
+            chanf_ = int(nchan - nchan*frac/2) if chanf is None else chanf
+            
+            self.chan_window[i] = sd_fits_utils.combine_chan_windows(self.chan_window[i], 
+                                                                     (chan0_, chanf_))
+            self.history.append([i, 'CHAN_WINDOW', list(self.chan_window[i])])
+    
+    
+    def flag_channels(self, chans, scans=None, ifnum=None, plnum=None, fdnum=None):
+        """
+        Flags channel ranges. The flagged values are 
+        ignored by every reduction step.
+        
+        Parameters
+        ----------
+        chans : list
+            (first, last) channel ranges to flag, with last exclusive.
+            Channels are counted from the start of the channel window.
+        scans : list, optional
+            Scans to flag. All by default.
+        ifnum : list, optional
+            Spectral windows to flag. All by default.
+        plnum : list, optional
+            Polarizations to flag. All by default.
+        fdnum : list, optional
+            Feeds to flag. All by default.
+        """
+        
+        for i in range(self.numtab):
+            
+            rows = sd_fits_utils.get_index_rows(self.index[i], scans=scans, ifnum=ifnum,
+                                                plnum=plnum, fdnum=fdnum)
+            if len(rows) == 0:
+                continue
+            
+            offset = 0 if self.chan_window[i] is None else self.chan_window[i][0]
+            mask = np.zeros(self.table[i]['DATA'].shape[-1], dtype=bool)
+            for c0,c1 in chans:
+                mask[offset+c0:offset+c1] = True
+            
+            self.flags[i].add(rows, mask)
+            self.history.append([i, 'FLAGS', self.flags[i].digest()])
+    
+    
+    def get_nchan(self, tablenum=0):
+        """
+        Number of channels of table `tablenum` 
+        after applying its channel window.
+        """
+        
+        nchan = self.table[tablenum]['DATA'].shape[-1]
+        sl = sd_fits_utils.chan_slice(self.chan_window[tablenum])
+        
+        return len(range(nchan)[sl])
+    
+    
+    def get_table(self, tablenum=0):
+        """
+        Returns table `tablenum` with its channel window applied.
+        This reads the whole table, so it is only meant
+        to be used when writing or exporting it.
+        """
+        
+        return sd_fits_utils.apply_chan_window(self.table[tablenum], 
+                                               self.chan_window[tablenum])
             
     
-    def update_tcal(self, scan, ifnum=None, plnum=None, update_scans=None,
-                    scale="Perley-Butler 2017", units="K", avgf_min=16):
+    @profiling.profiled
+    def update_tcal(self, scan, ifnum=None, plnum=None, fdnum=None, update_scans=None,
+                    scale="Perley-Butler 2017", units="K", avgf_min=16, cache=None):
         """
         Updates the TCAL column on the SDFITS table.
         `scan` must point to one of the scans of a flux density calibrator.
+        All the spectral windows, polarizations and feeds are solved 
+        together by `groundhog.datared.get_tcal_all`.
         
         Parameters
         ----------
@@ -132,57 +274,61 @@ class SDFITS:
         plnum : list, optional
             Polarizations to process.
             Will process all polarizations by default.
+        fdnum : list, optional
+            Feeds to process.
+            Will process all feeds by default.
         update_scans : list, optional
             List of scans to update with the new TCAL values.
         scale : str, optional
-        
+            Flux density scale of the calibrator.
         units : {'K', 'Jy'}, optional
             TCAL units.
         avgf_min : int
             Minimum number of channels to average together when
             computing the kappa factor (Eq. (14) in Winkel et al. 2012).
+        cache : `groundhog.cache.Cache`, optional
+            Cache where to look for the TCAL values before computing them.
         """
         
-        if ifnum is None:
-            ifnum = np.unique(self.table['IFNUM'])
-        else:
-            if not hasattr(ifnum, "__len__"):
-                ifnum = [ifnum]
+        tcals = datared.get_tcal_all(self, scan, ifnum=ifnum, plnum=plnum, fdnum=fdnum,
+                                     scale=scale, units=units, avgf_min=avgf_min, 
+                                     cache=cache)
+        if not tcals:
+            return
         
-        if plnum is None:
-            plnum = np.unique(self.table['PLNUM'])
-        else:
-            if not hasattr(plnum, "__len__"):
-                plnum = [plnum]
-        
-        # How many channels?
-        shape = self.table['DATA'].shape
-        if len(shape) == 1:
-            ax = 0
-        elif len(shape) == 2:
-            ax = 1
-        nchan = shape[ax]
-        
-        if self.table['TCAL'].shape != shape:
-            # Expand the TCAL column to accomodate vectors.
-            tcal_col = self.table['TCAL']
-            tcal = np.tile(tcal_col[:,np.newaxis], (1,nchan))
-            self.update_table_col('TCAL', tcal)
-        
-        # Loop over spectral windows and polarizations
-        # updating TCAL.
-        for ifnum_ in ifnum:
-            for plnum_ in plnum:
-        
-                tcal = datared.get_tcal(self, scan, ifnum=ifnum, plnum=plnum, 
-                                        scale=scale, units=units, avgf_min=avgf_min)
-                
-                mask = sd_fits_utils.get_table_mask(self.table, scans=update_scans, 
-                                                    ifnum=ifnum, plnum=plnum)
-                
-                tcal_col = self.table['TCAL']
-                tcal_col[mask] = np.tile(tcal.value, (mask.sum(),1))
-                self.update_table_col('TCAL', tcal_col)
+        for i,table in enumerate(self.table):
+            
+            # How many channels?
+            shape = table['DATA'].shape
+            nchan = self.get_nchan(i)
+            sl = sd_fits_utils.chan_slice(self.chan_window[i])
+            
+            # Rows of each spectral window, polarization and feed.
+            rows = {}
+            for key,tcal in tcals.items():
+                rows_ = sd_fits_utils.get_index_rows(self.index[i], scans=update_scans, 
+                                                     ifnum=key[0], plnum=key[1], fdnum=key[2])
+                if len(rows_) > 0 and len(tcal) == nchan:
+                    rows[key] = rows_
+            
+            if len(rows) == 0:
+                continue
+            
+            tcal_col = np.asarray(table['TCAL'], dtype=float)
+            if tcal_col.shape != shape:
+                # Expand the TCAL column to accomodate vectors.
+                tcal_col = np.tile(tcal_col[:,np.newaxis], (1,shape[-1]))
+            else:
+                tcal_col = tcal_col.copy()
+            
+            for key,rows_ in rows.items():
+                tcal_col[rows_,sl] = tcals[key].value
+            if tcal_col.shape == table['TCAL'].shape:
+                # Store the values with the precision of the column, in place.
+                tcal_col = tcal_col.astype(table['TCAL'].dtype)
+            
+            # Update the whole column at once.
+            self.update_table_col('TCAL', tcal_col, tablenum=i)
         
     
     def update_table_col(self, column_name, column_vals, tablenum=None):
@@ -197,16 +343,90 @@ class SDFITS:
             Array with the new column values.
         """
         
+        self.update_table_cols({column_name: column_vals}, tablenum=tablenum)
+    
+    
+    def _update_token(self, vals):
+        """
+        Cheap identifier of a column update, recorded in the history.
+        It has the shape and type of the new values, the number of updates
+        so far and a hash of a sample of at most 1024 values, so the
+        column does not need to be read again.
+        """
+        
+        self._nupdates += 1
+        vals = np.asarray(vals)
+        sample = vals.flat[np.linspace(0, vals.size - 1, min(vals.size, 1024)).astype(int)]
+        digest = hashlib.sha1(np.ascontiguousarray(sample)).hexdigest()
+        
+        return [list(vals.shape), vals.dtype.str, self._nupdates, digest]
+    
+    
+    @profiling.profiled
+    def update_table_cols(self, columns, tablenum=None):
+        """
+        Updates several columns of the SDFITS table.
+        Columns are updated in place when their shape does not change
+        and their type can hold the new values without losing precision,
+        otherwise the table is rebuilt once.
+        
+        Parameters
+        ----------
+        columns : dict
+            Dictionary with the column names as keys and 
+            the new column values as values.
+        tablenum : int, optional
+            Table to update. Will update all tables by default.
+        """
+        
         if tablenum is None:
-            for i in range(self.numtab):
-                new_table = sd_fits_utils.update_table_column(self.table[i], 
-                                                              column_name, 
-                                                              column_vals)
-                self.table[i] = new_table
+            tablenums = range(self.numtab)
         else:
-            new_table = sd_fits_utils.update_table_column(self.table[tablenum], 
-                                                          column_name, 
-                                                          column_vals)
-            self.table[tablenum] = new_table
+            tablenums = [tablenum]
+        
+        for i in tablenums:
+            new_table = sd_fits_utils.update_table_columns(self.table[i], columns, inplace=True)
+            self.table[i] = new_table
+            
+            for name,vals in columns.items():
+                self.history.append([i, name, self._update_token(vals)])
+            
+            # Keep the metadata in sync with the table.
+            if len(set(columns).intersection(sd_fits_utils.META_COLUMNS)) > 0:
+                self.meta[i] = sd_fits_utils.get_metadata(new_table)
+                self.unique[i] = sd_fits_utils.parse_sdfits(self.meta[i])
+                self.index[i] = sd_fits_utils.build_row_index(self.meta[i])
+                self._update_scan_tables()
+    
+    
+    def save_index(self, filename):
+        """
+        Saves the row index of the SDFITS tables to `filename`.
+        It can be loaded by `groundhog.sd_fits_io.read_sdfits`
+        to avoid building the index again.
+        
+        Parameters
+        ----------
+        filename : str
+            Name of the index file.
+        """
+        
+        sd_fits_utils.save_row_index(filename, [self.index[i] for i in range(self.numtab)])
+    
+    
+    def save_flags(self, filename):
+        """
+        Saves the flags of the SDFITS tables to `filename`.
+        They can be loaded by `groundhog.sd_fits_io.read_sdfits`.
+        The flags refer to the channels of the tables as read,
+        before applying any channel window.
+        
+        Parameters
+        ----------
+        filename : str
+            Name of the flags file.
+        """
+        
+        flagging.save_flags(filename, [self.flags[i] for i in range(self.numtab)])
         
             
@@ -4,13 +4,20 @@ Single Dish FITS I/O methods.
 https://fits.gsfc.nasa.gov/registry/sdfits.html
 """
 
+import io
+import os
+import glob
 import numpy as np
+
 from datetime import datetime
 
 from astropy.io import fits
 from astropy.time import Time
 
 from groundhog.sd_fits import SDFITS
+from groundhog import flagging
+from groundhog import profiling
+from groundhog import sd_fits_utils
 
 
 def make_sdfits_primary_header(date=None, telescope='NRAO_GBT', backend='VEGAS'):
@@ -42,22 +49,138 @@ def make_sdfits_table_header():
     return header
 
 
-def read_sdfits(filename, ext='SINGLE DISH'):
+@profiling.profiled
+def read_sdfits(filename, ext='SINGLE DISH', lazy=False, index_file=None, dtype=None,
+                flags_file=None):
     """
+    Reads an SDFITS file.
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the SDFITS file.
+    ext : str, optional
+        Name of the extensions with the single dish data.
+    lazy : bool, optional
+        Memory-map the binary tables and only read the 
+        metadata columns into memory. The rows of the DATA
+        column are read when selected by `SDFITS.get_scans`.
+    index_file : str, optional
+        File with the row index of the SDFITS tables.
+        If it exists, and it is newer than `filename`, the
+        row index is loaded from it. Otherwise, the row index
+        is built and saved to `index_file`.
+    dtype : data-type, optional
+        Floating point type used to process the spectra, e.g., 
+        ``np.float32`` to keep the spectra in single precision
+        through selection, averaging and calibration.
+        Sums over integrations and channels are still accumulated 
+        in float64. By default, the products are float64.
+    flags_file : str, optional
+        File with flags saved by `SDFITS.save_flags`.
+        The flags are loaded if it exists.
+    
+    Returns
+    -------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the contents of the file.
     """
     
-    table, head, phead = _read_sdfits(filename, ext=ext)
-    sdfits = SDFITS(table, head, phead=phead)
+    table, head, phead = _read_sdfits(filename, ext=ext, lazy=lazy)
+    
+    index = None
+    if index_file is not None and os.path.isfile(index_file) and \
+       os.path.getmtime(index_file) >= os.path.getmtime(filename):
+        index = sd_fits_utils.load_row_index(index_file)
+        if len(index) != len(table):
+            index = None
+    
+    sdfits = SDFITS(table, head, phead=phead, lazy=lazy, index=index, filename=filename,
+                    dtype=dtype)
+    
+    if index_file is not None and index is None:
+        sdfits.save_index(index_file)
+    
+    if flags_file is not None and os.path.isfile(flags_file):
+        flags = flagging.load_flags(flags_file)
+        if len(flags) != sdfits.numtab:
+            raise ValueError(f"{flags_file} has flags for {len(flags)} tables, "
+                             f"but {filename} has {sdfits.numtab}.")
+        for i,flags_ in enumerate(flags):
+            sdfits.flags[i] = flags_
+            sdfits.history.append([i, 'FLAGS', flags_.digest()])
+    
+    return sdfits
+
+
+@profiling.profiled
+def read_session(path, ext='SINGLE DISH', lazy=True, dtype=None):
+    """
+    Reads several SDFITS files as a single SDFITS object.
+    For example, the files of the different banks of a GBT session.
+    
+    Parameters
+    ----------
+    path : str or list
+        Directory with the SDFITS files, glob pattern 
+        matching the SDFITS files or list of file names.
+    ext : str, optional
+        Name of the extensions with the single dish data.
+    lazy : bool, optional
+        Memory-map the binary tables and only read the 
+        metadata columns into memory.
+    dtype : data-type, optional
+        Floating point type used to process the spectra.
+        See `read_sdfits`.
+    
+    Returns
+    -------
+    sdfits : `groundhog.sd_fits.SDFITS`
+        SDFITS object with the tables of all the files.
+        The primary header of each file is kept in ``sdfits.pheads``,
+        and that of the first file is used when writing.
+    """
+    
+    if isinstance(path, (list, tuple)):
+        filenames = list(path)
+    elif os.path.isdir(path):
+        filenames = sorted(glob.glob(os.path.join(path, '*.fits')))
+    else:
+        filenames = sorted(glob.glob(path))
+    
+    if len(filenames) == 0:
+        raise FileNotFoundError(f"No SDFITS files found in {path}.")
+    
+    tables = []
+    heads = []
+    pheads = []
+    for filename in filenames:
+        table, head, phead = _read_sdfits(filename, ext=ext, lazy=lazy)
+        tables.extend(table)
+        heads.extend(head)
+        pheads.append(phead)
+    
+    table = np.empty(len(tables), dtype=object)
+    table[:] = tables
+    head = np.empty(len(heads), dtype=object)
+    head[:] = heads
+    
+    sdfits = SDFITS(table, head, phead=pheads[0], lazy=lazy, filename=filenames, dtype=dtype,
+                    pheads=pheads)
     
     return sdfits
 
 
-def _read_sdfits(filename, ext='SINGLE DISH'):
+@profiling.profiled
+def _read_sdfits(filename, ext='SINGLE DISH', lazy=False):
     """
     """
     
     # Open the fits file.
-    hdu = fits.open(filename)
+    if lazy:
+        hdu = fits.open(filename, memmap=True, lazy_load_hdus=True)
+    else:
+        hdu = fits.open(filename)
     # Save the primary HDU header.
     phead = hdu[0].header
     
@@ -74,10 +197,13 @@ def _read_sdfits(filename, ext='SINGLE DISH'):
     for i,sdh in enumerate(sdhdus):
         tables[i] = hdu[sdh].data
         heads[i] = hdu[sdh].header           
+        if not lazy:
+            profiling.add(rows=len(tables[i]), bytes_read=tables[i].nbytes)
     
     return tables, heads, phead
     
 
+@profiling.profiled
 def write_sdfits(filename, sdfits, overwrite=False):
     """
     """
@@ -89,7 +215,9 @@ def write_sdfits(filename, sdfits, overwrite=False):
     empty_primary = fits.PrimaryHDU(header=phead)
     
     table_hdus = []
-    for i,tab in enumerate(table):
+    for i in range(len(table)):
+        # Remove the channels outside the channel window.
+        tab = sdfits.get_table(i)
         table_hdus.append(fits.BinTableHDU(data=tab, header=header[i], name='SINGLE DISH'))
     
     new_hdul = fits.HDUList([empty_primary,] + table_hdus)
@@ -110,6 +238,7 @@ def _write_sdfits(filename, table, header, overwrite=False):
     new_hdu.writeto(filename, overwrite=overwrite)
     
 
+@profiling.profiled
 def write_new_sdfits(filename, table, overwrite=False):
     """
     """
@@ -124,3 +253,143 @@ def write_new_sdfits(filename, table, overwrite=False):
     new_hdul.writeto(filename, overwrite=overwrite)
     
     
+
+
+class SDFITSWriter:
+    """
+    Writes an SDFITS file incrementally.
+    Rows are appended to the current `SINGLE DISH` extension as they 
+    are produced, and the number of rows in the header is fixed when 
+    the extension is finished.
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the output SDFITS file.
+    phead : `astropy.io.fits.Header`, optional
+        Primary header. If not given a new one is created.
+    overwrite : bool, optional
+        Overwrite `filename` if it exists?
+    
+    Examples
+    --------
+    >>> with SDFITSWriter('out.fits') as writer:
+    ...     for table in tables:
+    ...         writer.write(table)
+    """
+    
+    __name__ = "SDFITSWriter"
+    
+    def __init__(self, filename, phead=None, overwrite=False):
+        
+        if os.path.exists(filename) and not overwrite:
+            raise OSError(f"File {filename} already exists.")
+        
+        if phead is None:
+            phead = make_sdfits_primary_header(date=None)
+        
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        fits.PrimaryHDU(header=phead).writeto(self.file)
+        
+        self.header = None
+        self.nrows = 0
+        self._columns = None
+        self._header_offset = None
+        self._nbytes = 0
+    
+    
+    def __enter__(self):
+        
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.close()
+    
+    
+    @profiling.profiled
+    def write(self, table, header=None):
+        """
+        Appends rows to the current extension.
+        
+        Parameters
+        ----------
+        table : `astropy.io.fits.fitsrec`
+            Rows to write. All the rows written to an 
+            extension must have the same columns.
+        header : `astropy.io.fits.Header`, optional
+            Header of the extension. Only used for the first
+            rows of an extension. If not given a new header is created.
+        """
+        
+        if len(table) == 0:
+            return
+        
+        if header is None and self.header is None:
+            header = make_sdfits_table_header()
+        
+        hdu = fits.BinTableHDU(data=table, header=header if self.header is None else self.header, 
+                               name='SINGLE DISH')
+        
+        # Write the rows to a buffer in FITS format.
+        buf = io.BytesIO()
+        fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(buf)
+        
+        nbytes = hdu.header['NAXIS1']*hdu.header['NAXIS2']
+        if hdu.header['PCOUNT'] > 0:
+            raise ValueError("Variable length columns are not supported.")
+        padded = int(np.ceil(nbytes/2880.))*2880
+        raw = buf.getbuffer()[-padded:][:nbytes]
+        
+        if self.header is None:
+            # Start a new extension.
+            self.header = hdu.header.copy()
+            self._columns = (hdu.columns.names, hdu.columns.formats)
+            self._header_offset = self.file.tell()
+            self.file.write(self.header.tostring().encode('ascii'))
+        elif (hdu.columns.names, hdu.columns.formats) != self._columns:
+            raise ValueError("The rows do not match the columns of the current extension.")
+        
+        self.file.write(raw)
+        self.nrows += len(table)
+        self._nbytes += nbytes
+        profiling.add(rows=len(table), bytes_written=nbytes)
+    
+    
+    def new_table(self):
+        """
+        Finishes the current extension.
+        The next rows will be written to a new extension.
+        """
+        
+        if self.header is None:
+            return
+        
+        # Pad the data to a multiple of 2880 bytes.
+        padding = (2880 - self._nbytes%2880)%2880
+        self.file.write(b'\x00'*padding)
+        end = self.file.tell()
+        
+        # Fix the number of rows.
+        self.header['NAXIS2'] = self.nrows
+        self.file.seek(self._header_offset)
+        self.file.write(self.header.tostring().encode('ascii'))
+        self.file.seek(end)
+        
+        self.header = None
+        self.nrows = 0
+        self._nbytes = 0
+    
+    
+    def close(self):
+        """
+        Finishes the current extension and closes the file.
+        """
+        
+        if self.file.closed:
+            return
+        
+        self.new_table()
+        self.file.close()
@@ -0,0 +1,288 @@
+"""
+Synthetic SDFITS data.
+Used to test and benchmark groundhog without real observations.
+"""
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.time import Time
+from astropy import units as u
+
+from groundhog import sd_fits_io
+from groundhog import spectral_axis
+from groundhog.fluxscales import calibrators
+
+
+def make_ps_table(npairs=1, nint=4, nif=1, npol=2, nfd=1, nchan=1024,
+                  mode='OffOn', source='3C286', scan0=1, tsys=20., tcal=1.5,
+                  freq0=1.4e9, bandwidth=100e6, vframe=1e4, tint=1.,
+                  scale='Perley-Butler 2017', noise=True, seed=None):
+    """
+    Creates an SDFITS table with position switched observations
+    of a calibrator source.
+
+    Parameters
+    ----------
+    npairs : int, optional
+        Number of position switched pairs.
+    nint : int, optional
+        Number of integrations per scan.
+    nif : int, optional
+        Number of spectral windows.
+    npol : int, optional
+        Number of polarizations.
+    nfd : int, optional
+        Number of feeds.
+    nchan : int, optional
+        Number of channels.
+    mode : {'OffOn', 'OnOff'}, optional
+        Position switching procedure.
+    source : str, optional
+        Name of the observed source.
+        Its flux density is added to the On source scans.
+    scan0 : int, optional
+        Number of the first scan.
+    tsys : float, optional
+        System temperature in K.
+    tcal : float, optional
+        Temperature of the noise diode in K.
+    freq0 : float, optional
+        Central frequency of the first spectral window in Hz.
+    bandwidth : float, optional
+        Bandwidth of each spectral window in Hz.
+    vframe : float, optional
+        Radial velocity of the reference frame in m/s.
+    tint : float, optional
+        Exposure time of each integration in s.
+    scale : str, optional
+        Flux density scale of the source.
+    noise : bool, optional
+        Add radiometer noise to the spectra?
+    seed : int, optional
+        Seed for the random number generator.
+
+    Returns
+    -------
+    table : `astropy.io.fits.fitsrec`
+        SDFITS table.
+    """
+
+    scan = []
+    procseqn = []
+    for pair in range(npairs):
+        for seq in [1, 2]:
+            scan.append(scan0 + 2*pair + seq - 1)
+            procseqn.append(seq)
+    procseqn = np.array(procseqn)
+    on = (procseqn == 2) if mode == 'OffOn' else (procseqn == 1)
+    on = np.tile(on[:,np.newaxis], (1, nfd))
+
+    return _make_table(scan, procseqn, f'{mode}:PSWITCHON:TPWCAL', on, np.where(on[:,0], 'ON', 'OFF'),
+                       nint=nint, nif=nif, npol=npol, nfd=nfd, nchan=nchan, source=source,
+                       tsys=tsys, tcal=tcal, freq0=freq0, bandwidth=bandwidth, vframe=vframe,
+                       tint=tint, scale=scale, noise=noise, seed=seed)
+
+
+def make_fs_table(nscans=1, nint=4, nif=1, npol=2, nfd=1, nchan=1024, foffset=-6.25e6,
+                  line=(1., 1.4e9, 1e6), scan0=1, tsys=20., tcal=1.5, freq0=1.4e9,
+                  bandwidth=100e6, vframe=1e4, tint=1., noise=True, seed=None):
+    """
+    Creates an SDFITS table with frequency switched observations of a line.
+    The rows with SIG='F' have their frequencies shifted by `foffset`.
+
+    Parameters
+    ----------
+    nscans : int, optional
+        Number of frequency switched scans.
+    foffset : float, optional
+        Frequency offset of the reference state in Hz.
+    line : tuple, optional
+        Peak temperature in K, frequency in Hz and full
+        width at half maximum in Hz of a Gaussian line.
+    
+    See `make_ps_table` for the other parameters.
+
+    Returns
+    -------
+    table : `astropy.io.fits.fitsrec`
+        SDFITS table.
+    """
+
+    scan = np.arange(scan0, scan0 + nscans)
+    on = np.ones((nscans, nfd), dtype=bool)
+
+    return _make_table(scan, np.ones(nscans, dtype=int), 'Track:FSWITCH:TPWCAL', on, 
+                       np.full(nscans, 'UNKNOWN'), nint=nint, nif=nif, npol=npol, nfd=nfd, 
+                       nchan=nchan, sigs='TF', foffset=foffset, source=None, line=line, 
+                       tsys=tsys, tcal=tcal, freq0=freq0, bandwidth=bandwidth, vframe=vframe, 
+                       tint=tint, noise=noise, seed=seed)
+
+
+def make_nod_table(npairs=1, nint=4, nif=1, npol=2, nchan=1024, source='3C286', scan0=1,
+                   tsys=20., tcal=1.5, freq0=1.4e9, bandwidth=100e6, vframe=1e4, tint=1.,
+                   scale='Perley-Butler 2017', noise=True, seed=None):
+    """
+    Creates an SDFITS table with nodding observations of a calibrator source
+    with two feeds. The source is in the first feed during the first scan
+    of each pair, and in the second feed during the second scan.
+    See `make_ps_table` for the parameters.
+
+    Returns
+    -------
+    table : `astropy.io.fits.fitsrec`
+        SDFITS table.
+    """
+
+    scan = np.arange(scan0, scan0 + 2*npairs)
+    procseqn = np.tile([1, 2], npairs)
+    on = np.stack([procseqn == 1, procseqn == 2], axis=1)
+
+    return _make_table(scan, procseqn, 'Nod:NONE:TPWCAL', on, np.where(procseqn == 1, 'BEAM1', 'BEAM2'),
+                       nint=nint, nif=nif, npol=npol, nfd=2, nchan=nchan, source=source,
+                       tsys=tsys, tcal=tcal, freq0=freq0, bandwidth=bandwidth, vframe=vframe,
+                       tint=tint, scale=scale, noise=noise, seed=seed)
+
+
+def _make_table(scan, procseqn, obsmode, on, procscan, nint=4, nif=1, npol=2, nfd=1, 
+                nchan=1024, sigs='T', foffset=0., source='3C286', line=None, tsys=20., 
+                tcal=1.5, freq0=1.4e9, bandwidth=100e6, vframe=1e4, tint=1., 
+                scale='Perley-Butler 2017', noise=True, seed=None):
+    """
+    Creates an SDFITS table with the scans in `scan`.
+    `on` is True for the scans and feeds pointed at the source,
+    with shape (len(scan), nfd). `procseqn` and `procscan` 
+    are the PROCSEQN and PROCSCAN of each scan.
+    The source, and the `line` if given, are added to these rows.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # One row per scan, integration, feed, spectral window,
+    # polarization, signal state and noise diode state.
+    grid = np.meshgrid(np.arange(len(scan)), np.arange(nint), np.arange(nfd),
+                       np.arange(nif), np.arange(npol), np.arange(len(sigs)), np.arange(2), 
+                       indexing='ij')
+    iscan, intnum, fdnum, ifnum, plnum, isig, cal = [g.ravel() for g in grid]
+    nrow = len(iscan)
+    on = np.asarray(on)[iscan,fdnum]
+    scan = np.asarray(scan)[iscan]
+    procseqn = np.asarray(procseqn)[iscan]
+    procscan = np.asarray(procscan)[iscan]
+    sig = np.array(list(sigs))[isig]
+    cal = np.where(cal == 0, 'T', 'F')
+
+    # Spectral axis.
+    cdelt1 = np.full(nrow, bandwidth/nchan)
+    crpix1 = np.full(nrow, nchan/2. + 1.)
+    crval1 = freq0 + ifnum*bandwidth + np.where(sig == 'F', foffset, 0.)
+    vframe = np.full(nrow, vframe, dtype=float)
+
+    # Time of each integration.
+    exposure = np.full(nrow, tint, dtype=float)
+    time = Time('2021-04-20T00:00:00', scale='utc') + \
+           ((iscan*nint + intnum)*tint*1.2)*u.s
+    time.format = 'isot'
+    time.precision = 2
+
+    # Spectra in counts.
+    table = fits.BinTableHDU.from_columns(_make_columns(nchan), nrows=nrow).data
+    freq_axis = spectral_axis.get_freq_axis({'CRVAL1': crval1, 'CDELT1': cdelt1,
+                                             'CRPIX1': crpix1, 'VFRAME': vframe}, nchan=nchan)
+    freq = spectral_axis.eval_freq_axis(freq_axis)
+    tsou = np.zeros(freq.shape)
+    if source is not None:
+        tsou = tsou + calibrators.sed_values(freq, scale, source, units='K')
+    if line is not None:
+        amp, line_freq, fwhm = line
+        tsou = tsou + amp*np.exp(-4.*np.log(2.)*((freq - line_freq)/fwhm)**2.)
+    tsys_row = tsys*(1. + 0.05*plnum + 0.02*fdnum + 0.1*ifnum)
+    tcal_row = tcal*(1. + 0.05*plnum + 0.02*fdnum + 0.1*ifnum)
+    chan = np.arange(nchan)/nchan
+    bandpass = 1. + 0.2*np.sin(2.*np.pi*(chan[np.newaxis,:] + 0.1*ifnum[:,np.newaxis] + 0.3*plnum[:,np.newaxis]))
+    tant = tsys_row[:,np.newaxis] + np.where(cal == 'T', tcal_row, 0.)[:,np.newaxis] + \
+           on[:,np.newaxis]*tsou
+    if noise:
+        tant *= 1. + rng.standard_normal(tant.shape)/np.sqrt(cdelt1*exposure)[:,np.newaxis]
+    data = 1e6*bandpass*tant
+
+    values = {'OBJECT': source,
+              'BANDWID': bandwidth,
+              'DATE-OBS': time.value,
+              'DURATION': exposure,
+              'EXPOSURE': exposure,
+              'TSYS': 1.,
+              'DATA': data,
+              'TDIM7': f'({nchan},1,1,1)',
+              'CTYPE1': 'FREQ-OBS',
+              'CRVAL1': crval1,
+              'CRPIX1': crpix1,
+              'CDELT1': cdelt1,
+              'CTYPE2': 'RA',
+              'CRVAL2': 202.78 + 1.*(~on) + 0.01*fdnum,
+              'CTYPE3': 'DEC',
+              'CRVAL3': 30.51 + 0.01*fdnum,
+              'SCAN': scan,
+              'OBSMODE': obsmode,
+              'TCAL': tcal_row,
+              'VFRAME': vframe,
+              'OBSFREQ': crval1,
+              'LST': 3600. + (time - time[0]).to('s').value,
+              'AZIMUTH': 180. + 0.01*iscan,
+              'ELEVATIO': 45. + 0.01*iscan,
+              'RESTFREQ': crval1,
+              'FEED': fdnum + 1,
+              'SRFEED': 0,
+              'PROCSEQN': procseqn,
+              'PROCSIZE': 1 if obsmode.startswith('Track') else 2,
+              'PROCSCAN': procscan,
+              'LASTON': np.where(on, scan, 0),
+              'LASTOFF': np.where(on, 0, scan),
+              'SIG': sig,
+              'CAL': cal,
+              'IFNUM': ifnum,
+              'PLNUM': plnum,
+              'FDNUM': fdnum,
+              }
+    for name,value in values.items():
+        table[name][:] = value
+
+    return table
+
+
+def _make_columns(nchan):
+    """
+    Defines the columns of an SDFITS table with `nchan` channels.
+    Uses the columns of `groundhog.sd_fits_io.make_sdfits_table_header`.
+    """
+
+    header = sd_fits_io.make_sdfits_table_header()
+
+    cols = []
+    for i in range(1, header['TFIELDS'] + 1):
+        name = header[f'TTYPE{i}']
+        fmt = header[f'TFORM{i}']
+        if name == 'DATA':
+            fmt = f'{nchan}E'
+        cols.append(fits.Column(name=name, format=fmt, unit=header.get(f'TUNIT{i}')))
+
+    return cols
+
+
+def write_ps_session(filename, overwrite=False, **kwargs):
+    """
+    Writes an SDFITS file with position switched observations
+    of a calibrator source.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the output SDFITS file.
+    overwrite : bool, optional
+        Overwrite `filename` if it exists?
+    kwargs : dict
+        Arguments passed to `make_ps_table`.
+    """
+
+    table = make_ps_table(**kwargs)
+    sd_fits_io.write_new_sdfits(filename, table, overwrite=overwrite)
@@ -10,6 +10,72 @@ from collections import namedtuple
 
 from astropy.io import fits
 
+from groundhog import utils
+from groundhog import profiling
+
+
+# Columns that describe the rows of an SDFITS table.
+# These are cheap to read and are used to select rows.
+META_COLUMNS = ['SCAN', 'IFNUM', 'PLNUM', 'FDNUM', 'SIG', 'CAL', 
+                'OBSMODE', 'PROCSEQN', 'OBJECT']
+
+# Columns used to group the rows in the row index.
+INDEX_COLUMNS = ['SCAN', 'IFNUM', 'PLNUM', 'FDNUM', 'SIG', 'CAL']
+
+RowIndex = namedtuple('RowIndex', ['keys', 'rows', 'offsets'])
+
+
+def get_metadata(table, columns=META_COLUMNS):
+    """
+    Reads the metadata columns of an SDFITS table into memory.
+    
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file. It can be memory-mapped.
+    columns : list, optional
+        Names of the columns to read.
+        Columns not present in `table` are skipped.
+        
+    Returns
+    -------
+    meta : `numpy.recarray`
+        Record array with the selected columns.
+    """
+    
+    names = [col for col in columns if col in table.columns.names]
+    arrays = [np.array(table[col]) for col in names]
+    # Use native byte order for faster comparisons.
+    arrays = [arr.astype(arr.dtype.newbyteorder('=')) for arr in arrays]
+    meta = np.rec.fromarrays(arrays, names=names)
+    
+    return meta
+
+
+def get_rows(table, rows, columns):
+    """
+    Reads some of the columns of selected rows of an SDFITS table.
+    
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file. It can be memory-mapped.
+    rows : array
+        Rows to read.
+    columns : list
+        Names of the columns to read.
+    
+    Returns
+    -------
+    selection : `numpy.recarray`
+        Record array with the selected rows and columns.
+    """
+    
+    arrays = [np.asarray(table[col][rows]) for col in columns]
+    selection = np.rec.fromarrays(arrays, names=columns)
+    
+    return selection
+
 
 def parse_sdfits(table):
     """
@@ -35,10 +101,17 @@ def parse_sdfits(table):
     return uniques
 
 
+Summary = namedtuple('Summary', ['Scan', 'Source', 'Vel', 'Proc', 'Seq',
+                                 'RestF', 'nIF', 'nInt', 'nFd', 'Az', 'El'])
+
+
+@profiling.profiled
 def make_summary(table):
     """
     Creates a summary of the contents of an SDFITS table.
     It tries to imitate the `summary` function in GBTIDL.
+    The rows are sorted by scan once, and all the per scan 
+    values are computed from the sorted columns.
     
     Parameters
     ----------
@@ -51,31 +124,88 @@ def make_summary(table):
         Summary(Scan, Source, Vel, Proc, Seq, RestF, nIF, nInt, nFd, Az, El)
     """
     
-    uniques = parse_sdfits(table)
+    # Group the rows by scan.
+    order = np.argsort(np.asarray(table['SCAN']), kind='stable')
+    scans, starts, counts = np.unique(np.asarray(table['SCAN'])[order], 
+                                      return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(scans)), counts)
     
-    Summary = namedtuple('Summary', ['Scan', 'Source', 'Vel', 'Proc', 'Seq',
-                                     'RestF', 'nIF', 'nInt', 'nFd', 'Az', 'El'])
-    summary = Summary(Scan=[], Source=[], Vel=[], Proc=[], Seq=[],
-                      RestF=[], nIF=[], nInt=[], nFd=[], Az=[], El=[])
+    def column(name):
+        return np.asarray(table[name])[order]
     
-    for scan in uniques.scan:
-        
-        mask = (table['SCAN'] == scan)
-        summary.Scan.append(scan)
-        summary.Source.append(np.unique(table['OBJECT'][mask])[0])
-        summary.Vel.append(np.mean(table['VELOCITY'][mask]))
-        summary.Proc.append(np.unique(table['OBSMODE'][mask]).split(':')[0][0])
-        summary.Seq.append(np.unique(table['PROCSEQN'][mask])[0])
-        summary.RestF.append(np.unique(table['RESTFREQ'][mask])[0])
-        summary.nIF.append(len(np.unique(table['IFNUM'][mask])))
-        summary.nInt.append(mask.sum())
-        summary.nFd.append(np.unique(table['FDNUM'][mask])[0])
-        summary.Az.append(np.mean(table['AZIMUTH'][mask]))
-        summary.El.append(np.mean(table['ELEVATIO'][mask]))
+    def mean(name):
+        # Scans with the same number of rows are stacked and averaged 
+        # along the rows, which gives the same rounding as `np.mean` 
+        # over each scan, unlike summing the runs with `np.add.reduceat`.
+        vals = column(name)
+        means = np.empty(len(scans), dtype=vals.dtype if vals.dtype.kind == 'f' else np.float64)
+        for n in np.unique(counts):
+            sel = np.where(counts == n)[0]
+            means[sel] = np.mean(vals[starts[sel,None] + np.arange(n)], axis=1)
+        return means
+    
+    def first(name):
+        # Smallest value in each scan, like np.unique(...)[0].
+        vals = column(name)
+        return vals[np.lexsort((vals, group))[starts]]
+    
+    def nunique(name):
+        pairs = np.unique(np.rec.fromarrays([group, column(name)], names=['group', 'val']))
+        return np.bincount(pairs['group'], minlength=len(scans))
+    
+    summary = Summary(Scan=scans.tolist(), 
+                      Source=first('OBJECT').tolist(),
+                      Vel=mean('VELOCITY').tolist(), 
+                      Proc=[obsmode.split(':')[0] for obsmode in first('OBSMODE')],
+                      Seq=first('PROCSEQN').tolist(), 
+                      RestF=first('RESTFREQ').tolist(),
+                      nIF=nunique('IFNUM').tolist(), 
+                      nInt=counts.tolist(),
+                      nFd=first('FDNUM').tolist(), 
+                      Az=mean('AZIMUTH').tolist(), 
+                      El=mean('ELEVATIO').tolist())
         
     return summary
 
 
+def save_summary(filename, summary):
+    """
+    Saves a summary created by `make_summary`.
+    
+    Parameters
+    ----------
+    filename : str
+        Output file name. It is saved using `numpy.savez`.
+    summary : `Summary` object
+        Summary to save.
+    """
+    
+    with open(filename, 'wb') as f:
+        np.savez(f, **{field:np.asarray(vals) for field,vals in summary._asdict().items()})
+
+
+def load_summary(filename):
+    """
+    Loads a summary saved with `save_summary`.
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the file with the summary.
+    
+    Returns
+    -------
+    summary : `Summary` object
+        Summary(Scan, Source, Vel, Proc, Seq, RestF, nIF, nInt, nFd, Az, El)
+    """
+    
+    with np.load(filename) as f:
+        summary = Summary(**{field:f[field].tolist() for field in Summary._fields})
+    
+    return summary
+
+
+@profiling.profiled
 def get_table_mask(table, scans=None, ifnum=None, sig=None, cal=None, plnum=None, fdnum=None):
     """
     """
@@ -108,6 +238,327 @@ def get_table_mask(table, scans=None, ifnum=None, sig=None, cal=None, plnum=None
     return mask
 
 
+@profiling.profiled
+def build_row_index(meta):
+    """
+    Groups the rows of an SDFITS table by their
+    (SCAN, IFNUM, PLNUM, FDNUM, SIG, CAL) values.
+    
+    Parameters
+    ----------
+    meta : `numpy.recarray`
+        Metadata of the SDFITS table, as returned by `get_metadata`.
+    
+    Returns
+    -------
+    index : `RowIndex` object
+        RowIndex(keys, rows, offsets). The rows of group `keys[i]`
+        are `rows[offsets[i]:offsets[i+1]]`, in table order.
+    """
+    
+    keys = np.rec.fromarrays([meta[col] for col in INDEX_COLUMNS], 
+                             names=INDEX_COLUMNS)
+    ukeys, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    
+    # Stable sort keeps the table order inside each group.
+    rows = np.argsort(inverse, kind='stable')
+    offsets = np.zeros(len(ukeys) + 1, dtype=int)
+    offsets[1:] = np.cumsum(np.bincount(inverse, minlength=len(ukeys)))
+    
+    index = RowIndex(keys=ukeys.view(np.recarray), rows=rows, offsets=offsets)
+    
+    return index
+
+
+def select_index_groups(index, scans=None, ifnum=None, sig=None, cal=None, plnum=None, fdnum=None):
+    """
+    Finds the groups of a row index matching a selection.
+    
+    Parameters
+    ----------
+    index : `RowIndex` object
+        Row index of the SDFITS table, as returned by `build_row_index`.
+    
+    Returns
+    -------
+    groups : array
+        Position of the selected groups in `index.keys`.
+    """
+    
+    sel = np.ones(len(index.keys), dtype=bool)
+    for col,vals in zip(INDEX_COLUMNS, [scans, ifnum, plnum, fdnum, sig, cal]):
+        if vals is not None:
+            sel &= np.isin(index.keys[col], vals)
+    
+    return np.where(sel)[0]
+
+
+def get_index_rows(index, scans=None, ifnum=None, sig=None, cal=None, plnum=None, fdnum=None):
+    """
+    Finds the rows matching a selection using a row index.
+    The cost scales with the number of groups and selected rows,
+    not with the number of rows in the table.
+    
+    Parameters
+    ----------
+    index : `RowIndex` object
+        Row index of the SDFITS table, as returned by `build_row_index`.
+    
+    Returns
+    -------
+    rows : array
+        Selected rows in table order.
+    """
+    
+    groups = select_index_groups(index, scans=scans, ifnum=ifnum, sig=sig, cal=cal, 
+                                 plnum=plnum, fdnum=fdnum)
+    if len(groups) == 0:
+        return np.array([], dtype=int)
+    
+    rows = np.concatenate([index.rows[index.offsets[g]:index.offsets[g+1]] for g in groups])
+    rows.sort()
+    
+    return rows
+
+
+def get_index_groups(index):
+    """
+    Maps the keys of a row index to their position in the index.
+    
+    Parameters
+    ----------
+    index : `RowIndex` object
+        Row index of the SDFITS table, as returned by `build_row_index`.
+    
+    Returns
+    -------
+    groups : dict
+        Dictionary with (SCAN, IFNUM, PLNUM, FDNUM, SIG, CAL) tuples 
+        as keys and the group number as values.
+    """
+    
+    groups = {tuple(key.tolist()):g for g,key in enumerate(np.asarray(index.keys))}
+    
+    return groups
+
+
+def get_cal_pairs(index, scans=None, ifnum=None, plnum=None, fdnum=None, sig='T'):
+    """
+    Pairs the rows with the noise diode on and off of each
+    scan, spectral window, polarization and feed.
+    Rows are paired in table order.
+    
+    Parameters
+    ----------
+    index : `RowIndex` object
+        Row index of the SDFITS table, as returned by `build_row_index`.
+    
+    Returns
+    -------
+    rows_on : array
+        Rows with the noise diode on.
+    rows_off : array
+        Rows with the noise diode off, paired with `rows_on`.
+    starts : array
+        Index of the first pair of each group.
+    keys : `numpy.recarray`
+        SCAN, IFNUM, PLNUM and FDNUM of each group.
+    """
+    
+    groups = get_index_groups(index)
+    
+    sel = index.keys['CAL'] == 'T'
+    for col,vals in zip(INDEX_COLUMNS, [scans, ifnum, plnum, fdnum, sig]):
+        if vals is not None:
+            sel &= np.isin(index.keys[col], vals)
+    
+    rows_on = []
+    rows_off = []
+    keys = []
+    for g in np.where(sel)[0]:
+        key = tuple(index.keys[g].tolist())
+        g_off = groups.get(key[:-1] + ('F',))
+        if g_off is None:
+            continue
+        on = index.rows[index.offsets[g]:index.offsets[g+1]]
+        off = index.rows[index.offsets[g_off]:index.offsets[g_off+1]]
+        n = min(len(on), len(off))
+        if n == 0:
+            continue
+        rows_on.append(on[:n])
+        rows_off.append(off[:n])
+        keys.append(key[:4])
+    
+    if len(keys) == 0:
+        empty = np.array([], dtype=int)
+        return empty, empty, empty, np.rec.fromarrays([empty]*4, names=INDEX_COLUMNS[:4])
+    
+    starts = np.concatenate(([0], np.cumsum([len(on) for on in rows_on])[:-1]))
+    keys = np.rec.fromrecords(keys, names=INDEX_COLUMNS[:4])
+    
+    return np.concatenate(rows_on), np.concatenate(rows_off), starts, keys
+
+
+def get_mjd(table, rows=None):
+    """
+    Modified Julian date at the middle of each integration,
+    from the DATE-OBS and DURATION columns.
+    
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file.
+    rows : array, optional
+        Rows to use. Defaults to all the rows.
+    
+    Returns
+    -------
+    mjd : array
+        Modified Julian date of each row.
+    """
+    
+    if rows is None:
+        rows = slice(None)
+    
+    date = np.asarray(table['DATE-OBS'][rows]).astype('datetime64[us]')
+    mjd = (date - np.datetime64('1858-11-17T00:00:00'))/np.timedelta64(1, 'D')
+    
+    return mjd + 0.5*np.asarray(table['DURATION'][rows], dtype=float)/86400.
+
+
+def save_row_index(filename, indices):
+    """
+    Saves the row indices of the tables of an SDFITS file.
+    
+    Parameters
+    ----------
+    filename : str
+        Output file name. It is saved using `numpy.savez`.
+    indices : list
+        List with a `RowIndex` object for each table.
+    """
+    
+    arrays = {}
+    for i,index in enumerate(indices):
+        arrays[f'keys{i}'] = np.asarray(index.keys)
+        arrays[f'rows{i}'] = index.rows
+        arrays[f'offsets{i}'] = index.offsets
+    
+    with open(filename, 'wb') as f:
+        np.savez(f, numtab=len(indices), **arrays)
+
+
+def load_row_index(filename):
+    """
+    Loads the row indices saved with `save_row_index`.
+    
+    Parameters
+    ----------
+    filename : str
+        Name of the file with the row indices.
+    
+    Returns
+    -------
+    indices : list
+        List with a `RowIndex` object for each table.
+    """
+    
+    indices = []
+    with np.load(filename) as f:
+        for i in range(int(f['numtab'])):
+            index = RowIndex(keys=f[f'keys{i}'].view(np.recarray), 
+                             rows=f[f'rows{i}'], 
+                             offsets=f[f'offsets{i}'])
+            indices.append(index)
+    
+    return indices
+
+
+def get_ps_pairs(meta):
+    """
+    Finds the pairs of scans of the position switched 
+    procedures (OnOff or OffOn) in an SDFITS table.
+    
+    Parameters
+    ----------
+    meta : `numpy.recarray`
+        Metadata of the SDFITS table, as returned by `get_metadata`.
+    
+    Returns
+    -------
+    pairs : list
+        List of (scan_on, scan_off) tuples, sorted by scan number.
+    """
+    
+    scans, first = np.unique(meta['SCAN'], return_index=True)
+    
+    pairs = set()
+    for scan,i in zip(scans, first):
+        procname = meta['OBSMODE'][i].split(':')[0]
+        if procname not in ["OffOn", "OnOff"]:
+            continue
+        scan_on, scan_off = utils.get_ps_scan_pair(scan, meta['PROCSEQN'][i], procname)
+        if scan_on in scans and scan_off in scans:
+            pairs.add((int(scan_on), int(scan_off)))
+    
+    pairs = sorted(pairs, key=min)
+    
+    return pairs
+
+
+def get_nod_pairs(meta):
+    """
+    Finds the pairs of scans of the nodding procedures in an SDFITS table.
+    
+    Parameters
+    ----------
+    meta : `numpy.recarray`
+        Metadata of the SDFITS table, as returned by `get_metadata`.
+    
+    Returns
+    -------
+    pairs : list
+        List of (first, second) scan tuples, sorted by scan number.
+    """
+    
+    scans, first = np.unique(meta['SCAN'], return_index=True)
+    
+    pairs = set()
+    for scan,i in zip(scans, first):
+        if meta['OBSMODE'][i].split(':')[0] != "Nod":
+            continue
+        if meta['PROCSEQN'][i] == 1:
+            pair = (scan, scan + 1)
+        else:
+            pair = (scan - 1, scan)
+        if pair[0] in scans and pair[1] in scans:
+            pairs.add((int(pair[0]), int(pair[1])))
+    
+    return sorted(pairs)
+
+
+def get_fs_scans(meta):
+    """
+    Finds the frequency switched scans in an SDFITS table.
+    
+    Parameters
+    ----------
+    meta : `numpy.recarray`
+        Metadata of the SDFITS table, as returned by `get_metadata`.
+    
+    Returns
+    -------
+    scans : list
+        Frequency switched scans, sorted.
+    """
+    
+    scans, first = np.unique(meta['SCAN'], return_index=True)
+    
+    return [int(scan) for scan,i in zip(scans, first) 
+            if meta['OBSMODE'][i].split(':')[1:2] == ["FSWITCH"]]
+
+
 def update_table_column(table, column, new_array):
     """
     Parameters
@@ -118,29 +569,267 @@ def update_table_column(table, column, new_array):
         Name of the column to update.
     new_array : np.ndarray
         Array with the new column values.
+        
+    Returns
+    -------
+    new_table : `astropy.io.fits.fitsrec`
+        New table with the updated column. `table` is not modified.
     """
     
-    # Get the original table values.
-    cols = table.columns
-    fmt = cols[column].format
+    return update_table_columns(table, {column: new_array})
+
+
+@profiling.profiled
+def update_table_columns(table, columns, inplace=False):
+    """
+    Updates several columns of an SDFITS table.
+    By default a new table is built once with all the updated columns.
+    With `inplace`, columns whose shape allows it, and whose type can
+    hold the new values without losing precision, are updated in place,
+    and the remaining columns are updated in a single rebuild.
     
-    # Delete the column we will update.
-    cols.del_col(column)
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file to update.
+    columns : dict
+        Dictionary with the column names as keys and 
+        the new column values as values.
+    inplace : bool, optional
+        Update the columns of `table` in place when possible?
+        If False, `table` is not modified and a new table is always built.
+        
+    Returns
+    -------
+    new_table : `astropy.io.fits.fitsrec`
+        Updated table. It will be `table` if `inplace` is set and
+        all the columns could be updated in place.
+    """
     
-    if fmt[-1] == 'A':
-        new_fmt = fmt
-    elif len(new_array.shape) == 1:
-        new_fmt = '1{}'.format(fmt[-1])
-    else:
-        new_fmt = '{}{}'.format(new_array.shape[1], fmt[-1])
+    rebuild = {}
+    for column,new_array in columns.items():
+        new_array = np.asarray(new_array)
+        col = table[column]
+        if inplace and new_array.shape == col.shape and col.flags.writeable and \
+           np.can_cast(new_array.dtype, col.dtype, casting='safe'):
+            col[:] = new_array
+        else:
+            rebuild[column] = new_array
     
-    # Define the updated column.
-    new_col = fits.Column(name=column, format=new_fmt, array=new_array)
+    if inplace and len(rebuild) == 0:
+        return table
     
-    cols.add_col(new_col)
+    # Define the table columns, with the updated columns
+    # in their original position.
+    cols = []
+    for col in table.columns:
+        if col.name in rebuild:
+            new_array = rebuild[col.name]
+            fmt = col.format
+            if fmt[-1] == 'A':
+                new_fmt = fmt
+            elif len(new_array.shape) == 1:
+                new_fmt = '1{}'.format(fmt[-1])
+            else:
+                new_fmt = '{}{}'.format(new_array.shape[1], fmt[-1])
+            cols.append(fits.Column(name=col.name, format=new_fmt, 
+                                    unit=col.unit, array=new_array))
+        else:
+            cols.append(fits.Column(name=col.name, format=col.format, unit=col.unit, 
+                                    dim=col.dim, array=table[col.name]))
     
     # Make it a new table.
     new_hdu = fits.BinTableHDU.from_columns(cols)
     new_table = new_hdu.data
     
     return new_table
+
+
+def chan_slice(window):
+    """
+    Slice with the channels inside a channel `window`.
+    
+    Parameters
+    ----------
+    window : tuple or None
+        First and last (exclusive) channels to keep.
+        None keeps all the channels.
+    """
+    
+    if window is None:
+        return slice(None)
+    
+    return slice(*window)
+
+
+def combine_chan_windows(window, new_window):
+    """
+    Applies `new_window`, with channels counted from the start of 
+    `window`, on top of `window`. Returns the resulting channel window.
+    """
+    
+    if window is None:
+        return tuple(new_window)
+    
+    return (window[0] + new_window[0], window[0] + new_window[1])
+
+
+def read_data(table, rows, window=None, flags=None, dtype=None):
+    """
+    Reads the spectra in `rows`.
+    Only the channels inside `window` are read,
+    and flagged values are replaced with NaN.
+    
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file. It can be memory-mapped.
+    rows : array
+        Rows to read.
+    window : tuple or None, optional
+        First and last (exclusive) channels to keep.
+    flags : `groundhog.flagging.Flags` object, optional
+        Flags of `table`.
+    dtype : data-type, optional
+        Type of the spectra. Defaults to the type of DATA.
+    
+    Returns
+    -------
+    data : array
+        Spectra, one per row.
+    """
+    
+    sl = chan_slice(window)
+    data = np.array(table['DATA'][rows,sl], dtype=dtype)
+    if flags is not None and len(flags) > 0:
+        flags.apply(rows, data, chans=sl)
+    
+    return data
+
+
+@profiling.profiled
+def apply_chan_window(table, window):
+    """
+    Keeps only the channels inside a channel window.
+    DATA, and TCAL if it is a vector, are trimmed and CRPIX1 is shifted 
+    so the frequency axis is preserved. `table` is not modified.
+    
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file.
+    window : tuple or None
+        First and last (exclusive) channels to keep.
+        None keeps all the channels.
+        
+    Returns
+    -------
+    new_table : `astropy.io.fits.fitsrec`
+        Table with the selected channels. 
+        It will be `table` if `window` is None.
+    """
+    
+    if window is None:
+        return table
+    
+    sl = chan_slice(window)
+    data = table['DATA']
+    columns = {'DATA': data[...,sl], 
+               'CRPIX1': table['CRPIX1'] - window[0]}
+    if 'TCAL' in table.columns.names and table['TCAL'].shape == data.shape:
+        columns['TCAL'] = table['TCAL'][...,sl]
+    
+    return update_table_columns(table, columns)
+
+
+@profiling.profiled
+def select_rows(table, rows, window=None, flags=None, template=None):
+    """
+    Selects rows of an SDFITS table, with the channel window applied
+    and the flagged values replaced with NaN.
+    Only the channels inside `window` are read, and the selection
+    is built once, without copying the rows at full width first.
+    
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file. It can be memory-mapped.
+    rows : array
+        Rows to select.
+    window : tuple or None, optional
+        First and last (exclusive) channels to keep.
+    flags : `groundhog.flagging.Flags` object, optional
+        Flags of `table`.
+    template : `astropy.io.fits.fitsrec`, optional
+        Table with the layout of the selection, i.e., 
+        ``apply_chan_window(table[:1], window)``. 
+        Pass it to avoid building it on every call.
+        
+    Returns
+    -------
+    selection : `astropy.io.fits.fitsrec`
+        New table with the selected rows.
+    """
+    
+    rows = np.asarray(rows, dtype=int)
+    
+    if window is None:
+        selection = table[rows]
+        if flags is not None and len(flags) > 0:
+            flags.apply(rows, selection['DATA'])
+        return selection
+    
+    if template is None:
+        template = apply_chan_window(table[:1], window)
+    if len(rows) == 0:
+        return template[:0]
+    
+    # Fill a copy of the template with the selected rows.
+    sl = chan_slice(window)
+    vector_tcal = 'TCAL' in table.columns.names and template['TCAL'].shape == template['DATA'].shape
+    selection = template[np.zeros(len(rows), dtype=int)]
+    for name in table.columns.names:
+        if name == 'DATA':
+            selection[name][:] = read_data(table, rows, window=window, flags=flags)
+        elif name == 'TCAL' and vector_tcal:
+            selection[name][:] = table[name][rows,sl]
+        elif name == 'CRPIX1':
+            selection[name][:] = table[name][rows] - window[0]
+        else:
+            selection[name][:] = table[name][rows]
+    
+    return selection
+
+
+@profiling.profiled
+def concatenate_tables(tables):
+    """
+    Concatenates the rows of SDFITS tables with the same columns.
+    
+    Parameters
+    ----------
+    tables : list
+        List of `astropy.io.fits.fitsrec` to concatenate.
+        
+    Returns
+    -------
+    new_table : `astropy.io.fits.fitsrec`
+        Table with the rows of all the tables.
+    """
+    
+    if len(tables) == 1:
+        return tables[0]
+    
+    nrows = np.array([len(table) for table in tables])
+    starts = np.concatenate(([0], np.cumsum(nrows)))
+    
+    first = tables[0]
+    cols = [fits.Column(name=col.name, format=col.format, unit=col.unit, 
+                        dim=col.dim, array=first[col.name]) for col in first.columns]
+    new_table = fits.BinTableHDU.from_columns(cols, nrows=nrows.sum()).data
+    
+    for table,i0,i1 in zip(tables[1:], starts[1:-1], starts[2:]):
+        for name in first.columns.names:
+            new_table[name][i0:i1] = table[name]
+    
+    return new_table
@@ -0,0 +1,302 @@
+"""
+Smoothing and decimation of spectra.
+
+Spectra are convolved with a boxcar, Hanning or Gaussian kernel, and
+decimated by averaging consecutive blocks of channels. The decimation
+factor does not need to divide the number of channels, or to be an
+integer: fractional channels are weighted by the fraction inside each block.
+Invalid values (NaN or inf) are ignored, and near the edges the kernel
+is normalized over the channels inside the spectra.
+"""
+
+import numpy as np
+
+from groundhog import flagging
+from groundhog import profiling
+from groundhog import sd_fits_utils
+
+
+def make_kernel(kind='hanning', width=3):
+    """
+    Smoothing kernel, normalized to unit sum.
+
+    Parameters
+    ----------
+    kind : {'boxcar', 'hanning', 'gaussian'}, optional
+        Kernel shape.
+    width : float, optional
+        Width of the kernel in channels. For a boxcar it is the
+        number of channels averaged, for a Hanning kernel the number
+        of non-zero weights (3 gives weights of 1/4, 1/2 and 1/4),
+        and for a Gaussian its full width at half maximum.
+
+    Returns
+    -------
+    kernel : array
+        Kernel weights. It has an odd number of elements,
+        with its center at the middle element.
+    """
+
+    if kind == 'boxcar':
+        n = int(round(width))
+        kernel = np.ones(n + 1 - n%2)
+        if n%2 == 0:
+            # Keep the kernel centered.
+            kernel[[0,-1]] = 0.5
+    elif kind == 'hanning':
+        n = int(round(width))
+        n += 1 - n%2
+        kernel = np.hanning(n + 2)[1:-1]
+    elif kind == 'gaussian':
+        sigma = width/np.sqrt(8.*np.log(2.))
+        half = int(np.ceil(4.*sigma))
+        kernel = np.exp(-0.5*(np.arange(-half, half + 1)/sigma)**2.)
+    else:
+        raise ValueError(f"Unknown kernel: {kind}.")
+
+    return kernel/kernel.sum()
+
+
+def _convolve(values, kernel, method):
+    """
+    Convolves each row of `values` with a centered `kernel`.
+    Channels outside the spectra are zero.
+    """
+
+    nchan = values.shape[-1]
+    half = len(kernel)//2
+
+    if method == 'fft':
+        nfft = nchan + len(kernel) - 1
+        conv = np.fft.irfft(np.fft.rfft(values, nfft, axis=-1)*np.fft.rfft(kernel, nfft), nfft, axis=-1)
+        return conv[...,half:half+nchan]
+
+    if method != 'direct':
+        raise ValueError(f"Unknown method: {method}.")
+
+    conv = np.zeros(values.shape, dtype=np.float64)
+    for k,w in enumerate(kernel):
+        s = k - half
+        lo = max(0, -s)
+        hi = min(nchan, nchan - s)
+        conv[...,lo:hi] += w*values[...,lo+s:hi+s]
+
+    return conv
+
+
+@profiling.profiled
+def smooth(data, kind='hanning', width=3, method=None, chunk=1024):
+    """
+    Smooths every row of `data` with a kernel.
+
+    Parameters
+    ----------
+    data : array
+        Spectra, one per row.
+    kind : {'boxcar', 'hanning', 'gaussian'}, optional
+        Kernel shape. See `make_kernel`.
+    width : float, optional
+        Width of the kernel in channels. See `make_kernel`.
+    method : {'direct', 'fft'}, optional
+        Convolve directly, or using FFTs. By default,
+        FFTs are used for kernels longer than 64 channels.
+    chunk : int, optional
+        Number of rows to smooth at a time.
+
+    Returns
+    -------
+    smoothed : array
+        Smoothed spectra, with the type of `data`.
+        Channels without valid values within the kernel are NaN.
+    """
+
+    kernel = make_kernel(kind, width)
+    if method is None:
+        method = 'fft' if len(kernel) > 64 else 'direct'
+
+    data = np.asarray(data)
+    dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+    smoothed = np.empty(data.shape, dtype=dtype)
+    data2d = data.reshape(-1, data.shape[-1])
+    out2d = smoothed.reshape(-1, data.shape[-1])
+    for r0 in range(0, len(data2d), chunk):
+        block = data2d[r0:r0+chunk]
+        valid = np.isfinite(block)
+        num = _convolve(np.where(valid, block, 0.), kernel, method)
+        den = _convolve(valid.astype(np.float64), kernel, method)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out2d[r0:r0+chunk] = np.where(den > 1e-8, num/den, np.nan)
+    profiling.add(rows=len(data2d), taps=len(kernel))
+
+    return smoothed
+
+
+def decimated_nchan(nchan, factor):
+    """
+    Number of channels after decimating `nchan` channels by `factor`.
+    Channels that do not fill a whole block at the end are dropped.
+    """
+
+    return int(np.floor(nchan/factor + 1e-9))
+
+
+@profiling.profiled
+def decimate(data, factor):
+    """
+    Averages blocks of `factor` consecutive channels.
+    Output channel ``j`` covers input channels from ``j*factor`` to
+    ``(j + 1)*factor``. When `factor` is not an integer, the channels
+    at the block edges are weighted by the fraction inside the block.
+    Invalid values are ignored.
+
+    Parameters
+    ----------
+    data : array
+        Spectra, one per row.
+    factor : float
+        Decimation factor. At least one.
+
+    Returns
+    -------
+    decimated : array
+        Decimated spectra, with the type of `data`, and
+        ``decimated_nchan(nchan, factor)`` channels.
+        Blocks without valid values are NaN.
+    """
+
+    if factor < 1:
+        raise ValueError(f"The decimation factor must be at least one, not {factor}.")
+
+    data = np.asarray(data)
+    dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+    nchan = data.shape[-1]
+    nout = decimated_nchan(nchan, factor)
+    valid = np.isfinite(data)
+    values = np.where(valid, data, 0.)
+
+    if abs(factor - round(factor)) < 1e-9:
+        # Whole blocks of channels.
+        f = int(round(factor))
+        shape = data.shape[:-1] + (nout, f)
+        num = values[...,:nout*f].reshape(shape).sum(axis=-1, dtype=np.float64)
+        den = valid[...,:nout*f].reshape(shape).sum(axis=-1)
+    else:
+        # Integrate the spectra up to the block edges,
+        # with the channels as piecewise constant.
+        edges = np.arange(nout + 1)*factor
+        k = np.minimum(np.floor(edges).astype(int), nchan)
+        frac = edges - k
+        pad = [(0, 0)]*(data.ndim - 1) + [(1, 0)]
+        def integral(vals):
+            cum = np.pad(np.cumsum(vals, axis=-1, dtype=np.float64), pad)
+            ext = np.pad(vals, [(0, 0)]*(data.ndim - 1) + [(0, 1)]).astype(np.float64)
+            return cum[...,k] + frac*ext[...,k]
+        num = np.diff(integral(values), axis=-1)
+        den = np.diff(integral(valid), axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        decimated = np.where(den > 0, num/den, np.nan).astype(dtype)
+    profiling.add(bytes_alloc=decimated.nbytes)
+
+    return decimated
+
+
+def smooth_decimate(data, kind=None, width=3, factor=1, method=None):
+    """
+    Smooths `data` with `smooth`, unless `kind` is None,
+    and then decimates it with `decimate`.
+    """
+
+    if kind is not None:
+        data = smooth(data, kind=kind, width=width, method=method)
+    if factor != 1:
+        data = decimate(data, factor)
+
+    return data
+
+
+def decimate_axis(crpix1, cdelt1, factor):
+    """
+    Reference pixel and channel width after decimating by `factor`.
+    The frequency of each output channel is the average
+    frequency of the input channels it covers.
+    """
+
+    crpix1 = np.asarray(crpix1, dtype=float)
+
+    return (crpix1 - 0.5)/factor + 0.5, np.asarray(cdelt1, dtype=float)*factor
+
+
+@profiling.profiled
+def smooth_table(table, kind=None, width=3, factor=1, window=None, flags=None, method=None,
+                 chunk=1024):
+    """
+    Smooths and decimates the spectra of an SDFITS table.
+    DATA is read `chunk` rows at a time, so `table` can be memory-mapped,
+    and only the decimated spectra are kept in memory.
+
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Contents of the SDFITS file. It is not modified.
+    kind : {'boxcar', 'hanning', 'gaussian'}, optional
+        Smoothing kernel. No smoothing by default. See `make_kernel`.
+    width : float, optional
+        Width of the kernel in channels.
+    factor : float, optional
+        Decimation factor. See `decimate`.
+    window : tuple, optional
+        First and last (exclusive) channels to use.
+    flags : `groundhog.flagging.Flags` object, optional
+        Flags of `table`. Flagged values are ignored.
+    method : {'direct', 'fft'}, optional
+        Convolution method. See `smooth`.
+    chunk : int, optional
+        Number of rows to process at a time.
+
+    Returns
+    -------
+    new_table : `astropy.io.fits.fitsrec`
+        Table with the smoothed and decimated spectra.
+        CRPIX1 and CDELT1, and TCAL if it is a vector, are updated to match.
+    """
+
+    sl = sd_fits_utils.chan_slice(window)
+    nchan = len(range(table['DATA'].shape[-1])[sl])
+    nrow = len(table)
+
+    data = np.empty((nrow, decimated_nchan(nchan, factor)), dtype=table['DATA'].dtype.type)
+    for r0 in range(0, nrow, chunk):
+        rows = np.arange(r0, min(r0 + chunk, nrow))
+        block = sd_fits_utils.read_data(table, rows, window=window, flags=flags, dtype=np.float64)
+        data[r0:r0+chunk] = smooth_decimate(block, kind=kind, width=width, factor=factor,
+                                            method=method)
+
+    crpix1 = np.asarray(table['CRPIX1'], dtype=float) - (0 if window is None else window[0])
+    crpix1, cdelt1 = decimate_axis(crpix1, table['CDELT1'], factor)
+    columns = {'DATA': data, 'CRPIX1': crpix1, 'CDELT1': cdelt1}
+    if 'TCAL' in table.columns.names and table['TCAL'].shape == table['DATA'].shape:
+        columns['TCAL'] = decimate(np.asarray(table['TCAL'][:,sl], dtype=float), factor)
+
+    return sd_fits_utils.update_table_columns(table, columns)
+
+
+@profiling.profiled
+def smooth_sdfits(sdfits, kind=None, width=3, factor=1, method=None, chunk=1024):
+    """
+    Smooths and decimates all the tables of an SDFITS object,
+    e.g., right after reading it, to reduce the data carried through
+    the calibration. The tables are replaced by the decimated ones,
+    which are kept in memory. The channel windows and flags are
+    applied to the new tables, and are reset.
+    See `smooth_table` for the parameters.
+    """
+
+    for i in range(sdfits.numtab):
+
+        sdfits.table[i] = smooth_table(sdfits.table[i], kind=kind, width=width, factor=factor,
+                                       window=sdfits.chan_window[i], flags=sdfits.flags[i],
+                                       method=method, chunk=chunk)
+        sdfits.chan_window[i] = None
+        sdfits.flags[i] = flagging.Flags()
+        sdfits.history.append([i, 'SMOOTH', [kind, width, factor]])
@@ -6,7 +6,181 @@ import numpy as np
 from astropy import units as u
 from astropy import constants as ac
 
+from collections import namedtuple
 
+from groundhog import profiling
+
+
+FreqAxis = namedtuple('FreqAxis', ['crval1', 'cdelt1', 'crpix1', 'doppler', 'nchan'])
+
+# Speed of light in m/s.
+c_ms = ac.c.to('m/s').value
+
+
+def get_doppler(vframe, apply_doppler=True):
+    """
+    Doppler factor of the reference frame.
+    
+    Parameters
+    ----------
+    vframe : array
+        Radial velocity of the reference frame in m/s.
+    apply_doppler : bool, optional
+        If False the Doppler factor will be one.
+    
+    Returns
+    -------
+    doppler : array
+        Doppler factor.
+    """
+    
+    beta = np.asarray(vframe, dtype=float)/c_ms
+    
+    if apply_doppler:
+        doppler = np.sqrt((1.0 + beta)/(1.0 - beta))
+    else:
+        doppler = np.ones_like(beta)
+    
+    return doppler
+
+
+def get_freq_axis(table, apply_doppler=True, nchan=None):
+    """
+    Compact representation of the frequency axis of each row.
+    The frequency of channel ``chan``, counting from 1, is
+    ``(crval1 + cdelt1*(chan - crpix1))*doppler``.
+    
+    Parameters
+    ----------
+    table : `astropy.io.fits.fitsrec`
+        Rows of an SDFITS table.
+    apply_doppler : bool, optional
+        Apply the Doppler correction?
+    nchan : int, optional
+        Number of channels. 
+        If not given it is taken from the DATA column.
+    
+    Returns
+    -------
+    freq_axis : `FreqAxis` object
+        FreqAxis(crval1, cdelt1, crpix1, doppler, nchan).
+        Frequencies are in Hz.
+    """
+    
+    if nchan is None:
+        nchan = table['DATA'].shape[-1]
+    
+    freq_axis = FreqAxis(crval1=np.asarray(table['CRVAL1'], dtype=float),
+                         cdelt1=np.asarray(table['CDELT1'], dtype=float),
+                         crpix1=np.asarray(table['CRPIX1'], dtype=float),
+                         doppler=get_doppler(table['VFRAME'], apply_doppler=apply_doppler),
+                         nchan=nchan)
+    
+    return freq_axis
+
+
+@profiling.profiled
+def eval_freq_axis(freq_axis, chan=None):
+    """
+    Evaluates a compact frequency axis.
+    
+    Parameters
+    ----------
+    freq_axis : `FreqAxis` object
+        Frequency axis, as returned by `get_freq_axis`.
+    chan : array, optional
+        Channels where to evaluate the frequency axis, counting from 1.
+        Fractional channels are allowed.
+        Defaults to all the channels.
+    
+    Returns
+    -------
+    freq : array
+        Frequency in Hz. It has one row for each row of `freq_axis`.
+    """
+    
+    if chan is None:
+        chan = np.arange(1, freq_axis.nchan + 1)
+    chan = np.asarray(chan, dtype=float)
+    
+    crv1 = freq_axis.crval1[...,np.newaxis]
+    cd1 = freq_axis.cdelt1[...,np.newaxis]
+    crp1 = freq_axis.crpix1[...,np.newaxis]
+    doppler = freq_axis.doppler[...,np.newaxis]
+    
+    freq = (crv1 + cd1*(chan - crp1))*doppler
+    profiling.add(arrays=1, bytes_alloc=freq.nbytes)
+    
+    return freq
+
+
+def average_freq_axis(freq_axis, weights, starts=None):
+    """
+    Weighted average of the frequency axis of several rows.
+    
+    Parameters
+    ----------
+    freq_axis : `FreqAxis` object
+        Frequency axis, as returned by `get_freq_axis`.
+    weights : array
+        Weight of each row.
+    starts : array, optional
+        Index of the first row of each group of rows to average.
+        If not given all the rows are averaged together.
+    
+    Returns
+    -------
+    freq_axis : `FreqAxis` object
+        Averaged frequency axis.
+    """
+    
+    # The frequency axis is linear in channel number,
+    # so its average is determined by the average of 
+    # its value at channel zero and its slope.
+    f0 = (freq_axis.crval1 - freq_axis.cdelt1*freq_axis.crpix1)*freq_axis.doppler
+    df = freq_axis.cdelt1*freq_axis.doppler
+    
+    if starts is None:
+        f0 = np.sum(f0*weights)/np.sum(weights)
+        df = np.sum(df*weights)/np.sum(weights)
+    else:
+        f0 = np.add.reduceat(f0*weights, starts)/np.add.reduceat(weights, starts)
+        df = np.add.reduceat(df*weights, starts)/np.add.reduceat(weights, starts)
+    
+    avg_freq_axis = FreqAxis(crval1=f0, cdelt1=df, crpix1=np.zeros_like(f0),
+                             doppler=np.ones_like(f0), nchan=freq_axis.nchan)
+    
+    return avg_freq_axis
+
+
+def block_freq_axis(freq_axis, avgf):
+    """
+    Frequency of blocks of `avgf` channels.
+    It is equivalent to averaging the frequency axis
+    in blocks of `avgf` channels.
+    
+    Parameters
+    ----------
+    freq_axis : `FreqAxis` object
+        Frequency axis, as returned by `get_freq_axis`.
+    avgf : float
+        Number of channels in each block.
+        Blocks can include fractions of channels,
+        as in `groundhog.smoothing.decimate`.
+    
+    Returns
+    -------
+    freq : array
+        Frequency at the center of each block in Hz.
+    """
+    
+    nblock = int(np.floor(freq_axis.nchan/avgf + 1e-9))
+    chan = np.arange(nblock)*avgf + (avgf + 1.)/2.
+    
+    return eval_freq_axis(freq_axis, chan=chan)
+
+
+@profiling.profiled
 def compute_freq_axis(table, chstart=1, chstop=-1, apply_doppler=True):
     """
     """
@@ -14,38 +188,14 @@ def compute_freq_axis(table, chstart=1, chstop=-1, apply_doppler=True):
     # Copied from GBT gridder: 
     # https://github.com/nrao/gbtgridder/blob/master/src/get_data.py
     
-    shape = table.field('data').shape
-    if len(shape) == 1:
-        ax = 0
-    elif len(shape) == 2:
-        ax = 1
+    freq_axis = get_freq_axis(table, apply_doppler=apply_doppler)
     
     if chstop == -1:
-        chstop = shape[ax] + 1
-        
-    freq = np.zeros(shape)
-
-    crv1 = table.field('crval1')*u.Hz
-    cd1 = table.field('cdelt1')*u.Hz
-    crp1 = table.field('crpix1')
-    vframe = table.field('vframe')*u.m/u.s
-    #frest = data.field('restfreq')
-    
-    # Observatory redshift.
-    beta = vframe/ac.c
-    
-    # Doppler correction.
-    doppler = np.ones_like(beta)
-    if apply_doppler:
-        doppler = np.sqrt((1.0 + beta)/(1.0 - beta))
+        chstop = freq_axis.nchan + 1
     
     # Full frequency axis in doppler tracked frame from first row.
     # FITS counts from 1, this indx refers to the original axis, before chan selection.
     indx = np.arange(chstop - chstart) + chstart
-    if ax == 1:
-        indx = np.tile(indx, (shape[0],1))
-        freq[:,:] = (crv1[:,np.newaxis] + cd1[:,np.newaxis]*(indx - crp1[:,np.newaxis]))*doppler[:,np.newaxis]
-    else:
-        freq = (crv1 + cd1*(indx - crp1))*doppler
+    freq = eval_freq_axis(freq_axis, chan=indx)
         
     return freq*u.Hz
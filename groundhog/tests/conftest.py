@@ -2,6 +2,7 @@ import pytest
 import numpy as np
 
 from groundhog import sd_fits_io
+from groundhog import sd_fits_sim
 
 
 # Arrange
@@ -13,6 +14,16 @@ def sd_fits_table():
 def sd_fits_table_hi():
     return sd_fits_io.read_sdfits('data/TGBT20A_506_01.raw.vegas.A.fits')
 
+@pytest.fixture(scope="session")
+def ps_session(tmp_path_factory):
+    # Writes a simulated position switched session in a new directory
+    # and returns its file name. See `sd_fits_sim.write_ps_session`.
+    def write(seed=1, **kwargs):
+        filename = str(tmp_path_factory.mktemp('sim') / 'sim.fits')
+        sd_fits_sim.write_ps_session(filename, seed=seed, **kwargs)
+        return filename
+    return write
+
 @pytest.fixture(scope="module")
 def gbtidl_spec():
     return np.loadtxt("data/AGBT19B_332_04_scan5_ifnum4_intnum1_plnum0.ascii", skiprows=3)
@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+
+from groundhog import baseline
+from groundhog import datared
+from groundhog import sd_fits_io
+from groundhog.scan import Scan
+
+
+def make_spectra(nrow=50, nchan=400, seed=1):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1., 1., nchan)
+    coefs = rng.normal(size=(nrow, 3))
+    base = coefs[:,:1] + coefs[:,1:2]*x + coefs[:,2:]*x**2.
+    line = 5.*np.exp(-0.5*((np.arange(nchan) - 200.)/5.)**2.)
+    return base + line, base, line
+
+
+def test_subtract_baseline():
+    data, base, line = make_spectra()
+    data[3,10] = np.nan
+    data[4,:] = np.nan
+    residual, coefs = baseline.subtract_baseline(data.astype(np.float32), order=2, 
+                                                 exclude=[(170, 230)], chunk=16)
+    assert residual.dtype == np.float32
+    assert coefs.shape == (50, 3)
+    expc = np.tile(line, (50, 1))
+    expc[3,10] = np.nan
+    expc[4] = np.nan
+    # The invalid values are left as they are.
+    np.testing.assert_allclose(residual, expc, atol=1e-4)
+    assert np.all(np.isnan(coefs[4]))
+    # Same as fitting each row.
+    mask = baseline.line_free_mask(400, exclude=[(170, 230)])
+    x = np.linspace(-1., 1., 400)
+    fit = np.polynomial.legendre.legfit(x[mask], data[0,mask], 2)
+    np.testing.assert_allclose(coefs[0], fit, rtol=1e-4)
+
+
+def test_spline_design():
+    design = baseline.spline_design(100, 4, degree=3)
+    assert design.shape == (100, 8)
+    # B-splines are a partition of unity.
+    np.testing.assert_allclose(design.sum(axis=1), 1.)
+    # A cubic is fitted exactly.
+    data, base, line = make_spectra(nrow=2, nchan=100)
+    residual, _ = baseline.subtract_baseline(base, order=3, kind='spline', nknots=4)
+    np.testing.assert_allclose(residual, 0., atol=1e-10)
+
+
+def test_subtract_baseline_sdfits(ps_session):
+    filename = ps_session(npairs=2, nint=2, npol=2, nchan=256)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    sdfits.remove_edge_chans(chan0=16, chanf=240)
+    cal = datared.get_ps_all(sdfits, avgf_min=16)
+    expc = np.array(cal.table[0]['DATA'])
+    scan = Scan(cal.table[0])
+    coefs = scan.subtract_baseline(order=1, exclude=[(100, 120)])
+    baseline.subtract_baseline_sdfits(cal, order=1, exclude=[(100, 120)], chunk=3)
+    np.testing.assert_allclose(cal.table[0]['DATA'], scan.data, rtol=1e-5, atol=1e-5)
+    assert coefs.shape == (len(expc), 2)
+    assert not np.allclose(cal.table[0]['DATA'], expc)
+    # Rows that cannot be fitted are left unchanged.
+    data = np.array(cal.table[0]['DATA'])
+    nchan = data.shape[1]
+    cal.flags[0].add([1], np.ones((1, nchan), dtype=bool))
+    baseline.subtract_baseline_sdfits(cal, order=1, exclude=[(100, 120)], chunk=3)
+    np.testing.assert_array_equal(cal.table[0]['DATA'][1], data[1])
+    assert np.all(np.isfinite(cal.table[0]['DATA'][:,16:240]))
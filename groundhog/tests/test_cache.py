@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+
+from groundhog import cache
+from groundhog import datared
+from groundhog import sd_fits_io
+
+
+def test_cache(tmp_path, ps_session):
+    filename = ps_session(nchan=256)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    cache_ = cache.Cache(str(tmp_path / 'cache'))
+    
+    tcal = datared.get_tcal(sdfits, 1, ifnum=0, plnum=0, cache=cache_)
+    assert len(cache_.info()) == 1
+    tcal_ = datared.get_tcal(sdfits, 1, ifnum=0, plnum=0, cache=cache_)
+    np.testing.assert_array_equal(tcal.value, tcal_.value)
+    assert tcal.unit == tcal_.unit
+    assert len(cache_.info()) == 1
+    
+    ref = datared.prepare_mapping_off(sdfits, 1, cache=cache_)
+    ref_ = datared.prepare_mapping_off(sdfits, 1, cache=cache_)
+    np.testing.assert_array_equal(ref.data, ref_.data)
+    assert ref.tsys == ref_.tsys
+    
+    # Changing the tables changes the key.
+    sdfits.update_tcal(1, cache=cache_)
+    datared.get_tcal(sdfits, 1, ifnum=0, plnum=0, cache=cache_)
+    assert len(cache_.info()) == 4
+    assert len(sdfits.history) == 1
+    # The update is recorded without hashing the whole column.
+    assert sdfits.history[0][:2] == [0, 'TCAL']
+    assert sdfits.history[0][2][:3] == [list(sdfits.table[0]['DATA'].shape), '<f8', 1]
+    
+    cache_.invalidate(name='datared.get_tcal')
+    assert len(cache_.info()) == 2
+    cache_.invalidate(filename=filename)
+    assert len(cache_.info()) == 0
+    
+    datared.get_tcal(sdfits, 1, ifnum=0, plnum=0, cache=cache_)
+    cache_.evict(max_bytes=0)
+    assert len(cache_.info()) == 0
+
+
+def test_cache_dtype(tmp_path, ps_session):
+    filename = ps_session(nchan=256)
+    cache_ = cache.Cache(str(tmp_path / 'cache'))
+    
+    sdfits64 = sd_fits_io.read_sdfits(filename)
+    sdfits32 = sd_fits_io.read_sdfits(filename, dtype=np.float32)
+    tcal64 = datared.get_tcal(sdfits64, 1).value
+    tcal32 = datared.get_tcal(sdfits32, 1).value
+    assert not np.array_equal(tcal64, tcal32)
+    
+    for sdfits,tcal in [(sdfits64, tcal64), (sdfits32, tcal32)]:
+        cached = datared.get_tcal(sdfits, 1, cache=cache_).value
+        np.testing.assert_array_equal(cached, tcal)
+    # The float32 product is computed, not taken from the float64 one.
+    assert len(cache_.info()) == 2
+    np.testing.assert_array_equal(datared.get_tcal(sdfits32, 1, cache=cache_).value, tcal32)
+    assert len(cache_.info()) == 2
+    
+    # Flags added directly to the object change the key too.
+    sdfits32.flags[0].add([0], np.arange(256) == 10)
+    datared.get_tcal(sdfits32, 1, cache=cache_)
+    assert len(cache_.info()) == 3
@@ -1,8 +1,13 @@
 import pytest
 import numpy as np
 
+from astropy.io import fits
+
 from groundhog import sd_fits
 from groundhog import datared
+from groundhog import sd_fits_io
+from groundhog import sd_fits_sim
+from groundhog import sd_fits_utils
 
 
 def test_get_ps(sd_fits_table, sd_fits_table_hi, gbtidl_spec, gbtidl_spec_hi):
@@ -17,3 +22,113 @@ def test_get_ps(sd_fits_table, sd_fits_table_hi, gbtidl_spec, gbtidl_spec_hi):
     sdfits = sd_fits_table_hi
     tsou = datared.get_ps(sdfits, 6, plnum=0, method='gbtidl')
     np.testing.assert_allclose(tsou, gbtidl_spec_hi[:,1], rtol=0.02)
+
+def test_get_ps_all(sd_fits_table):
+    sdfits = sd_fits_table
+    for method in ['vector', 'gbtidl', 'classic']:
+        cal = datared.get_ps_all(sdfits, ifnum=4, plnum=0, method=method)
+        table = cal.table[0]
+        assert len(table) == 1
+        tsou = datared.get_ps(sdfits, 5, ifnum=4, plnum=0, method=method)
+        np.testing.assert_allclose(table['DATA'][0], tsou, rtol=1e-5)
+
+
+
+def test_get_tcal_all(ps_session):
+    filename = ps_session(nif=2, npol=2, nchan=512)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    tcals = datared.get_tcal_all(sdfits, 1)
+    assert sorted(tcals.keys()) == [(0,0,0), (0,1,0), (1,0,0), (1,1,0)]
+    for (ifnum,plnum,fdnum),tcal in tcals.items():
+        tcal_ = datared.get_tcal(sdfits, 1, ifnum=ifnum, plnum=plnum)
+        np.testing.assert_allclose(tcal.value, tcal_.value)
+    sdfits.update_tcal(1)
+    rows = sdfits.get_scans([1,2], ifnum=1, plnum=0).table
+    np.testing.assert_allclose(rows['TCAL'], np.tile(tcals[(1,0,0)].value, (len(rows),1)))
+
+
+def test_get_tcal_all_session(tmp_path):
+    # Only the second file has the pair with scan 3.
+    table = sd_fits_sim.make_ps_table(npairs=2, nchan=512, seed=1)
+    filenames = [str(tmp_path / 'a.fits'), str(tmp_path / 'b.fits')]
+    fits.BinTableHDU(table[table['SCAN'] <= 3], name='SINGLE DISH').writeto(filenames[0])
+    fits.BinTableHDU(table[table['SCAN'] >= 3], name='SINGLE DISH').writeto(filenames[1])
+    tcals = datared.get_tcal_all(sd_fits_io.read_session(filenames), 3)
+    expc = datared.get_tcal_all(sd_fits_io.read_sdfits(filenames[1]), 3)
+    assert sorted(tcals.keys()) == sorted(expc.keys()) == [(0,0,0), (0,1,0)]
+    for key,tcal in tcals.items():
+        np.testing.assert_allclose(tcal.value, expc[key].value)
+    with pytest.warns(UserWarning):
+        assert datared.get_tcal_all(sd_fits_io.read_sdfits(filenames[0]), 3) is None
+
+
+def test_get_ps_float32(ps_session):
+    filename = ps_session(npairs=2, nif=2, nchan=1024)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    sdfits32 = sd_fits_io.read_sdfits(filename, dtype=np.float32)
+    assert sdfits32.get_scans(1, ifnum=0, plnum=0).data.dtype == np.float32
+    for method in ['vector', 'gbtidl', 'classic']:
+        tsou = datared.get_ps(sdfits, 3, ifnum=1, plnum=1, method=method, avgf_min=16)
+        tsou32 = datared.get_ps(sdfits32, 3, ifnum=1, plnum=1, method=method, avgf_min=16)
+        assert tsou32.dtype == np.float32
+        np.testing.assert_allclose(tsou32, tsou, rtol=1e-5)
+        cal = datared.get_ps_all(sdfits, method=method, avgf_min=16).table[0]['DATA']
+        cal32 = datared.get_ps_all(sdfits32, method=method, avgf_min=16).table[0]['DATA']
+        np.testing.assert_allclose(cal32, cal, rtol=1e-5)
+
+
+def test_get_fs_all(tmp_path):
+    filename = str(tmp_path / 'sim.fits')
+    for foffset in [-6.25e6, -5e6]:
+        table = sd_fits_sim.make_fs_table(nscans=2, nif=2, npol=2, nchan=1024, foffset=foffset,
+                                          line=(1., 1.45e9, 1e6), seed=1)
+        sd_fits_io.write_new_sdfits(filename, table, overwrite=True)
+        sdfits = sd_fits_io.read_sdfits(filename)
+        for method in ['vector', 'gbtidl']:
+            cal = datared.get_fs_all(sdfits, method=method, avgf_min=16)
+            table = cal.table[0]
+            assert len(table) == 2*2*2
+            assert np.all(table['SIG'] == 'T')
+            # The line is in the second spectral window.
+            peak = np.nanmax(table['DATA'], axis=1)
+            np.testing.assert_allclose(peak[table['IFNUM'] == 1], 1., rtol=0.1)
+            tsou = datared.get_fs(sdfits, 2, ifnum=1, plnum=1, method=method, avgf_min=16)
+            row = (table['SCAN'] == 2) & (table['IFNUM'] == 1) & (table['PLNUM'] == 1)
+            np.testing.assert_allclose(table['DATA'][row][0], tsou, rtol=1e-5)
+    cal = datared.get_fs_all(sdfits, scans=[1], ifnum=[0], fold=False, avgf_min=16)
+    assert len(cal.table[0]) == 2
+
+
+def test_get_fs_all_reads(tmp_path, monkeypatch):
+    # Folding reuses the rows read for the signal state.
+    filename = str(tmp_path / 'sim.fits')
+    sd_fits_io.write_new_sdfits(filename, sd_fits_sim.make_fs_table(nchan=256, seed=1))
+    sdfits = sd_fits_io.read_sdfits(filename)
+    read_data = sd_fits_utils.read_data
+    nread = []
+    def counted(table, rows, *args, **kwargs):
+        nread.append(len(rows))
+        return read_data(table, rows, *args, **kwargs)
+    monkeypatch.setattr(sd_fits_utils, 'read_data', counted)
+    datared.get_fs_all(sdfits, avgf_min=16)
+    assert sum(nread) == len(sdfits.table[0])
+
+
+def test_get_nod_all(tmp_path, ps_session):
+    filename = str(tmp_path / 'sim.fits')
+    table = sd_fits_sim.make_nod_table(npairs=2, npol=2, nchan=512, seed=1)
+    sd_fits_io.write_new_sdfits(filename, table, overwrite=True)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    filename = ps_session(npol=2, nchan=512)
+    ps = datared.get_ps_all(sd_fits_io.read_sdfits(filename), avgf_min=16).table[0]['DATA']
+    for method in ['vector', 'gbtidl', 'classic']:
+        cal = datared.get_nod_all(sdfits, method=method, avgf_min=16)
+        table = cal.table[0]
+        assert len(table) == 2*2
+        np.testing.assert_array_equal(table['SCAN'], [1, 1, 3, 3])
+        tsou = datared.get_nod(sdfits, 4, plnum=1, method=method, avgf_min=16)
+        np.testing.assert_allclose(table['DATA'][3], tsou, rtol=1e-5)
+    # Same source as the position switched simulation.
+    cal = datared.get_nod_all(sdfits, avgf_min=16)
+    np.testing.assert_allclose(np.median(cal.table[0]['DATA'], axis=1), 
+                               np.median(ps, axis=1)[[0,1,0,1]], rtol=0.02)
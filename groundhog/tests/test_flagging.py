@@ -0,0 +1,94 @@
+import pytest
+import numpy as np
+
+from groundhog import datared
+from groundhog import flagging
+from groundhog import sd_fits_io
+
+
+def test_flags(tmp_path):
+    flags = flagging.Flags()
+    assert len(flags) == 0
+    mask = np.zeros(20, dtype=bool)
+    mask[3:5] = True
+    flags.add([7, 2], mask)
+    mask = np.zeros((2, 20), dtype=bool)
+    mask[0,10] = True
+    flags.add([7, 9], mask)
+    # Rows without flags are not stored.
+    np.testing.assert_array_equal(flags.rows, [2, 7])
+    assert flags.bits.shape == (2, 3)
+    assert flags.count() == 5
+    expc = np.zeros((3, 20), dtype=bool)
+    expc[1,[3,4,10]] = True
+    expc[2,[3,4]] = True
+    np.testing.assert_array_equal(flags.get([0, 7, 2]), expc)
+    np.testing.assert_array_equal(flags.get([0, 7, 2], chans=slice(4, 12)), expc[:,4:12])
+    data = np.ones((3, 8))
+    flags.apply([0, 7, 2], data, chans=slice(4, 12))
+    np.testing.assert_array_equal(np.isnan(data), expc[:,4:12])
+
+    filename = str(tmp_path / 'flags.npz')
+    flagging.save_flags(filename, [flags, flagging.Flags()])
+    loaded = flagging.load_flags(filename)
+    assert len(loaded) == 2
+    assert loaded[0].digest() == flags.digest()
+    assert loaded[1].nchan is None
+    assert len(loaded[1]) == 0
+
+
+def test_find_spikes():
+    rng = np.random.default_rng(1)
+    data = 1. + 0.2*np.sin(np.linspace(0, 3, 500)) + 0.01*rng.standard_normal((20, 500))
+    data[5,100] += 1.
+    data[8,300:302] += 1.
+    mask = flagging.find_spikes(data, width=15, nsigma=6.)
+    assert mask[5,100]
+    assert np.all(mask[8,300:302])
+    assert mask.sum() < 10
+    # An integration with more noise.
+    data[12] += 0.05*rng.standard_normal(500)
+    bad = flagging.find_bad_rows(data, nsigma=5.)
+    np.testing.assert_array_equal(np.where(bad)[0], [12])
+
+
+def test_flag_rfi(tmp_path, ps_session):
+    filename = ps_session(npairs=1, nint=8, npol=1, nchan=256)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    sdfits.remove_edge_chans(chan0=16, chanf=240)
+    clean = datared.get_ps_all(sdfits, avgf_min=16).table[0]['DATA'].copy()
+
+    # RFI in one integration of the reference scan.
+    rows = np.where((sdfits.table[0]['SCAN'] == 1) & (sdfits.table[0]['CAL'] == 'F'))[0]
+    sdfits.table[0]['DATA'][rows[3],100] *= 2.
+    sdfits.table[0]['DATA'][rows[3],5] *= 2.
+    flagging.flag_rfi(sdfits, nsigma=6.)
+    flags = sdfits.flags[0]
+    assert flags.get(rows[3])[0,100]
+    # Channels outside the window are not searched.
+    assert not flags.get(rows[3])[0,5]
+    assert flags.count() < 20
+    assert sdfits.history[-1][1] == 'FLAGS'
+
+    # Flagged values are left out of the calibration.
+    cal = datared.get_ps_all(sdfits, avgf_min=16).table[0]['DATA']
+    np.testing.assert_allclose(cal[:,100-16], clean[:,100-16], rtol=0.1)
+    scan = sdfits.get_scans(1, cal='F')
+    assert np.isnan(scan.data[3,100-16])
+
+    # The flags persist next to the file.
+    flags_file = str(tmp_path / 'sim.flags.npz')
+    sdfits.save_flags(flags_file)
+    loaded = sd_fits_io.read_sdfits(filename, flags_file=flags_file)
+    assert loaded.flags[0].digest() == flags.digest()
+
+
+def test_flag_channels(ps_session):
+    filename = ps_session(npairs=1, nint=2, npol=2, nchan=128)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    sdfits.remove_edge_chans(chan0=8, chanf=120)
+    sdfits.flag_channels([(10, 12)], plnum=[1])
+    scan = sdfits.get_scans([1, 2])
+    flagged = np.isnan(scan.data)
+    assert np.all(flagged[scan.table['PLNUM'] == 1][:,10:12])
+    assert flagged.sum() == 2*(scan.table['PLNUM'] == 1).sum()
@@ -0,0 +1,70 @@
+import numpy as np
+
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from groundhog import gridding
+from groundhog import sd_fits_sim
+
+
+def make_map_table(wcs, shape, nchan=32):
+    # One spectrum at the center of each pixel with a linear gradient on the sky.
+    ny, nx = shape
+    table = sd_fits_sim.make_ps_table(npairs=ny*nx//4 + 1, nint=1, npol=1, nchan=nchan, 
+                                      noise=False)[:ny*nx]
+    yy, xx = np.mgrid[:ny, :nx]
+    lon, lat = wcs.wcs_pix2world(xx.ravel(), yy.ravel(), 0)
+    table['CRVAL2'][:] = lon
+    table['CRVAL3'][:] = lat
+    table['TSYS'][:] = 20.
+    table['VFRAME'][:] = 0.
+    table['DATA'][:] = (1. + 10.*(lat - 20.))[:,np.newaxis]*np.ones(nchan)
+    table['DATA'][0,3] = np.nan
+    return table
+
+
+def test_eval_kernel():
+    kernel = gridding.gauss_kernel(0.1)
+    np.testing.assert_allclose(gridding.eval_kernel(kernel, [0., 0.05]), [1., 0.5])
+    assert gridding.eval_kernel(kernel, 1.) == 0
+    kernel = gridding.box_kernel(0.1)
+    np.testing.assert_array_equal(gridding.eval_kernel(kernel, [0.05, 0.2]), [1., 0.])
+
+
+def test_find_neighbours():
+    x = np.array([1.2, 3.])
+    y = np.array([1., 1.])
+    neigh = gridding.find_neighbours(x, y, (3, 5), 1.)
+    # Brute force.
+    yy, xx = np.mgrid[:3, :5]
+    dist = np.hypot(xx.ravel()[:,np.newaxis] - x, yy.ravel()[:,np.newaxis] - y)
+    pix, rows = np.nonzero(dist <= 1.)
+    assert sorted(zip(pix, rows)) == sorted(zip(neigh.pixels[neigh.index], neigh.rows))
+    np.testing.assert_allclose(neigh.distances, dist[neigh.pixels[neigh.index], neigh.rows])
+
+
+def test_grid_cube(tmp_path):
+    wcs, shape = gridding.make_wcs([9.9, 10.1], [19.9, 20.1], 0.01)
+    assert shape == (21, 19)
+    table = make_map_table(wcs, shape)
+    kernel = gridding.gauss_kernel(0.02)
+    hdu = gridding.grid_cube(table, wcs, shape, kernel, chunk=5)
+    assert hdu.data.shape == (32,) + shape
+    # A linear gradient is preserved far from the edges.
+    cube_wcs = WCS(hdu.header)
+    ny, nx = shape
+    yy, xx = np.mgrid[5:ny-5, 5:nx-5]
+    lon, lat, _ = cube_wcs.wcs_pix2world(xx, yy, 0, 0)
+    np.testing.assert_allclose(hdu.data[7,5:ny-5,5:nx-5], 1. + 10.*(lat - 20.), atol=1e-5)
+    # The invalid value is ignored.
+    assert np.all(np.isfinite(hdu.data[3]))
+    np.testing.assert_allclose(hdu.data[3,5:ny-5,5:nx-5], hdu.data[7,5:ny-5,5:nx-5])
+    # The frequency axis.
+    freq = cube_wcs.spectral.pixel_to_world_values(np.arange(32))
+    np.testing.assert_allclose(freq[0], table['CRVAL1'][0] - table['CDELT1'][0]*(table['CRPIX1'][0] - 1))
+    # Written in blocks.
+    filename = str(tmp_path / 'cube.fits')
+    gridding.grid_cube(table, wcs, shape, kernel, chunk=7, filename=filename)
+    with fits.open(filename) as hdul:
+        np.testing.assert_array_equal(hdul[0].data, hdu.data)
+        assert hdul[0].header['CTYPE3'] == 'FREQ'
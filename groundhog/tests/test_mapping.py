@@ -0,0 +1,46 @@
+import pytest
+import numpy as np
+
+from groundhog import datared
+from groundhog import mapping
+from groundhog import sd_fits_io
+
+
+@pytest.fixture(scope="module")
+def sim_sdfits(ps_session):
+    filename = ps_session(npairs=2, nint=2, nif=2, npol=2, nfd=2, nchan=256)
+    return sd_fits_io.read_sdfits(filename)
+
+
+def test_map_with_refs(sim_sdfits):
+    cal = mapping.map_with_refs(sim_sdfits, [2, 4], [1])
+    assert cal.data.shape == (2*2*2*2*2, 256)
+    # Same as calibrating each spectral window, polarization and feed.
+    for ifnum,plnum,fdnum in [(0, 0, 0), (1, 1, 0), (1, 0, 1)]:
+        ref_scan = datared.prepare_mapping_off(sim_sdfits, 1, ifnum=ifnum, plnum=plnum, fdnum=fdnum)
+        expc = mapping.map_with_ref(sim_sdfits, [2, 4], ref_scan, ifnum=ifnum, plnum=plnum, fdnum=fdnum)
+        sel = (cal.table['IFNUM'] == ifnum) & (cal.table['PLNUM'] == plnum) & \
+              (cal.table['FDNUM'] == fdnum)
+        np.testing.assert_allclose(cal.data[sel], expc.data, rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(cal.table['TSYS'][sel], expc.table['TSYS'])
+        np.testing.assert_allclose(cal.table['EXPOSURE'][sel], expc.table['EXPOSURE'])
+
+
+def test_map_with_refs_interp(sim_sdfits):
+    refs = datared.prepare_mapping_offs(sim_sdfits, [1, 3], ifnum=0, plnum=0, fdnum=0)
+    assert len(refs.keys) == 2
+    cal = mapping.map_with_refs(sim_sdfits, [2], None, ifnum=0, plnum=0, fdnum=0, 
+                                refs=refs, interp='linear')
+    # Scan 2 is between the reference scans.
+    mjd = np.array([refs.mjd[0], 0.75*refs.mjd[0] + 0.25*refs.mjd[1], refs.mjd[1] + 1.])
+    ref0, ref1, w = mapping.match_refs(refs, [0, 0, 0], [0, 0, 0], [0, 0, 0], mjd, interp='linear')
+    np.testing.assert_array_equal(ref0, [0, 0, 1])
+    np.testing.assert_array_equal(ref1, [0, 1, 1])
+    np.testing.assert_allclose(w, [0., 0.25, 0.], atol=1e-6)
+    ref0, ref1, w = mapping.match_refs(refs, [0, 0, 0], [0, 0, 0], [0, 0, 0], mjd, interp='nearest')
+    np.testing.assert_array_equal(ref0, [0, 0, 1])
+    np.testing.assert_array_equal(ref0, ref1)
+    assert np.all(cal.table['IFNUM'] == 0)
+    assert np.all((cal.table['TSYS'] > refs.tsys.min()) & (cal.table['TSYS'] < refs.tsys.max()))
+    with pytest.raises(ValueError):
+        mapping.map_with_refs(sim_sdfits, [2], None, refs=refs, fdnum=1)
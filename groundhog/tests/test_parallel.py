@@ -0,0 +1,31 @@
+import pytest
+import numpy as np
+
+from groundhog import datared
+from groundhog import parallel
+from groundhog import sd_fits_io
+
+
+def test_get_ps(sd_fits_table):
+    filename = 'data/AGBT19B_334_04_3C353.raw.vegas.A.fits'
+    tsou = parallel.get_ps(filename, [5], ifnum=[3,4], plnum=0, method='gbtidl', nproc=2)
+    assert list(tsou.keys()) == [(5,3,0,0), (5,4,0,0)]
+    tsou_ = datared.get_ps(sd_fits_table, 5, ifnum=4, plnum=0, method='gbtidl')
+    np.testing.assert_allclose(tsou[(5,4,0,0)], tsou_)
+
+
+def test_get_ps_feeds(ps_session):
+    filename = ps_session(npairs=1, nint=2, npol=1, nfd=2, nchan=256)
+    tsou = parallel.get_ps(filename, [1], avgf_min=16, nproc=2)
+    assert list(tsou.keys()) == [(1,0,0,0), (1,0,0,1)]
+    sdfits = sd_fits_io.read_sdfits(filename)
+    cal = datared.get_ps_all(sdfits, avgf_min=16).table[0]
+    for (scan,ifnum,plnum,fdnum),tsou_ in tsou.items():
+        row = np.where((cal['IFNUM'] == ifnum) & (cal['PLNUM'] == plnum) & (cal['FDNUM'] == fdnum))[0]
+        np.testing.assert_allclose(tsou_, cal['DATA'][row[0]], rtol=1e-5)
+    assert not np.allclose(tsou[(1,0,0,0)], tsou[(1,0,0,1)])
+    tcal = parallel.get_tcal(filename, 1, avgf_min=16, nproc=2)
+    assert list(tcal.keys()) == [(0,0,0), (0,0,1)]
+    tcal_all = datared.get_tcal_all(sdfits, 1, avgf_min=16)
+    for key,tcal_ in tcal.items():
+        np.testing.assert_allclose(tcal_.value, tcal_all[key].value, rtol=1e-5)
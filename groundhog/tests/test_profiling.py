@@ -0,0 +1,33 @@
+import json
+import pytest
+
+from groundhog import datared
+from groundhog import profiling
+from groundhog import sd_fits_io
+
+
+def test_profiler(tmp_path, ps_session):
+    filename = ps_session(npairs=1, nint=2, nchan=256)
+    
+    records = []
+    with profiling.Profiler(callback=records.append) as prof:
+        sdfits = sd_fits_io.read_sdfits(filename)
+        datared.get_ps(sdfits, 1, ifnum=0, plnum=0, avgf_min=16)
+    assert not profiling.is_active()
+    assert len(records) == len(prof.records)
+    
+    report = {entry['name']: entry for entry in prof.report()}
+    assert report['datared.get_ps']['calls'] == 1
+    assert report['sd_fits.SDFITS.get_scans']['calls'] == 5
+    assert report['sd_fits.SDFITS.get_scans']['rows'] == 12
+    assert report['datared.kappa_interp']['calls'] == 1
+    
+    trace = str(tmp_path / 'trace.json')
+    prof.to_chrome_trace(trace)
+    with open(trace) as f:
+        events = json.load(f)['traceEvents']
+    assert len(events) == len(prof.records)
+    
+    # Nothing is recorded when the profiler is not active.
+    datared.get_ps(sdfits, 1, ifnum=0, plnum=0, avgf_min=16)
+    assert len(prof.records) == len(records)
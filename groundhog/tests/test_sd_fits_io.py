@@ -1,5 +1,6 @@
 
 import pytest
+import numpy as np
 
 from groundhog import sd_fits_io
 
@@ -15,3 +16,46 @@ def test_write_sdfits(sd_fits_table, tmp_path):
     out = d / "test.fits"
     sd_fits_io.write_sdfits(out, sd_fits_table, overwrite=True)
     assert len(list(tmp_path.iterdir())) == 1
+
+def test_read_sdfits_lazy(sd_fits_table):
+    sdfits = sd_fits_io.read_sdfits('data/AGBT19B_334_04_3C353.raw.vegas.A.fits', lazy=True)
+    assert sdfits.lazy
+    assert sdfits.meta[0].shape == sd_fits_table.table[0].shape
+    scan_lazy = sdfits.get_scans(5, ifnum=4, plnum=0, cal='T', sig='T')
+    scan = sd_fits_table.get_scans(5, ifnum=4, plnum=0, cal='T', sig='T')
+    np.testing.assert_array_equal(scan_lazy.data, scan.data)
+
+
+def test_sdfits_writer(sd_fits_table, tmp_path):
+    table = sd_fits_table.table[0]
+    out = tmp_path / "stream.fits"
+    with sd_fits_io.SDFITSWriter(out, phead=sd_fits_table.phead) as writer:
+        for i in range(0, len(table), 10):
+            writer.write(table[i:i+10], header=sd_fits_table.header[0])
+    sdfits = sd_fits_io.read_sdfits(out)
+    assert len(sdfits.table[0]) == len(table)
+    np.testing.assert_array_equal(sdfits.table[0]['DATA'], table['DATA'])
+    np.testing.assert_array_equal(sdfits.table[0]['SCAN'], table['SCAN'])
+
+
+def test_read_session(sd_fits_table):
+    filename = 'data/AGBT19B_334_04_3C353.raw.vegas.A.fits'
+    sdfits = sd_fits_io.read_session([filename, filename])
+    assert sdfits.numtab == 2*sd_fits_table.numtab
+    # The rows of both files are gathered into one scan.
+    scan = sdfits.get_scans(5, ifnum=4, plnum=0, cal='T', sig='T')
+    scan_ = sd_fits_table.get_scans(5, ifnum=4, plnum=0, cal='T', sig='T')
+    assert len(scan.table) == 2*len(scan_.table)
+    np.testing.assert_array_equal(scan.data[:len(scan_.table)], scan_.data)
+
+
+def test_read_session_configurations(ps_session):
+    filenames = [ps_session(npairs=1, nint=2, nif=1, npol=1, nchan=nchan) 
+                 for nchan in (64, 128)]
+    sdfits = sd_fits_io.read_session(filenames)
+    # One primary header per file.
+    assert len(sdfits.pheads) == 2
+    assert sdfits.phead is sdfits.pheads[0]
+    # The DATA columns have different lengths.
+    with pytest.raises(ValueError, match="different columns"):
+        sdfits.get_scans(1, ifnum=0, plnum=0)
@@ -0,0 +1,19 @@
+import pytest
+import numpy as np
+
+from groundhog import datared
+from groundhog import sd_fits_io
+from groundhog import sd_fits_sim
+
+
+def test_write_ps_session(tmp_path):
+    filename = str(tmp_path / 'sim.fits')
+    sd_fits_sim.write_ps_session(filename, npairs=2, nint=3, nif=2, npol=2, nfd=2, 
+                                 nchan=512, tcal=1.5, seed=1)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    table = sdfits.table[0]
+    assert len(table) == 4*3*2*2*2*2
+    assert table['DATA'].shape == (192, 512)
+    assert np.unique(sdfits.meta[0]['SCAN']).tolist() == [1, 2, 3, 4]
+    tcal = datared.get_tcal(sdfits, 3, ifnum=0, plnum=0, avgf_min=16)
+    assert np.ma.median(tcal.value) == pytest.approx(1.5, rel=5e-2)
@@ -4,7 +4,9 @@ import pytest
 import numpy as np
 
 
+from groundhog import flagging
 from groundhog import sd_fits_io
+from groundhog import sd_fits_sim
 from groundhog import sd_fits_utils
 
 
@@ -13,6 +15,18 @@ def test_make_summary(sd_fits_table):
     assert summary.Scan == [5, 6]
     assert summary.Proc == ['OffOn', 'OffOn']
     assert summary.Az == [247.89581746345755, 253.10093738847564]
+
+
+def test_make_summary_means():
+    table = sd_fits_sim.make_ps_table(npairs=2, nint=3, nif=2, npol=2, nchan=16, seed=1)
+    # Rows out of scan order.
+    table = table[np.random.default_rng(1).permutation(len(table))]
+    summary = sd_fits_utils.make_summary(table)
+    assert summary.Scan == [1, 2, 3, 4]
+    assert summary.nInt == [24]*4
+    for col,vals in [('AZIMUTH', summary.Az), ('ELEVATIO', summary.El), ('VELOCITY', summary.Vel)]:
+        expc = [np.mean(table[col][table['SCAN'] == scan]) for scan in summary.Scan]
+        assert vals == np.array(expc).tolist()
     
 
 def test_update_table_column(sd_fits_table):
@@ -28,3 +42,89 @@ def test_update_table_column(sd_fits_table):
     
     # Clean up
     os.remove('test.fits')
+
+
+def test_row_index(sd_fits_table, tmp_path):
+    meta = sd_fits_table.meta[0]
+    index = sd_fits_utils.build_row_index(meta)
+    mask = sd_fits_utils.get_table_mask(meta, scans=5, ifnum=4, cal='T', plnum=0)
+    rows = sd_fits_utils.get_index_rows(index, scans=5, ifnum=4, cal='T', plnum=0)
+    np.testing.assert_array_equal(rows, np.where(mask)[0])
+    # Save and load the index.
+    filename = tmp_path / "index.npz"
+    sd_fits_utils.save_row_index(filename, [index])
+    index_ = sd_fits_utils.load_row_index(filename)[0]
+    np.testing.assert_array_equal(index_.rows, index.rows)
+    np.testing.assert_array_equal(index_.offsets, index.offsets)
+
+
+def test_update_table_columns(sd_fits_table):
+    table = sd_fits_table.table[0][:10].copy()
+    crpix1 = table['CRPIX1'] - 10
+    # The table is not modified by default.
+    new_table = sd_fits_utils.update_table_columns(table, {'CRPIX1': crpix1})
+    assert new_table is not table
+    np.testing.assert_array_equal(new_table['CRPIX1'], crpix1)
+    assert np.all(table['CRPIX1'] == crpix1 + 10)
+    # Same shape and type, update in place.
+    new_table = sd_fits_utils.update_table_columns(table, {'CRPIX1': crpix1}, inplace=True)
+    assert new_table is table
+    np.testing.assert_array_equal(new_table['CRPIX1'], crpix1)
+    # Values that do not fit in the column type are not cast in place.
+    data = table['DATA'].astype(np.float64) + 1e-9
+    new_table = sd_fits_utils.update_table_columns(table, {'DATA': data}, inplace=True)
+    assert new_table is not table
+    # Different shapes, rebuild once.
+    data = table['DATA'][:,10:-10]
+    tcal = np.ones(data.shape)
+    new_table = sd_fits_utils.update_table_columns(table, {'DATA': data, 'TCAL': tcal, 
+                                                           'CRPIX1': crpix1 - 10}, inplace=True)
+    assert new_table is not table
+    assert new_table.columns.names == table.columns.names
+    np.testing.assert_array_equal(new_table['DATA'], data)
+    np.testing.assert_array_equal(new_table['TCAL'], tcal)
+    np.testing.assert_array_equal(new_table['CRPIX1'], crpix1 - 10)
+
+
+def test_update_table_columns_casting():
+    table = sd_fits_sim.make_ps_table(npairs=1, nint=2, npol=1, nchan=16, seed=1)
+    data = np.arange(table['DATA'].size, dtype=np.int16).reshape(table['DATA'].shape)
+    # Values that fit in the column are written in place.
+    new_table = sd_fits_utils.update_table_columns(table, {'DATA': data}, inplace=True)
+    assert new_table is table
+    # Narrowing float64 to float32 is not done in place.
+    new_table = sd_fits_utils.update_table_columns(table, {'DATA': data.astype(np.float64) + 1e-9}, 
+                                                   inplace=True)
+    assert new_table is not table
+    np.testing.assert_array_equal(table['DATA'], data)
+    # update_table_column leaves the table as it was.
+    new_table = sd_fits_utils.update_table_column(table, 'DATA', np.zeros(data.shape, dtype=np.float32))
+    assert np.all(new_table['DATA'] == 0)
+    np.testing.assert_array_equal(table['DATA'], data)
+
+
+def test_save_summary(sd_fits_table, tmp_path):
+    summary = sd_fits_utils.make_summary(sd_fits_table.table[0])
+    filename = tmp_path / "summary.npz"
+    sd_fits_utils.save_summary(filename, summary)
+    assert sd_fits_utils.load_summary(filename) == summary
+
+
+def test_select_rows():
+    table = sd_fits_sim.make_ps_table(npairs=1, nint=2, npol=2, nchan=64, seed=1)
+    table = sd_fits_utils.update_table_columns(table, {'TCAL': np.tile(np.arange(64.), (len(table), 1))})
+    flags = flagging.Flags()
+    flags.add([3], np.arange(64) == 20)
+    rows = np.array([5, 3, 0])
+    window = (8, 56)
+    selection = sd_fits_utils.select_rows(table, rows, window=window, flags=flags)
+    expc = sd_fits_utils.apply_chan_window(table[rows], window)
+    assert selection.columns.formats == expc.columns.formats
+    for name in table.columns.names:
+        if name != 'DATA':
+            np.testing.assert_array_equal(selection[name], expc[name])
+    expc['DATA'][1,20-8] = np.nan
+    np.testing.assert_array_equal(selection['DATA'], expc['DATA'])
+    # The table is not modified.
+    assert np.isfinite(table['DATA'][3,20])
+    assert len(sd_fits_utils.select_rows(table, [], window=window)) == 0
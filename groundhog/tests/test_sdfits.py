@@ -1,7 +1,9 @@
 import pytest
 import numpy as np
 
+from groundhog import datared
 from groundhog import sd_fits
+from groundhog import sd_fits_io
 
 
 def test_remove_edge_channels(sd_fits_table_hi):
@@ -25,3 +27,52 @@ def test_remove_edge_channels(sd_fits_table_hi):
     idx0,idxf = np.sort([idx0,idxf+1])
     np.testing.assert_allclose(freq_tot[0][idx0:idxf], freq_crop[0])
     np.testing.assert_allclose(spec_tot[0][idx0:idxf], spec_crop[0])
+
+
+def test_remove_edge_channels_window(tmp_path, ps_session):
+    filename = ps_session(npairs=1, nint=2, nif=1, npol=1, nchan=256)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    scan_tot = sdfits.get_scans(1, ifnum=0, plnum=0)
+    data = np.array(sdfits.table[0]['DATA'])
+    # Remove the edges twice.
+    sdfits.remove_edge_chans(chan0=10, chanf=246)
+    sdfits.remove_edge_chans(chan0=6, chanf=226)
+    assert sdfits.chan_window[0] == (16, 236)
+    assert sdfits.get_nchan(0) == 220
+    # The table is not modified.
+    np.testing.assert_array_equal(sdfits.table[0]['DATA'], data)
+    scan_crop = sdfits.get_scans(1, ifnum=0, plnum=0)
+    assert scan_crop.data.shape == (4, 220)
+    np.testing.assert_allclose(scan_crop.freq, scan_tot.freq[:,16:236])
+    np.testing.assert_array_equal(scan_crop.data, scan_tot.data[:,16:236])
+    # The batched calibration uses the same channels.
+    tsou = datared.get_ps(sdfits, 1, ifnum=0, plnum=0, avgf_min=10)
+    cal = datared.get_ps_all(sdfits, avgf_min=10)
+    np.testing.assert_allclose(cal.table[0]['DATA'][0], tsou, rtol=1e-6)
+    # The channels are removed when writing.
+    out = str(tmp_path / 'out.fits')
+    sd_fits_io.write_sdfits(out, sdfits)
+    sdfits_out = sd_fits_io.read_sdfits(out)
+    assert sdfits_out.table[0]['DATA'].shape == (len(data), 220)
+    np.testing.assert_allclose(sdfits_out.get_scans(1, ifnum=0, plnum=0).freq, 
+                               scan_crop.freq)
+
+
+def test_scan_copy_freq(ps_session):
+    filename = ps_session(npairs=1, nint=2, nif=1, npol=1, nchan=64)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    scan = sdfits.get_scans(1, ifnum=0, plnum=0)
+    table = scan.table
+    data = np.array(table['DATA'])
+    # Changing the spectra in place does not change the table.
+    scan.data *= 2
+    np.testing.assert_array_equal(table['DATA'], data)
+    # The frequencies can be set, and follow averaging.
+    freq = scan.freq
+    scan.freq = freq + 1e3*freq.unit
+    np.testing.assert_allclose(scan.freq, freq + 1e3*freq.unit)
+    np.testing.assert_allclose(scan.get_freq(chan=[1, 3]), scan.freq[:,[0,2]])
+    scan.average()
+    assert scan.freq.shape == (64,)
+    scan.freq = None
+    np.testing.assert_allclose(scan.freq, scan.get_freq())
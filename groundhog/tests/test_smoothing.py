@@ -0,0 +1,113 @@
+import pytest
+import numpy as np
+
+from groundhog import datared
+from groundhog import smoothing
+from groundhog import sd_fits_io
+from groundhog import spectral_axis
+from groundhog import utils
+
+
+def test_make_kernel():
+    np.testing.assert_allclose(smoothing.make_kernel('hanning', 3), [0.25, 0.5, 0.25])
+    np.testing.assert_allclose(smoothing.make_kernel('boxcar', 3), [1./3]*3)
+    np.testing.assert_allclose(smoothing.make_kernel('boxcar', 4), [0.125, 0.25, 0.25, 0.25, 0.125])
+    kernel = smoothing.make_kernel('gaussian', 10.)
+    assert len(kernel)%2 == 1
+    assert kernel.sum() == pytest.approx(1.)
+
+
+def test_smooth():
+    rng = np.random.default_rng(1)
+    data = rng.normal(size=(20, 300))
+    data[2,50] = np.nan
+    for kind,width in [('boxcar', 5), ('hanning', 7), ('gaussian', 30.)]:
+        direct = smoothing.smooth(data, kind=kind, width=width, method='direct', chunk=7)
+        fft = smoothing.smooth(data, kind=kind, width=width, method='fft')
+        np.testing.assert_allclose(direct, fft, atol=1e-12)
+        assert np.all(np.isfinite(direct))
+        # Away from the edges and invalid values it is a convolution.
+        kernel = smoothing.make_kernel(kind, width)
+        expc = np.convolve(data[0], kernel, mode='same')
+        half = len(kernel)//2
+        np.testing.assert_allclose(direct[0,half:-half], expc[half:-half], atol=1e-12)
+    # The edges are normalized over the channels inside the spectra.
+    smoothed = smoothing.smooth(np.ones((1, 10)), kind='boxcar', width=5)
+    np.testing.assert_allclose(smoothed, 1.)
+
+
+def test_decimate():
+    data = np.arange(24.).reshape(2, 12).astype(np.float32)
+    decimated = smoothing.decimate(data, 4)
+    assert decimated.dtype == np.float32
+    np.testing.assert_allclose(decimated, data.reshape(2, 3, 4).mean(axis=-1))
+    # Non-integer factors weight the channels at the block edges.
+    decimated = smoothing.decimate(data, 2.5)
+    assert decimated.shape == (2, 4)
+    np.testing.assert_allclose(decimated[0], [(0 + 1 + 0.5*2)/2.5, (0.5*2 + 3 + 4)/2.5,
+                                              (5 + 6 + 0.5*7)/2.5, (0.5*7 + 8 + 9)/2.5])
+    # The frequency axis follows the center of the blocks, up to a 
+    # fraction of a channel for non-integer factors.
+    crpix1, cdelt1 = smoothing.decimate_axis(1., 1., 4)
+    np.testing.assert_allclose(smoothing.decimate(np.arange(100.), 4), (np.arange(1, 26) - crpix1)*cdelt1)
+    crpix1, cdelt1 = smoothing.decimate_axis(1., 1., 3.3)
+    np.testing.assert_allclose(smoothing.decimate(np.arange(100.), 3.3), (np.arange(1, 31) - crpix1)*cdelt1,
+                               atol=0.05)
+    data[0,:4] = np.nan
+    assert np.isnan(smoothing.decimate(data, 4)[0,0])
+
+
+def test_smooth_sdfits(ps_session):
+    filename = ps_session(npairs=1, nint=2, npol=2, nchan=1000)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    sdfits.remove_edge_chans(chan0=20, chanf=980)
+    cal = datared.get_ps_all(sdfits, avgf_min=16).table[0]
+    freq = spectral_axis.eval_freq_axis(spectral_axis.get_freq_axis(cal))
+
+    smoothing.smooth_sdfits(sdfits, kind='hanning', width=3, factor=3)
+    assert sdfits.table[0]['DATA'].shape == (len(sdfits.table[0]), 320)
+    assert sdfits.chan_window[0] is None
+    assert sdfits.history[-1][1] == 'SMOOTH'
+    cal_dec = datared.get_ps_all(sdfits, avgf_min=16).table[0]
+    freq_dec = spectral_axis.eval_freq_axis(spectral_axis.get_freq_axis(cal_dec))
+    np.testing.assert_allclose(freq_dec, smoothing.decimate(freq, 3), rtol=1e-12)
+    np.testing.assert_allclose(np.median(cal_dec['DATA'], axis=1), np.median(cal['DATA'], axis=1),
+                               rtol=1e-2)
+    # Less noise.
+    assert np.all(np.std(np.diff(cal_dec['DATA'], axis=1), axis=1) <
+                  np.std(np.diff(cal['DATA'], axis=1), axis=1)/2.)
+
+
+def test_kappa_avgf_regression():
+    # Before non-divisors were allowed, the smallest divisor of nchan
+    # not smaller than avgf_min was used. It is kept whenever it is
+    # smaller than twice avgf_min, e.g., for all powers of two.
+    nchans = [2**k for k in range(9, 18)]
+    nchans += [1000, 1020, 1022, 1536, 3000, 6144, 26214, 26215, 26216, 32000, 52428]
+    changed = []
+    for avgf_min in [16, 64, 256]:
+        for nchan in nchans:
+            facs = utils.factors(nchan)
+            old = np.min(facs[facs >= avgf_min])
+            new = datared.get_kappa_avgf(nchan, avgf_min)
+            if old < 2*avgf_min:
+                assert new == old
+            else:
+                assert new == avgf_min
+                changed.append((nchan, avgf_min, old))
+    # Only these widths change, they were more than twice avgf_min.
+    assert changed == [(1022, 16, 73), (26215, 16, 35), (26215, 256, 535)]
+
+
+def test_kappa_avgf(ps_session):
+    assert datared.get_kappa_avgf(1024, 16) == 16
+    assert datared.get_kappa_avgf(1020, 16) == 17
+    assert datared.get_kappa_avgf(1021, 16) == 16
+    assert datared.get_kappa_avgf(10, 16) == 10
+    # Calibrate spectra with a prime number of channels.
+    filename = ps_session(npairs=1, nint=2, npol=1, nchan=1021)
+    sdfits = sd_fits_io.read_sdfits(filename)
+    tsou = datared.get_ps(sdfits, 2, avgf_min=16)
+    assert np.median(tsou) == pytest.approx(30.4, rel=0.02)
+    cal = datared.get_ps_all(sdfits, avgf_min=16).table[0]['DATA']
+    np.testing.assert_allclose(cal[0], tsou, rtol=1e-5)
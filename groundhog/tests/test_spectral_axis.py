@@ -11,3 +11,23 @@ def test_compute_freq_axis(sd_fits_table, gbtidl_spec):
     freq = spectral_axis.compute_freq_axis(table)
     np.testing.assert_allclose(freq.to('MHz').value[0], gbtidl_spec[:,0])
     
+
+
+def test_average_freq_axis():
+    nchan = 64
+    freq_axis = spectral_axis.FreqAxis(crval1=np.array([1.4e9, 1.4e9 + 5e3, 1.4e9 + 1e4]),
+                                       cdelt1=np.array([-1e3, -1e3, -1.1e3]),
+                                       crpix1=np.array([32., 32., 33.]),
+                                       doppler=spectral_axis.get_doppler([1e4, 1.1e4, 1.2e4]),
+                                       nchan=nchan)
+    weights = np.array([1., 2., 0.5])
+    freq = spectral_axis.eval_freq_axis(freq_axis)
+    assert freq.shape == (3, nchan)
+    avg_freq_axis = spectral_axis.average_freq_axis(freq_axis, weights)
+    np.testing.assert_allclose(spectral_axis.eval_freq_axis(avg_freq_axis), 
+                               np.average(freq, axis=0, weights=weights), rtol=1e-14)
+    # Averaging in blocks of channels.
+    block_freq = spectral_axis.block_freq_axis(avg_freq_axis, 8)
+    np.testing.assert_allclose(block_freq, 
+                               spectral_axis.eval_freq_axis(avg_freq_axis).reshape(8,8).mean(axis=1),
+                               rtol=1e-14)
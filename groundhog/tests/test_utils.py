@@ -17,3 +17,31 @@ def test_ruze():
     g0 = 0.71
     eta = utils.ruze(21e-2, g0, 0.)
     assert eta == g0
+
+
+def test_chunked_average():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(100,32))
+    data[3,5] = np.nan
+    data[:,7] = np.nan
+    weights = rng.uniform(0.5, 1.5, size=100)
+    expc = np.ma.average(np.ma.masked_invalid(data), axis=0, weights=weights)
+    for chunk in [1, 7, 1024]:
+        avg = utils.chunked_average(data, weights, chunk=chunk)
+        np.testing.assert_allclose(avg, expc.filled(np.nan), rtol=1e-12)
+        assert np.isnan(avg[7])
+    # Masked values are ignored too.
+    avg = utils.chunked_average(np.ma.masked_invalid(data), weights)
+    np.testing.assert_allclose(avg, expc.filled(np.nan), rtol=1e-12)
+
+
+def test_shift_channels():
+    data = np.arange(20.).reshape(2, 10)
+    shifted = utils.shift_channels(data, [2, -3])
+    np.testing.assert_array_equal(shifted[0,:8], data[0,2:])
+    np.testing.assert_array_equal(shifted[1,3:], data[1,:7])
+    assert np.all(np.isnan(shifted[0,8:])) and np.all(np.isnan(shifted[1,:3]))
+    # Fractional offsets interpolate between channels.
+    shifted = utils.shift_channels(data, 1.25)
+    np.testing.assert_allclose(shifted[:,:8], data[:,:8] + 1.25)
+    assert np.all(np.isnan(shifted[:,8:]))
@@ -48,6 +48,165 @@ def get_ps_scan_pair(scan, procnum, procname):
     return scan_on, scan_off
     
 
+def as_dtype(values, dtype=None):
+    """
+    Casts `values` to `dtype`, without copying if it already is.
+    Masked arrays stay masked. Does nothing if `dtype` is None.
+    """
+    
+    if dtype is None:
+        return values
+    
+    if isinstance(values, np.ndarray):
+        return values.astype(dtype, copy=False)
+    
+    return np.asarray(values, dtype=dtype)
+
+
+def group_average(values, weights, starts, dtype=np.float64):
+    """
+    Weighted average of consecutive groups of rows.
+    Invalid values (NaN or inf) are ignored.
+    
+    Parameters
+    ----------
+    values : array
+        Values to average. The first axis runs over rows.
+    weights : array
+        Weight of each row.
+    starts : array
+        Index of the first row of each group.
+        Groups must not be empty.
+    dtype : data-type, optional
+        Type of the weighted values and of the output.
+        The sums are accumulated in float64.
+    
+    Returns
+    -------
+    average : array
+        Weighted average of each group.
+        It will be NaN where all the values in a group are invalid.
+    """
+    
+    valid = np.isfinite(values)
+    wgt = np.asarray(weights, dtype=dtype)
+    wgt = wgt.reshape(wgt.shape + (1,)*(values.ndim - 1))
+    
+    num = np.add.reduceat(np.where(valid, values*wgt, 0.), starts, axis=0, dtype=np.float64)
+    den = np.add.reduceat(valid*wgt, starts, axis=0, dtype=np.float64)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = (num/den).astype(dtype, copy=False)
+    
+    return average
+
+
+def chunked_average(values, weights, chunk=1024, dtype=np.float64):
+    """
+    Weighted average along the first axis, accumulated over
+    chunks of rows. Invalid values (NaN, inf or masked) are ignored.
+    Only temporary arrays of size `chunk` times the size of a row 
+    are allocated.
+    
+    Parameters
+    ----------
+    values : array or masked array
+        Values to average. The first axis runs over rows.
+    weights : array
+        Weight of each row.
+    chunk : int, optional
+        Number of rows to accumulate at a time.
+    dtype : data-type, optional
+        Type of the weighted values and of the output.
+        The sums are accumulated in float64.
+    
+    Returns
+    -------
+    average : array
+        Weighted average. It is NaN where all the values are invalid.
+    """
+    
+    data = np.ma.getdata(values)
+    mask = np.ma.getmask(values)
+    weights = np.asarray(weights, dtype=float)
+    
+    num = np.zeros(data.shape[1:], dtype=float)
+    den = np.zeros(data.shape[1:], dtype=float)
+    
+    for i in range(0, data.shape[0], chunk):
+        block = data[i:i+chunk]
+        wgt = weights[i:i+chunk].astype(dtype).reshape((-1,) + (1,)*(data.ndim - 1))
+        valid = np.isfinite(block)
+        if mask is not np.ma.nomask:
+            valid &= ~mask[i:i+chunk]
+        num += np.where(valid, block*wgt, 0.).sum(axis=0, dtype=np.float64)
+        den += (valid*wgt).sum(axis=0, dtype=np.float64)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = (num/den).astype(dtype, copy=False)
+    
+    return average
+
+
+def invalid_to_nan(values):
+    """
+    Replaces the invalid values (inf) of an array with NaN, in place.
+    Returns the array.
+    """
+    
+    values[np.isinf(values)] = np.nan
+    
+    return values
+
+
+def shift_channels(values, offset, tol=1e-3):
+    """
+    Shifts spectra along the channel axis, so that
+    ``shifted[...,k] = values[...,k+offset]``.
+    Channels shifted in from outside the spectra are NaN.
+    
+    Parameters
+    ----------
+    values : array
+        Spectra, one per row.
+    offset : float or array
+        Offset in channels, one for all the rows or one per row.
+        Offsets within `tol` of an integer are applied by slicing.
+        Otherwise, the two nearest channels are linearly interpolated.
+    
+    Returns
+    -------
+    shifted : array
+        Shifted spectra.
+    """
+    
+    values = np.atleast_2d(values)
+    nchan = values.shape[-1]
+    offset = np.broadcast_to(np.asarray(offset, dtype=float), values.shape[:1])
+    dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+    
+    def shift(vals, n):
+        out = np.full(vals.shape, np.nan, dtype=dtype)
+        if abs(n) < nchan:
+            if n >= 0:
+                out[...,:nchan-n] = vals[...,n:]
+            else:
+                out[...,-n:] = vals[...,:nchan+n]
+        return out
+    
+    shifted = np.empty(values.shape, dtype=dtype)
+    for off in np.unique(offset):
+        rows = offset == off
+        n = int(np.floor(off))
+        frac = off - n
+        if frac < tol or frac > 1. - tol:
+            shifted[rows] = shift(values[rows], int(np.rint(off)))
+        else:
+            shifted[rows] = (1. - frac)*shift(values[rows], n) + frac*shift(values[rows], n + 1)
+    
+    return shifted
+
+
 def ruze(lmbd, g0, surf_rms):
     """
     Ruze equation.